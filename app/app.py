@@ -5,9 +5,14 @@ from httphelper import \
     decode_auth_header, SessionMiddleware, EntityLinks, CorsMiddleware, \
     exclude_from_docs, encode_query_parameters
 from customjson import JSONHandler
+from identifier import user_id_generator, is_valid_id
 from errors import \
     PermissionsError, CompositeValidationError, EntityNotFoundError
+from summary import \
+    summary_deltas, build_summary, choose_bucket_seconds, bucket_range, \
+    BUCKET_SECONDS
 import datetime
+import math
 
 USER_URI_TEMPLATE = '/users/{user_id}'
 SOUND_URI_TEMPLATE = '/sounds/{sound_id}'
@@ -145,6 +150,11 @@ def list_entity(
     low_id = req.get_param('low_id')
     high_id = req.get_param('high_id')
     order = req.get_param('order')
+
+    for name, value in (('low_id', low_id), ('high_id', high_id)):
+        if value is not None and not is_valid_id(value):
+            raise falcon.HTTPBadRequest(
+                description=f'{name} must be a valid identifier')
     result_order = default_result_order
 
     orders = {
@@ -331,6 +341,172 @@ class SoundsResource(object):
             additional_params=additional_params)
 
 
+class SoundsBatchResource(object):
+    MAX_BATCH_SIZE = 500
+
+    def get_example_post_body(self):
+        return dict(sounds=[
+            dict(
+                info_url='https://archive.org/details/Greatest_Speeches_of_the_20th_Century',
+                audio_url='https://archive.org/download/Greatest_Speeches_of_the_20th_Century/AbdicationAddress.ogg',
+                license_type='https://creativecommons.org/licenses/by/4.0',
+                title='Abdication Address - King Edward VIII',
+                duration_seconds=(6 * 60) + 42,
+                tags=['speech']),
+            dict(
+                info_url='https://archive.org/details/Greatest_Speeches_of_the_20th_Century',
+                audio_url='https://archive.org/download/Greatest_Speeches_of_the_20th_Century/CheckersSpeech.ogg',
+                license_type='https://creativecommons.org/licenses/by/4.0',
+                title='Checkers Speech - Richard Nixon',
+                duration_seconds=(30 * 60) + 12,
+                tags=['speech'])
+        ])
+
+    def get_example_model(self, content_type):
+        return JSONHandler(AppEntityLinks()).serialize({
+            'items': [
+                {
+                    'status': 'created',
+                    'id': '65e2c94997d13b7b395dc7a600b3c',
+                    'uri': '/sounds/65e2c94997d13b7b395dc7a600b3c'
+                },
+                {
+                    'status': 'existing',
+                    'id': '65e2c94997d699f551823498b385b',
+                    'uri': '/sounds/65e2c94997d699f551823498b385b'
+                }
+            ]
+        }, content_type).decode()
+
+    @falcon.before(basic_auth)
+    def on_post(self, req, resp, session, actor):
+        """
+        description:
+            Create many sounds at once.  Sounds whose `audio_url` is already
+            registered are not created again; instead, the existing sound's
+            identifier is returned, so an interrupted import can simply
+            re-submit everything it has not yet seen confirmed.  Results are
+            returned in the same order as the submitted sounds.
+        example_request_body:
+            python: get_example_post_body
+        responses:
+            - status_code: 200
+              description: Each sound was either created or already existed
+              example:
+                python: get_example_model
+            - status_code: 400
+              description: Input model validation error
+            - status_code: 401
+              description: Unauthorized request
+            - status_code: 403
+              description: User is not permitted to create sounds
+        """
+        sounds_key = 'sounds'
+
+        sounds = req.media.get(sounds_key)
+        if not sounds:
+            error = ValueError(
+                'You must provide one or more sounds in field "sounds"')
+            raise CompositeValidationError((sounds_key, error))
+
+        if not isinstance(sounds, list):
+            error = ValueError(f'Field "{sounds_key}" must be a list')
+            raise CompositeValidationError((sounds_key, error))
+
+        if len(sounds) > self.MAX_BATCH_SIZE:
+            error = ValueError(
+                f'You may provide at most {self.MAX_BATCH_SIZE} sounds '
+                f'per request')
+            raise CompositeValidationError((sounds_key, error))
+
+        errors = []
+        for i, sound in enumerate(sounds):
+            key = f'{sounds_key}[{i}]'
+            if not isinstance(sound, dict):
+                error = ValueError('Each sound must be an object')
+                errors.append((key, error))
+                continue
+            audio_url = sound.get('audio_url')
+            if audio_url is not None and not isinstance(audio_url, str):
+                error = ValueError('audio_url must be a string')
+                errors.append((f'{key}.audio_url', error))
+        if errors:
+            raise CompositeValidationError(*errors)
+
+        audio_urls = {sound.get('audio_url') for sound in sounds}
+        audio_urls.discard(None)
+
+        # a single lookup resolves every sound that's already registered
+        existing = session.filter(
+            Sound.audio_url.one_of(audio_urls),
+            page_size=len(audio_urls),
+            total_count=False) if audio_urls else []
+        sound_ids = {sound.audio_url: sound.id for sound in existing}
+
+        items = []
+        for data in sounds:
+            audio_url = data.get('audio_url')
+            try:
+                sound_id = sound_ids[audio_url]
+                status = 'existing'
+            except KeyError:
+                data['created_by'] = actor
+                sound = Sound.create(creator=actor, **data)
+                sound_id = sound.id
+                status = 'created'
+                if audio_url is not None:
+                    # later duplicates within this batch refer to this sound
+                    sound_ids[audio_url] = sound_id
+
+            items.append({
+                'status': status,
+                'id': sound_id,
+                'uri': SOUND_URI_TEMPLATE.format(sound_id=sound_id)
+            })
+
+        resp.media = {'items': items}
+        resp.status = falcon.HTTP_OK
+
+    def on_conflict(self, req, resp, session):
+        """
+        Called by `SessionMiddleware` when a concurrent request registered
+        some of the same sounds first.  Sounds that were not written by this
+        request are reported as `existing`, pointing at the stored sound, as
+        are any later duplicates within the batch that referred to them
+        """
+        created = [
+            (data['audio_url'], item)
+            for data, item in zip(req.media['sounds'], resp.media['items'])
+            if item['status'] == 'created']
+        audio_urls = {audio_url for audio_url, _ in created}
+
+        stored = session.filter(
+            Sound.audio_url.one_of(audio_urls),
+            page_size=len(audio_urls),
+            total_count=False)
+        sound_ids = {sound.audio_url: sound.id for sound in stored}
+
+        replaced = {}
+        for audio_url, item in created:
+            try:
+                sound_id = sound_ids[audio_url]
+            except KeyError:
+                # the sound wasn't written for some other reason
+                raise falcon.HTTPConflict()
+            if sound_id != item['id']:
+                replaced[item['id']] = sound_id
+
+        for item in resp.media['items']:
+            try:
+                sound_id = replaced[item['id']]
+            except KeyError:
+                continue
+            item.update(
+                status='existing',
+                id=sound_id,
+                uri=SOUND_URI_TEMPLATE.format(sound_id=sound_id))
+
+
 def view_entity(session, actor, query, add_links=None):
     # TODO: There should be an option to exclude the total count here
     entity = session.find_one(query)
@@ -682,6 +858,150 @@ class SoundAnnotationsResource(object):
             additional_params=additional_params)
 
 
+class SoundAnnotationSummaryResource(object):
+    def __init__(self, annotations_repo):
+        super().__init__()
+        self.annotations_repo = annotations_repo
+
+    def get_example_model(self, content_type):
+        dataset = User.create(
+            user_name='HalIncandenza',
+            password='Halation',
+            email='hal@enfield.com',
+            user_type=UserType.DATASET,
+            about_me='Tennis 4 Life')
+
+        snd = Sound.create(
+            creator=dataset,
+            created_by=dataset,
+            info_url='https://example.com/sound',
+            audio_url='https://example.com/sound/file.wav',
+            low_quality_audio_url='https://example.com/sound/file.mp3',
+            license_type=LicenseType.BY,
+            title='A sound',
+            duration_seconds=12.3,
+            tags=['test'])
+
+        annotations = [
+            dict(
+                sound=snd.id,
+                created_by=dataset.id,
+                start_seconds=start,
+                end_seconds=start + 1,
+                tags=[tag])
+            for start, tag in ((1, 'kick'), (2, 'snare'), (5, 'kick'))]
+        deltas = summary_deltas(annotations)
+        bucket_seconds = 4
+        buckets = build_summary(
+            {bucket: delta for (_, bs, bucket), delta in deltas.items()
+             if bs == bucket_seconds},
+            bucket_seconds,
+            0,
+            snd.duration_seconds)
+        view = self._build_view(
+            snd, bucket_seconds, 0, snd.duration_seconds, buckets)
+        return JSONHandler(AppEntityLinks()) \
+            .serialize(view, content_type).decode()
+
+    @staticmethod
+    def _build_view(sound, bucket_seconds, start, end, buckets):
+        for bucket in buckets:
+            bucket['created_by'] = {
+                USER_URI_TEMPLATE.format(user_id=user_id): count
+                for user_id, count in bucket['created_by'].items()}
+        return {
+            'sound': sound,
+            'bucket_seconds': bucket_seconds,
+            'start_seconds': start,
+            'end_seconds': end,
+            'buckets': buckets
+        }
+
+    @falcon.before(basic_auth)
+    def on_get(self, req, resp, sound_id, session, actor):
+        """
+        description:
+            Get the number of annotations overlapping fixed-width time buckets
+            for the sound with id `sound_id`, broken down by creating user and
+            tag.  This is much cheaper than listing annotations when viewing
+            long stretches of a densely-annotated sound.
+        url_params:
+            sound_id: The sound to summarize annotations for
+        query_params:
+            time_range: Only summarize the specified time range, defaulting to
+                the entire sound
+            max_buckets: The maximum number of buckets to return, at most
+                4096, used to choose a resolution when `bucket_seconds` isn't
+                specified.  Requests spanning more buckets are rejected
+            bucket_seconds: The width of each bucket, in seconds.  Must be one
+                of 1, 4, 16, 64, 256 or 1024
+        responses:
+            - status_code: 200
+              description: Successfully fetched an annotation summary
+              example:
+                python: get_example_model
+            - status_code: 400
+              description: Invalid time range or bucket width
+            - status_code: 404
+              description: Provided an unknown sound identifier
+            - status_code: 401
+              description: Unauthorized request
+        """
+        sound = session.find_one(Sound.id == sound_id)
+
+        time_range = req.get_param('time_range')
+        if time_range is not None:
+            try:
+                start, end = time_range.split('-')
+                start = float(start)
+                end = float(end)
+            except ValueError:
+                raise falcon.HTTPBadRequest(
+                    description='Please specify time ranges as two '
+                    'dash-separated float values')
+            if not (math.isfinite(start) and math.isfinite(end)):
+                raise falcon.HTTPBadRequest(
+                    description='Time ranges must be finite')
+            if end < start:
+                raise falcon.HTTPBadRequest(
+                    description='Time ranges must not end before they start')
+            # there are no annotations beyond the sound itself
+            start = min(max(start, 0), sound.duration_seconds)
+            end = min(max(end, 0), sound.duration_seconds)
+        else:
+            start, end = 0, sound.duration_seconds
+
+        bucket_seconds = req.get_param_as_int('bucket_seconds')
+        max_buckets_limit = 4096
+        max_buckets = req.get_param_as_int('max_buckets')
+        if max_buckets is None:
+            max_buckets = \
+                256 if bucket_seconds is None else max_buckets_limit
+        if max_buckets < 1 or max_buckets > max_buckets_limit:
+            raise falcon.HTTPBadRequest(
+                description=f'max_buckets must be between 1 and '
+                f'{max_buckets_limit}')
+
+        if bucket_seconds is None:
+            bucket_seconds = choose_bucket_seconds(start, end, max_buckets)
+        elif bucket_seconds not in BUCKET_SECONDS:
+            raise falcon.HTTPBadRequest(
+                description=f'bucket_seconds must be one of {BUCKET_SECONDS}')
+
+        first, last = bucket_range(start, end, bucket_seconds)
+        if last - first + 1 > max_buckets:
+            raise falcon.HTTPBadRequest(
+                description=f'The time range spans more than {max_buckets} '
+                f'buckets of {bucket_seconds} seconds')
+
+        buckets = self.annotations_repo.summaries.summary(
+            sound_id, bucket_seconds, start, end)
+
+        resp.media = self._build_view(
+            sound, bucket_seconds, start, end, buckets)
+        resp.status = falcon.HTTP_OK
+
+
 class UserSoundsResource(object):
     def link_template(self, user_id):
         return f'/users/{user_id}/sounds?{{encoded_params}}'
@@ -883,6 +1203,128 @@ class UserAnnotationResource(object):
             additional_params=additional_params)
 
 
+class UserAnnotationsBySoundResource(object):
+    def link_template(self, user_id):
+        return f'/users/{user_id}/annotations/by_sound?{{encoded_params}}'
+
+    @staticmethod
+    def _build_view(groups, total_count, next_link):
+        items = [
+            {
+                'sound': group['sound'],
+                'count': group['count'],
+                'start_seconds': group['min_start_seconds'],
+                'end_seconds': group['max_end_seconds']
+            }
+            for group in groups]
+        result = dict(items=items, total_count=total_count)
+        if next_link:
+            result['next'] = next_link
+        return result
+
+    def get_model_example(self, content_type):
+        featurebot = User.create(
+            user_name='FFTBot',
+            password='password',
+            email='fftbot@gmail.com',
+            user_type=UserType.FEATUREBOT,
+            about_me='I compute FFT features')
+
+        sounds = [Sound.partial_hydrate(id=user_id_generator(None))
+                  for _ in range(2)]
+        groups = [
+            {
+                'sound': sounds[0],
+                'count': 1,
+                'min_start_seconds': 0,
+                'max_end_seconds': 12.3
+            },
+            {
+                'sound': sounds[1],
+                'count': 1,
+                'min_start_seconds': 0,
+                'max_end_seconds': 30.4
+            }
+        ]
+        encoded_params = encode_query_parameters(page_size=2, page_number=1)
+        view = self._build_view(
+            groups,
+            total_count=100,
+            next_link=self.link_template(featurebot.id).format(
+                encoded_params=encoded_params))
+        return JSONHandler(AppEntityLinks()) \
+            .serialize(view, content_type).decode()
+
+    @falcon.before(basic_auth)
+    def on_get(self, req, resp, user_id, session, actor):
+        """
+        description:
+            List the sounds annotated by the user with id `user_id`, along
+            with the number of annotations for each sound and the time range
+            they span.  This is far cheaper than paging through every
+            annotation the user has created.
+        url_params:
+            user_id: The user who created the annotations
+        query_params:
+            page_size: The number of results per page
+            page_number: The current page
+            tags: Only consider annotations with all specified tags
+        responses:
+            - status_code: 200
+              description: Successfully fetched a list of annotated sounds
+              example:
+                python: get_model_example
+            - status_code: 404
+              description: Provided an unknown user identifier
+            - status_code: 401
+              description: Unauthorized request
+        """
+        page_size = req.get_param_as_int('page_size') or 100
+        page_number = req.get_param_as_int('page_number') or 0
+
+        page_size_min = 1
+        page_size_max = 500
+
+        if page_size < page_size_min or page_size > page_size_max:
+            raise falcon.HTTPBadRequest(
+                f'Page size must be between '
+                f'{page_size_min} and {page_size_max}')
+
+        user = session.find_one(User.id == user_id)
+        query = Annotation.created_by == user
+
+        additional_params = {}
+        tags = req.get_param_as_list('tags')
+        if tags:
+            additional_params['tags'] = tags
+            for tag in tags:
+                query = query & (Annotation.tags == tag)
+
+        query_result = session.group(
+            query,
+            Annotation.sound,
+            min_of=(Annotation.start_seconds,),
+            max_of=(Annotation.end_seconds,),
+            page_size=page_size,
+            page_number=page_number)
+
+        next_link = None
+        if query_result.next_page is not None:
+            encoded_params = encode_query_parameters(
+                page_size=page_size,
+                page_number=query_result.next_page,
+                **additional_params)
+            next_link = self.link_template(user_id).format(
+                encoded_params=encoded_params)
+
+        view = self._build_view(
+            query_result.results, query_result.total_count, next_link)
+        view['query_time'] = query_result.query_time
+        view['transform_time'] = query_result.result_transform_time
+        resp.media = view
+        resp.status = falcon.HTTP_OK
+
+
 class UsersResource(object):
     def __init__(self, email_whitelist):
         super().__init__()
@@ -1305,11 +1747,18 @@ class Application(falcon.API):
         self.add_route('/users', UsersResource(email_whitelist))
         self.add_route(USER_URI_TEMPLATE, UserResource())
         self.add_route('/sounds', SoundsResource())
+        self.add_route('/sounds/batch', SoundsBatchResource())
         self.add_route(SOUND_URI_TEMPLATE, SoundResource())
         self.add_route(
             '/sounds/{sound_id}/annotations', SoundAnnotationsResource())
+        self.add_route(
+            '/sounds/{sound_id}/annotations/summary',
+            SoundAnnotationSummaryResource(annotations_repo))
         self.add_route('/users/{user_id}/sounds', UserSoundsResource())
         self.add_route('/users/{user_id}/annotations', UserAnnotationResource())
+        self.add_route(
+            '/users/{user_id}/annotations/by_sound',
+            UserAnnotationsBySoundResource())
         self.add_route('/annotations', AnnotationsResource())
 
         self.add_error_handler(PermissionsError, permissions_error)
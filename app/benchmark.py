@@ -0,0 +1,149 @@
+"""
+Benchmarks that exercise the data layer against a real MongoDB instance, e.g.
+
+python benchmark.py --connection-string mongodb://localhost:27017 ingest
+python benchmark.py --connection-string mongodb://localhost:27017 ids
+"""
+import argparse
+import time
+from pymongo import MongoClient
+from model import User, UserType, Sound, Annotation, LicenseType
+from data import AnnotationRepository
+from identifier import user_id_generator, encode_id
+
+
+def timed(f, *args, **kwargs):
+    start = time.time()
+    f(*args, **kwargs)
+    return time.time() - start
+
+
+def annotation_updates(n_annotations):
+    """
+    Build the flattened updates a session would produce for a batch of freshly
+    created annotations
+    """
+    user = User.create(
+        user_name='benchmark',
+        password='password',
+        email='benchmark@example.com',
+        user_type=UserType.DATASET,
+        about_me='I exist to be timed')
+    snd = Sound.create(
+        creator=user,
+        created_by=user,
+        info_url='https://example.com/sound',
+        audio_url='https://example.com/sound/file.wav',
+        license_type=LicenseType.BY,
+        title='A sound',
+        duration_seconds=n_annotations)
+
+    for i in range(n_annotations):
+        annotation = Annotation.create(
+            creator=user,
+            created_by=user,
+            sound=snd,
+            start_seconds=i,
+            duration_seconds=1,
+            tags=['benchmark'])
+        flattened = {
+            field.name: (field, value)
+            for _, field, value in annotation.events}
+        yield annotation.identity_query, flattened
+
+
+def ingest(db, n_annotations, batch_size):
+    """
+    Compare the legacy upsert write path for new entities with the insert-only
+    write path now used by Session.close
+    """
+    updates = list(annotation_updates(n_annotations))
+    batches = [
+        updates[i: i + batch_size]
+        for i in range(0, len(updates), batch_size)]
+
+    upsert_repo = AnnotationRepository(db.benchmark_upsert)
+    insert_repo = AnnotationRepository(db.benchmark_insert)
+
+    for repo in (upsert_repo, insert_repo):
+        repo.delete_all()
+
+    try:
+        upsert_time = sum(
+            timed(upsert_repo.upsert, *batch) for batch in batches)
+        insert_time = sum(
+            timed(insert_repo.insert, *(update for _, update in batch))
+            for batch in batches)
+    finally:
+        db.drop_collection(db.benchmark_upsert)
+        db.drop_collection(db.benchmark_insert)
+
+    print(f'ingested {n_annotations} annotations in batches of {batch_size}')
+    print(f'upsert: {upsert_time:.3f}s ({n_annotations / upsert_time:.0f}/s)')
+    print(f'insert: {insert_time:.3f}s ({n_annotations / insert_time:.0f}/s)')
+
+
+def ids(db, n_documents, n_scans, batch_size=1000):
+    """
+    Compare index size and range-scan speed for identifiers stored as
+    hexadecimal strings and as compact binary values
+    """
+    hex_ids = [user_id_generator(None) for _ in range(n_documents)]
+    collections = {
+        'string': (db.benchmark_string_ids, hex_ids),
+        'binary': (db.benchmark_binary_ids, [encode_id(i) for i in hex_ids])
+    }
+
+    try:
+        for name, (collection, _ids) in collections.items():
+            collection.drop()
+            for i in range(0, len(_ids), batch_size):
+                collection.insert_many(
+                    [{'_id': _id} for _id in _ids[i: i + batch_size]],
+                    ordered=False)
+
+            stats = db.command('collstats', collection.name)
+            index_size = stats['indexSizes']['_id_']
+
+            step = max(1, len(_ids) // n_scans)
+            low_ids = _ids[::step][:n_scans]
+
+            def scan():
+                for low_id in low_ids:
+                    list(collection
+                         .find({'_id': {'$gt': low_id}}, sort=[('_id', 1)])
+                         .limit(100))
+
+            scan_time = timed(scan)
+            print(
+                f'{name}: _id index {index_size / 1024:.1f}KB, '
+                f'{len(low_ids)} range scans in {scan_time:.3f}s')
+    finally:
+        for collection, _ in collections.values():
+            collection.drop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--connection-string',
+        default='mongodb://localhost:27017')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    ingest_parser = subparsers.add_parser('ingest')
+    ingest_parser.add_argument('--annotations', type=int, default=100000)
+    ingest_parser.add_argument('--batch-size', type=int, default=500)
+
+    ids_parser = subparsers.add_parser('ids')
+    ids_parser.add_argument('--documents', type=int, default=1000000)
+    ids_parser.add_argument('--scans', type=int, default=1000)
+
+    args = parser.parse_args()
+    db = MongoClient(args.connection_string).annotate_benchmark
+
+    if args.benchmark == 'ingest':
+        ingest(db, args.annotations, args.batch_size)
+    elif args.benchmark == 'ids':
+        ids(db, args.documents, args.scans)
+    else:
+        parser.print_help()
@@ -2,6 +2,7 @@ import json
 import datetime
 from falcon.media import BaseHandler
 from enum import Enum
+from identifier import decode_id
 
 
 class JsonEncoder(json.JSONEncoder):
@@ -19,6 +20,9 @@ class JsonEncoder(json.JSONEncoder):
             return o.isoformat() + 'Z'
         elif isinstance(o, Enum):
             return o.value
+        elif isinstance(o, bytes):
+            # any identifier that escaped conversion by its repository
+            return decode_id(o)
         else:
             return super().default(o)
 
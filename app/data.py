@@ -1,11 +1,17 @@
-from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING, UpdateOne
+from pymongo import \
+    MongoClient, IndexModel, ASCENDING, DESCENDING, UpdateOne, InsertOne
 from pymongo.errors import BulkWriteError
 from scratch import \
     NoCriteria, BaseMapper, BaseMapping, QueryResult, BaseRepository, Query, \
     SortOrder
 from model import User, UserType, Sound, Annotation
 from errors import DuplicateEntityException
-from mapping import UserMapper, SoundMapper, AnnotationMapper
+from mapping import \
+    UserMapper, SoundMapper, AnnotationMapper, identifier_fields
+from identifier import encode_id, decode_id
+from summary import \
+    summary_deltas, summary_checkpoints, build_summary, bucket_range, \
+    checkpoint, SummaryDelta, CHECKPOINT_BUCKETS
 import time
 
 # TODO: Does BaseRepository need cls and mapper arguments anymore?
@@ -18,7 +24,8 @@ class MongoRepository(BaseRepository):
         Query.GREATER_THAN: '$gt',
         Query.GREATER_THAN_OR_EQUAL_TO: '$gte',
         Query.LESS_THAN: '$lt',
-        Query.LESS_THAN_OR_EQUAL_TO: '$lte'
+        Query.LESS_THAN_OR_EQUAL_TO: '$lte',
+        Query.IN: '$in'
     }
 
     BOOLEAN_OPS = {Query.AND, Query.OR}
@@ -36,9 +43,24 @@ class MongoRepository(BaseRepository):
         SortOrder.DESCENDING: DESCENDING
     }
 
-    def __init__(self, cls, mapper, collection):
+    def __init__(self, cls, mapper, collection, writer=None):
         super().__init__(cls, mapper)
         self.collection = collection
+        self.writer = writer
+
+        # identifiers are exposed as hexadecimal strings, but are stored in a
+        # compact binary form to keep indexes small
+        self.identifier_fields = identifier_fields(mapper)
+
+    def _to_mongo_document(self, storage_data):
+        return {
+            key: encode_id(value) if key in self.identifier_fields else value
+            for key, value in storage_data.items()}
+
+    def _from_mongo_document(self, document):
+        return {
+            key: decode_id(value) if key in self.identifier_fields else value
+            for key, value in document.items()}
 
     def _transform_query(self, query):
         if isinstance(query, NoCriteria):
@@ -58,10 +80,21 @@ class MongoRepository(BaseRepository):
                 else:
                     conditions.append(criterion)
             return {mongo_op: conditions}
+        elif query.op == Query.IN:
+            storage_data = self.mapper.storage_data(query.field)
+            storage_name = storage_data.storage_name
+            storage_values = [
+                storage_data.to_storage_format(value)
+                for value in query.literal_value]
+            if storage_name in self.identifier_fields:
+                storage_values = [encode_id(value) for value in storage_values]
+            return {storage_name: {mongo_op: storage_values}}
         elif query.op in MongoRepository.COMPARISON_OPS:
             storage_data = self.mapper.storage_data(query.field)
             storage_name = storage_data.storage_name
             storage_value = storage_data.to_storage_format(query.literal_value)
+            if storage_name in self.identifier_fields:
+                storage_value = encode_id(storage_value)
             return {storage_name: {mongo_op: storage_value}}
         else:
             raise ValueError(f'Op "{query.op}" is not currently supported')
@@ -81,20 +114,55 @@ class MongoRepository(BaseRepository):
         # underlying storage format before passing along here?
         mongo_updates = []
         for query, update in updates:
-            storage_updates = self.mapper.transform_updates(update.values())
+            storage_updates = self._to_mongo_document(
+                self.mapper.transform_updates(update.values()))
             mongo_update = UpdateOne(
                 self._transform_query(query),
                 {'$set': storage_updates},
                 upsert=True)
             mongo_updates.append(mongo_update)
         try:
-            self.collection.bulk_write(mongo_updates, ordered=False)
+            if self.writer:
+                self.writer.write(self.collection, mongo_updates)
+            else:
+                self.collection.bulk_write(mongo_updates, ordered=False)
         except BulkWriteError as e:
-            write_errors = e.details['writeErrors']
-            if any('duplicate' in we['errmsg'] for we in write_errors):
-                raise DuplicateEntityException(self.cls)
+            self._raise_for_write_errors(e)
+
+    def insert(self, *inserts):
+        documents = [
+            self._to_mongo_document(
+                self.mapper.transform_updates(insert.values()))
+            for insert in inserts]
+        try:
+            if self.writer:
+                self.writer.write(
+                    self.collection, [InsertOne(doc) for doc in documents])
             else:
-                raise
+                self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # writes are unordered, so everything but the failed documents
+            # was written
+            failed = {we['index'] for we in e.details['writeErrors']}
+            self._inserted(
+                [doc for i, doc in enumerate(documents) if i not in failed])
+            self._raise_for_write_errors(e)
+        self._inserted(documents)
+        return documents
+
+    def _inserted(self, documents):
+        """
+        Called with the documents written by each call to `insert`, even when
+        some of the batch could not be written
+        """
+        pass
+
+    def _raise_for_write_errors(self, e):
+        write_errors = e.details['writeErrors']
+        if any('duplicate' in we['errmsg'] for we in write_errors):
+            raise DuplicateEntityException(self.cls)
+        else:
+            raise
 
     def filter(
             self,
@@ -114,7 +182,7 @@ class MongoRepository(BaseRepository):
             .skip(page_number * page_size) \
             .limit(page_size)
         total_count = results.count() if total_count else None
-        results = list(results)
+        results = [self._from_mongo_document(r) for r in results]
 
         stop = time.time() - start
         result = QueryResult(results, page_number, page_size, total_count)
@@ -123,6 +191,68 @@ class MongoRepository(BaseRepository):
         result.query = mongo_query
         return result
 
+    def group(
+            self,
+            query,
+            group_by,
+            min_of=(),
+            max_of=(),
+            page_size=100,
+            page_number=0):
+
+        mongo_query = self._transform_query(query)
+        group_name = self.mapper.storage_data(group_by).storage_name
+
+        group_stage = {'_id': f'${group_name}', 'count': {'$sum': 1}}
+
+        # keep track of which outputs hold identifiers, which need to be
+        # converted back from their binary form
+        identifier_outputs = set()
+        if group_name in self.identifier_fields:
+            identifier_outputs.add('_id')
+
+        for op, fields in (('min', min_of), ('max', max_of)):
+            for field in fields:
+                storage_name = self.mapper.storage_data(field).storage_name
+                output_name = f'{op}_{storage_name}'
+                group_stage[output_name] = {f'${op}': f'${storage_name}'}
+                if storage_name in self.identifier_fields:
+                    identifier_outputs.add(output_name)
+
+        pipeline = [
+            {'$match': mongo_query},
+            {'$group': group_stage},
+            {'$facet': {
+                'results': [
+                    {'$sort': {'_id': ASCENDING}},
+                    {'$skip': page_number * page_size},
+                    {'$limit': page_size}
+                ],
+                'total_count': [{'$count': 'count'}]
+            }}
+        ]
+
+        start = time.time()
+        facets = next(self.collection.aggregate(pipeline, allowDiskUse=True))
+
+        results = [
+            {
+                key: decode_id(value) if key in identifier_outputs else value
+                for key, value in result.items()
+            }
+            for result in facets['results']]
+
+        try:
+            total_count = facets['total_count'][0]['count']
+        except IndexError:
+            total_count = 0
+
+        stop = time.time() - start
+        result = QueryResult(results, page_number, page_size, total_count)
+        result.inner_query = stop
+        result.query = pipeline
+        return result
+
     def _count(self, mongo_query):
         return self.collection.count_documents(mongo_query)
 
@@ -138,21 +268,149 @@ class MongoRepository(BaseRepository):
 
 
 class UserRepository(MongoRepository):
-    def __init__(self, collection):
-        super().__init__(User, UserMapper, collection)
+    def __init__(self, collection, writer=None):
+        super().__init__(User, UserMapper, collection, writer)
 
 
 class SoundRepository(MongoRepository):
-    def __init__(self, collection):
-        super().__init__(Sound, SoundMapper, collection)
+    def __init__(self, collection, writer=None):
+        super().__init__(Sound, SoundMapper, collection, writer)
+
+
+class AnnotationSummaryRepository(object):
+    """
+    Stores the per-bucket deltas that make up multi-resolution annotation
+    summaries for each sound, along with periodic checkpoints of their
+    running sums.  See summary.py for details
+    """
+
+    def __init__(self, collection, checkpoints):
+        super().__init__()
+        self.collection = collection
+        self.checkpoints = checkpoints
+
+    @staticmethod
+    def _escape_key(key):
+        # tags are used as field names, which may not contain dots or begin
+        # with a dollar sign
+        return key.replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+    @staticmethod
+    def _unescape_key(key):
+        return key.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+    def update(self, annotation_documents):
+        annotations = [
+            {
+                'sound': doc[AnnotationMapper.sound_id.storage_name],
+                'created_by': decode_id(
+                    doc[AnnotationMapper.created_by.storage_name]),
+                'start_seconds':
+                    doc[AnnotationMapper.start_seconds.storage_name],
+                'end_seconds': doc[AnnotationMapper.end_seconds.storage_name],
+                'tags': doc.get(AnnotationMapper.tags.storage_name)
+            }
+            for doc in annotation_documents]
+
+        self._increment(self.collection, 'bucket', summary_deltas(annotations))
+        self._increment(
+            self.checkpoints, 'checkpoint', summary_checkpoints(annotations))
+
+    def _increment(self, collection, key_name, deltas):
+        mongo_updates = []
+        for (sound, bucket_seconds, key), delta in deltas.items():
+            increments = {'count': delta.count}
+            for user_id, n in delta.created_by.items():
+                increments[f'created_by.{user_id}'] = n
+            for tag, n in delta.tags.items():
+                increments[f'tags.{self._escape_key(tag)}'] = n
+            mongo_updates.append(UpdateOne(
+                {
+                    'sound_id': sound,
+                    'bucket_seconds': bucket_seconds,
+                    key_name: key
+                },
+                {'$inc': increments},
+                upsert=True))
+
+        if mongo_updates:
+            collection.bulk_write(mongo_updates, ordered=False)
+
+    def _to_delta(self, doc):
+        delta = SummaryDelta()
+        delta.count = doc.get('count', 0)
+        delta.created_by.update(doc.get('created_by', {}))
+        delta.tags.update({
+            self._unescape_key(k): v
+            for k, v in doc.get('tags', {}).items()})
+        return delta
+
+    def summary(self, sound_id, bucket_seconds, start_seconds, end_seconds):
+        first, last = bucket_range(start_seconds, end_seconds, bucket_seconds)
+        sound_id = encode_id(sound_id)
+
+        k = checkpoint(first)
+        prefix = None
+        if k:
+            doc = self.checkpoints.find_one({
+                'sound_id': sound_id,
+                'bucket_seconds': bucket_seconds,
+                'checkpoint': k
+            })
+            if doc is not None:
+                prefix = self._to_delta(doc)
+
+        documents = self.collection.find({
+            'sound_id': sound_id,
+            'bucket_seconds': bucket_seconds,
+            'bucket': {'$gte': k * CHECKPOINT_BUCKETS, '$lte': last}
+        })
+        deltas = {doc['bucket']: self._to_delta(doc) for doc in documents}
+
+        return build_summary(
+            deltas, bucket_seconds, start_seconds, end_seconds, prefix)
+
+    def delete_all(self):
+        self.checkpoints.delete_many({})
+        return self.collection.delete_many({})
 
 
 class AnnotationRepository(MongoRepository):
-    def __init__(self, collection):
-        super().__init__(Annotation, AnnotationMapper, collection)
+    def __init__(self, collection, writer=None, summaries=None):
+        super().__init__(Annotation, AnnotationMapper, collection, writer)
+        self.summaries = summaries
 
+    def _inserted(self, documents):
+        if self.summaries is not None and documents:
+            # annotations are immutable, so summaries only need to be
+            # maintained as new annotations are created
+            self.summaries.update(documents)
 
-def build_repositories(connection_string):
+    def delete_all(self):
+        if self.summaries is not None:
+            self.summaries.delete_all()
+        return super().delete_all()
+
+
+def create_summary_indexes(summaries, checkpoints):
+    summaries.create_indexes([
+        IndexModel([
+            ('sound_id', ASCENDING),
+            ('bucket_seconds', ASCENDING),
+            ('bucket', ASCENDING)
+        ], name='sound_bucket', unique=True)
+    ])
+
+    checkpoints.create_indexes([
+        IndexModel([
+            ('sound_id', ASCENDING),
+            ('bucket_seconds', ASCENDING),
+            ('checkpoint', ASCENDING)
+        ], name='sound_checkpoint', unique=True)
+    ])
+
+
+def build_repositories(connection_string, writer=None):
     client = MongoClient(connection_string)
     db = client.annotate
 
@@ -188,12 +446,18 @@ def build_repositories(connection_string):
 
     ])
 
+    create_summary_indexes(
+        db.annotation_summaries, db.annotation_summary_checkpoints)
+
     users_db = db.users
     sounds_db = db.sounds
     annotations_db = db.annotations
 
-    users_repo = UserRepository(users_db)
-    sounds_repo = SoundRepository(sounds_db)
-    annotations_repo = AnnotationRepository(annotations_db)
+    users_repo = UserRepository(users_db, writer)
+    sounds_repo = SoundRepository(sounds_db, writer)
+    summaries_repo = AnnotationSummaryRepository(
+        db.annotation_summaries, db.annotation_summary_checkpoints)
+    annotations_repo = AnnotationRepository(
+        annotations_db, writer, summaries_repo)
 
     return users_repo, sounds_repo, annotations_repo
@@ -1,12 +1,18 @@
 from app import Application
 from data import build_repositories
+from groupcommit import GroupCommitWriter
 import os
 
 connection_string = os.environ['connection_string']
 email_whitelist = os.environ['email_whitelist']
 
+# group commit is opt-in, and only helps when requests are handled
+# concurrently within a single process, e.g. gunicorn's --threads option
+writer = \
+    GroupCommitWriter() if os.environ.get('group_commit') else None
+
 users_repo, sounds_repo, annotations_repo = \
-    build_repositories(connection_string)
+    build_repositories(connection_string, writer)
 
 api = application = Application(
     users_repo,
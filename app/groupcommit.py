@@ -0,0 +1,133 @@
+import threading
+import queue
+import time
+from collections import defaultdict
+from pymongo.errors import BulkWriteError
+
+
+class PendingWrite(object):
+    """
+    A batch of write operations submitted by a single session, which will be
+    committed alongside writes from other sessions
+    """
+
+    def __init__(self, collection, operations):
+        super().__init__()
+        self.collection = collection
+        self.operations = operations
+        self.write_errors = []
+        self.exception = None
+        self._done = threading.Event()
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _complete(self, exception=None):
+        self.exception = exception
+        self._done.set()
+
+    def result(self, timeout=None):
+        """
+        Block until the operations have been committed, raising any errors
+        attributable to *this* batch of operations only
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('Timed out waiting for group commit')
+
+        if self.exception is not None:
+            raise self.exception
+
+        if self.write_errors:
+            raise BulkWriteError({
+                'writeErrors': self.write_errors,
+                'writeConcernErrors': [],
+                'nInserted': 0,
+                'nUpserted': 0,
+                'nMatched': 0,
+                'nModified': 0,
+                'nRemoved': 0,
+                'upserted': []
+            })
+
+
+class GroupCommitWriter(threading.Thread):
+    """
+    Collect write operations from concurrent sessions for up to
+    `max_delay_seconds` (or until `max_batch_size` operations are waiting) and
+    issue a single unordered `bulk_write` per collection.
+
+    Errors reported by MongoDB are mapped back to the session that submitted
+    the offending operation, so duplicate detection still works per-request.
+    Note that this only pays off when a process handles requests concurrently,
+    e.g. when gunicorn is run with `--threads`
+    """
+
+    def __init__(self, max_delay_seconds=0.005, max_batch_size=1000):
+        super().__init__(daemon=True)
+        self.max_batch_size = max_batch_size
+        self.max_delay_seconds = max_delay_seconds
+        self._queue = queue.Queue()
+        self.start()
+
+    def submit(self, collection, operations):
+        pending = PendingWrite(collection, operations)
+        self._queue.put(pending)
+        return pending
+
+    def write(self, collection, operations):
+        return self.submit(collection, operations).result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        n_operations = len(batch[0])
+        deadline = time.time() + self.max_delay_seconds
+
+        while n_operations < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            n_operations += len(pending)
+
+        return batch
+
+    @staticmethod
+    def _flush(collection, batch):
+        operations = []
+        owners = []
+        for pending in batch:
+            for i, operation in enumerate(pending.operations):
+                operations.append(operation)
+                owners.append((pending, i))
+
+        try:
+            collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # attribute each error to the session that caused it, re-numbering
+            # the operation index so it's relative to that session's batch
+            for write_error in e.details['writeErrors']:
+                pending, index = owners[write_error['index']]
+                pending.write_errors.append(dict(write_error, index=index))
+        except Exception as e:
+            for pending in batch:
+                pending._complete(e)
+            return
+
+        for pending in batch:
+            pending._complete()
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+
+            by_collection = defaultdict(list)
+            for pending in batch:
+                by_collection[pending.collection.full_name].append(pending)
+
+            for pending_writes in by_collection.values():
+                collection = pending_writes[0].collection
+                self._flush(collection, pending_writes)
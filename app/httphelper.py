@@ -79,8 +79,20 @@ class SessionMiddleware(object):
             if isinstance(e, DuplicateEntityException):
                 entity_cls = e.entity_cls
 
-                with self._session() as session:
+                if hasattr(resource, 'on_conflict'):
+                    # the resource can describe the outcome itself, e.g. for
+                    # batch requests that don't describe a single entity
+                    with self._session() as session:
+                        resource.on_conflict(req, resp, session)
+                    return
+
+                try:
                     query = entity_cls.exists_query(**req.media)
+                except TypeError:
+                    # there's no one location to point to
+                    raise falcon.HTTPConflict()
+
+                with self._session() as session:
                     entity = session.find_one(query)
                     uri = self.link_converter.convert_to_link(entity)
                     resp.set_header('Location', uri)
@@ -1,17 +1,99 @@
 import time
 import os
 import binascii
+import threading
+import string
+
+RANDOM_BYTES = 8
+TIME_BYTES = 8
+HEX_DIGITS = set(string.hexdigits)
 
 
 class UserIdGenerator(object):
+    """
+    Produce identifiers consisting of a microsecond timestamp followed by
+    random bits.  Timestamps never repeat or move backward within a process,
+    so identifiers created later always sort after those created earlier.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._last_time = 0
+
+    def _next_time(self):
+        with self._lock:
+            self._last_time = max(int(time.time() * 1e6), self._last_time + 1)
+            return self._last_time
+
     def __call__(self, instance):
-        time_bits = '{:x}'.format(int(time.time() * 1e6))
-        random_bits = binascii.hexlify(os.urandom(8)).decode()
+        time_bits = '{:x}'.format(self._next_time())
+        random_bits = binascii.hexlify(os.urandom(RANDOM_BYTES)).decode()
         identifier = time_bits + random_bits
         return identifier
 
+
 user_id_generator = UserIdGenerator()
 
+
+def _encode(identifier):
+    if not isinstance(identifier, str) \
+            or len(identifier) <= RANDOM_BYTES * 2 \
+            or not set(identifier) <= HEX_DIGITS:
+        raise ValueError(f'{identifier!r} is not a valid identifier')
+
+    time_bits = int(identifier[:-RANDOM_BYTES * 2], 16)
+    random_bits = bytes.fromhex(identifier[-RANDOM_BYTES * 2:])
+    try:
+        return time_bits.to_bytes(TIME_BYTES, 'big') + random_bits
+    except OverflowError:
+        raise ValueError(f'{identifier!r} is not a valid identifier')
+
+
+def is_valid_id(identifier):
+    """
+    Return True if `identifier` is in the external, hexadecimal form
+    """
+    try:
+        _encode(identifier)
+        return True
+    except ValueError:
+        return False
+
+
+def encode_id(identifier):
+    """
+    Convert the external, hexadecimal form of an identifier into its compact,
+    16-byte binary form.  Values that aren't valid identifiers are returned
+    unchanged, so equality lookups simply never match a stored identifier.
+    Range bounds should be checked with `is_valid_id` first, since a string
+    bound never compares against binary identifiers
+    """
+    if isinstance(identifier, bytes):
+        return identifier
+
+    try:
+        return _encode(identifier)
+    except ValueError:
+        return identifier
+
+
+def decode_id(identifier):
+    """
+    Convert the compact binary form of an identifier back into its
+    external, hexadecimal form
+    """
+    if not isinstance(identifier, bytes):
+        return identifier
+
+    time_bits = int.from_bytes(identifier[:TIME_BYTES], 'big')
+    random_bits = binascii.hexlify(identifier[TIME_BYTES:]).decode()
+    return '{:x}'.format(time_bits) + random_bits
+
+
 __all__ = [
-    user_id_generator
-]
\ No newline at end of file
+    user_id_generator,
+    is_valid_id,
+    encode_id,
+    decode_id
+]
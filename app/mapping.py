@@ -12,7 +12,24 @@ class EnumMapping(BaseMapping):
             **kwargs)
 
 
-class EntityMapping(BaseMapping):
+class IdentifierMapping(BaseMapping):
+    """
+    Marks a field whose values are entity identifiers, which storage backends
+    may choose to store in a more compact form
+    """
+    pass
+
+
+def identifier_fields(mapper):
+    """
+    Return the storage names of all fields holding identifiers
+    """
+    return {
+        key for key, mapping in mapper._mapped_fields.items()
+        if isinstance(mapping, IdentifierMapping)}
+
+
+class EntityMapping(IdentifierMapping):
     def __init__(self, field, entity_class, *args, **kwargs):
         self.entity_class = entity_class
         super().__init__(
@@ -33,7 +50,7 @@ class UserMapper(BaseMapper):
     # TODO: Better, more formal way to specify mapper's target class than this
     entity_class = User
 
-    _id = BaseMapping(User.id)
+    _id = IdentifierMapping(User.id)
     date_created = BaseMapping(User.date_created)
     deleted = BaseMapping(User.deleted)
     user_name = BaseMapping(User.user_name)
@@ -47,7 +64,7 @@ class UserMapper(BaseMapper):
 class SoundMapper(BaseMapper):
     entity_class = Sound
 
-    _id = BaseMapping(Sound.id)
+    _id = IdentifierMapping(Sound.id)
     date_created = BaseMapping(Sound.date_created)
     created_by = EntityMapping(Sound.created_by, User)
     created_by_user_name = BaseMapping(Sound.created_by_user_name)
@@ -63,7 +80,7 @@ class SoundMapper(BaseMapper):
 class AnnotationMapper(BaseMapper):
     entity_class = Annotation
 
-    _id = BaseMapping(Annotation.id)
+    _id = IdentifierMapping(Annotation.id)
     date_created = BaseMapping(Annotation.date_created)
     created_by = EntityMapping(Annotation.created_by, User)
     created_by_user_name = BaseMapping(Sound.created_by_user_name)
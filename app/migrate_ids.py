@@ -0,0 +1,71 @@
+"""
+Convert identifiers stored as hexadecimal strings into their compact binary
+form, e.g.
+
+python migrate_ids.py --connection-string mongodb://localhost:27017
+
+Each collection is copied into a temporary collection with converted
+identifiers, which then atomically replaces the original.  The application
+should be stopped while this runs, and restarted afterward so that indexes are
+rebuilt by `build_repositories`.  Re-running the migration is harmless.
+"""
+import argparse
+from pymongo import MongoClient, InsertOne
+from identifier import encode_id
+from mapping import \
+    UserMapper, SoundMapper, AnnotationMapper, identifier_fields
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAPPERS = {
+    'users': UserMapper,
+    'sounds': SoundMapper,
+    'annotations': AnnotationMapper
+}
+
+
+def migrate_collection(db, name, mapper, batch_size=1000):
+    collection = db[name]
+    temp_name = f'{name}_binary_ids'
+    db.drop_collection(temp_name)
+    temp = db[temp_name]
+
+    fields = identifier_fields(mapper)
+    batch = []
+    n_documents = 0
+
+    for document in collection.find():
+        for field in fields & set(document.keys()):
+            document[field] = encode_id(document[field])
+        batch.append(InsertOne(document))
+        if len(batch) >= batch_size:
+            temp.bulk_write(batch, ordered=False)
+            n_documents += len(batch)
+            batch = []
+            logger.info(f'Migrated {n_documents} documents in {name}')
+
+    if batch:
+        temp.bulk_write(batch, ordered=False)
+        n_documents += len(batch)
+
+    if n_documents:
+        temp.rename(name, dropTarget=True)
+    logger.info(f'Finished migrating {n_documents} documents in {name}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--connection-string',
+        default='mongodb://localhost:27017')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000)
+    args = parser.parse_args()
+
+    db = MongoClient(args.connection_string).annotate
+    for collection_name, mapper in MAPPERS.items():
+        migrate_collection(db, collection_name, mapper, args.batch_size)
@@ -0,0 +1,79 @@
+"""
+Rebuild annotation summaries and their checkpoints from every stored
+annotation, e.g.
+
+python rebuild_summaries.py --connection-string mongodb://localhost:27017
+
+Summaries are only maintained as annotations are created, so this backfills
+them for annotations created before summaries existed, or repairs them after
+they've drifted.  They're rebuilt into temporary collections, which then
+replace the originals, so summaries are unchanged if the rebuild fails.  The
+application should be stopped while this runs, since annotations created
+during the rebuild may be left out.  Re-running the rebuild is harmless.
+"""
+import argparse
+from pymongo import MongoClient, ASCENDING
+from data import AnnotationSummaryRepository, create_summary_indexes
+from mapping import AnnotationMapper
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FIELDS = (
+    AnnotationMapper.sound_id,
+    AnnotationMapper.created_by,
+    AnnotationMapper.start_seconds,
+    AnnotationMapper.end_seconds,
+    AnnotationMapper.tags
+)
+
+
+def rebuild_summaries(db, batch_size=1000):
+    names = ('annotation_summaries', 'annotation_summary_checkpoints')
+    temp_names = [f'{name}_rebuild' for name in names]
+    for temp_name in temp_names:
+        db.drop_collection(temp_name)
+    temp_summaries, temp_checkpoints = [db[name] for name in temp_names]
+    create_summary_indexes(temp_summaries, temp_checkpoints)
+    summaries = AnnotationSummaryRepository(temp_summaries, temp_checkpoints)
+
+    # visiting each sound's annotations together keeps the buckets being
+    # updated within a batch close together
+    sound_id = AnnotationMapper.sound_id.storage_name
+    documents = db.annotations.find(
+        projection=[field.storage_name for field in FIELDS],
+        sort=[(sound_id, ASCENDING)])
+
+    batch = []
+    n_annotations = 0
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            summaries.update(batch)
+            n_annotations += len(batch)
+            batch = []
+            logger.info(f'Summarized {n_annotations} annotations')
+
+    if batch:
+        summaries.update(batch)
+        n_annotations += len(batch)
+
+    for name, temp_name in zip(names, temp_names):
+        db[temp_name].rename(name, dropTarget=True)
+    logger.info(f'Finished summarizing {n_annotations} annotations')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--connection-string',
+        default='mongodb://localhost:27017')
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000)
+    args = parser.parse_args()
+
+    db = MongoClient(args.connection_string).annotate
+    rebuild_summaries(db, args.batch_size)
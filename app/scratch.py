@@ -30,6 +30,9 @@ class BaseRepository(object):
     def upsert(self, *updates):
         raise NotImplementedError()
 
+    def insert(self, *inserts):
+        raise NotImplementedError()
+
     def filter(
             self,
             query,
@@ -42,6 +45,23 @@ class BaseRepository(object):
     def count(self, query):
         raise NotImplementedError()
 
+    def group(
+            self,
+            query,
+            group_by,
+            min_of=(),
+            max_of=(),
+            page_size=100,
+            page_number=0):
+        """
+        Group entities matching query by the value of the group_by field,
+        returning a QueryResult whose results are dicts in the storage format,
+        each with `_id` (the group's value), `count`, and `min_{storage_name}`
+        and `max_{storage_name}` keys for the fields in min_of and max_of.
+        Groups are ordered by their value
+        """
+        raise NotImplementedError()
+
     # TODO: Perhaps count() should just accept a query with no criteria, which
     # would keep the interface simpler
     def __len__(self):
@@ -94,6 +114,7 @@ class Query(object):
     GREATER_THAN_OR_EQUAL_TO = '>='
     LESS_THAN = '<'
     LESS_THAN_OR_EQUAL_TO = '<='
+    IN = 'in'
 
     def __init__(self, lhs, rhs, op):
         super().__init__()
@@ -124,7 +145,13 @@ class Query(object):
             pass
 
         try:
-            self.literal_value = self.field.value_transform(self.literal_value)
+            if op == Query.IN:
+                self.literal_value = [
+                    self.field.value_transform(value)
+                    for value in self.literal_value]
+            else:
+                self.literal_value = \
+                    self.field.value_transform(self.literal_value)
             self.lhs = self.field
             self.rhs = self.literal_value
         except AttributeError:
@@ -203,6 +230,14 @@ class Query(object):
     def _to_lambda(self, varname, mapper):
         # KLUDGE: This is just temporary, and is for testing against the
         # in-memory repository
+        if self.op == Query.IN:
+            storage_data = mapper.storage_data(self.field)
+            values = [
+                storage_data.to_storage_format(value)
+                for value in self.literal_value]
+            return \
+                f'{varname}["{storage_data.storage_name}"] in {repr(values)}'
+
         lhs = self._transform_operand(
             self.lhs, varname, mapper, self.rhs)
         rhs = self._transform_operand(
@@ -303,6 +338,47 @@ class Session(object):
         repo = self._repositories[query.entity_class]
         return repo.count(query)
 
+    def group(
+            self,
+            query,
+            group_by,
+            min_of=(),
+            max_of=(),
+            page_size=100,
+            page_number=0):
+
+        repo = self._repositories[query.entity_class]
+        start = time.time()
+        query_result = repo.group(
+            query,
+            group_by,
+            min_of=min_of,
+            max_of=max_of,
+            page_size=page_size,
+            page_number=page_number)
+        query_result.query_time = time.time() - start
+
+        def from_storage(field, value):
+            return repo.mapper.storage_data(field).from_storage_format(value)
+
+        start = time.time()
+        transformed_results = []
+        for result in query_result.results:
+            transformed = {
+                group_by.name: from_storage(group_by, result['_id']),
+                'count': result['count']
+            }
+            for prefix, fields in (('min', min_of), ('max', max_of)):
+                for field in fields:
+                    storage_name = repo.mapper.storage_data(field).storage_name
+                    transformed[f'{prefix}_{field.name}'] = from_storage(
+                        field, result[f'{prefix}_{storage_name}'])
+            transformed_results.append(transformed)
+        query_result.result_transform_time = time.time() - start
+
+        query_result.results = transformed_results
+        return query_result
+
     def open(self):
         thread_local.session = self
         return self
@@ -334,15 +410,29 @@ class Session(object):
                 raise PartialEntityUpdate(entity)
             entity.raise_for_errors()
 
-        # Divide updates up according to repository and pass them in batch
+        # Divide updates up according to repository and pass them in batch.
+        # Entities created during this session can't possibly exist in the
+        # backing store yet, so they can be written as plain inserts, skipping
+        # the lookup an upsert requires
+        inserts_by_entity = defaultdict(list)
         updates_by_entity = defaultdict(list)
         for entity, update in updates.items():
-            updates_by_entity[entity.__class__].append(
-                (entity.identity_query, update))
+            if entity._new:
+                inserts_by_entity[entity.__class__].append(update)
+            else:
+                updates_by_entity[entity.__class__].append(
+                    (entity.identity_query, update))
 
-        for entity_cls, updates in updates_by_entity.items():
+        for entity_cls, inserts in inserts_by_entity.items():
             repo = self._repositories[entity_cls]
-            repo.upsert(*updates)
+            repo.insert(*inserts)
+
+        for entity_cls, entity_updates in updates_by_entity.items():
+            repo = self._repositories[entity_cls]
+            repo.upsert(*entity_updates)
+
+        for entity in updates.keys():
+            entity._new = False
 
     def __enter__(self):
         return self.open()
@@ -432,6 +522,9 @@ class BaseDescriptor(object):
     def __le__(self, other):
         return Query(self, other, Query.LESS_THAN_OR_EQUAL_TO)
 
+    def one_of(self, values):
+        return Query(self, list(values), Query.IN)
+
     def __get__(self, instance, owner):
         if instance is None:
             return self
@@ -565,6 +658,7 @@ class BaseEntity(object, metaclass=MetaEntity):
         self._events = []
         self._data = {}
         self._partial = False
+        self._new = True
 
         creator = creator or self
 
@@ -608,6 +702,7 @@ class BaseEntity(object, metaclass=MetaEntity):
         obj._data = kwargs
         obj._events = []
         obj._partial = False
+        obj._new = False
         obj._track()
         return obj
 
@@ -0,0 +1,164 @@
+"""
+Multi-resolution summaries of the annotations belonging to a sound.
+
+Time is divided into fixed-width buckets at several resolutions.  Rather than
+incrementing every bucket an annotation overlaps, which would make long
+annotations expensive, each annotation adds one at the bucket where it begins
+and subtracts one just past the bucket where it ends.  A running sum over these
+deltas recovers the number of annotations overlapping each bucket, so
+maintaining the summary costs O(resolutions) per annotation.
+
+Summing every delta from the start of the sound would make reading a view
+cost more the further into the sound it begins, so the running sum is also
+stored at checkpoints every `CHECKPOINT_BUCKETS` buckets.  Checkpoint `k`
+holds the sum of all deltas before bucket `k * CHECKPOINT_BUCKETS`, i.e., the
+annotations overlapping the bucket just before it.  An annotation changes
+only the checkpoints it spans, and a view is built from a single checkpoint
+and fewer than `CHECKPOINT_BUCKETS` deltas preceding it, plus the deltas
+within it.
+"""
+import math
+from collections import defaultdict, Counter
+
+BUCKET_SECONDS = (1, 4, 16, 64, 256, 1024)
+CHECKPOINT_BUCKETS = 64
+
+
+def bucket_range(start_seconds, end_seconds, bucket_seconds):
+    """
+    Return the first and last buckets overlapped by an interval
+    """
+    first = int(math.floor(start_seconds / bucket_seconds))
+    last = int(math.ceil(end_seconds / bucket_seconds)) - 1
+    return first, max(first, last)
+
+
+def choose_bucket_seconds(start_seconds, end_seconds, max_buckets):
+    """
+    Choose the finest resolution that can describe the interval with no more
+    than max_buckets buckets
+    """
+    duration = end_seconds - start_seconds
+    for bucket_seconds in BUCKET_SECONDS:
+        if duration / bucket_seconds <= max_buckets:
+            return bucket_seconds
+    return BUCKET_SECONDS[-1]
+
+
+def checkpoint(bucket):
+    """
+    Return the checkpoint from which a summary beginning at `bucket` is built
+    """
+    return bucket // CHECKPOINT_BUCKETS
+
+
+class SummaryDelta(object):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.created_by = Counter()
+        self.tags = Counter()
+
+    def add(self, n, created_by, tags):
+        self.count += n
+        self.created_by[created_by] += n
+        for tag in tags:
+            self.tags[tag] += n
+
+
+def summary_deltas(annotations):
+    """
+    Compute the changes to all summaries caused by adding a batch of
+    annotations, each a dict with `sound`, `created_by`, `start_seconds`,
+    `end_seconds` and `tags` keys.  Changes to the same bucket are merged, so
+    the result is keyed by (sound, bucket_seconds, bucket)
+    """
+    deltas = defaultdict(SummaryDelta)
+    for annotation in annotations:
+        sound = annotation['sound']
+        created_by = annotation['created_by']
+        tags = annotation['tags'] or []
+
+        for bucket_seconds in BUCKET_SECONDS:
+            first, last = bucket_range(
+                annotation['start_seconds'],
+                annotation['end_seconds'],
+                bucket_seconds)
+            deltas[(sound, bucket_seconds, first)].add(1, created_by, tags)
+            deltas[(sound, bucket_seconds, last + 1)].add(-1, created_by, tags)
+    return deltas
+
+
+def summary_checkpoints(annotations):
+    """
+    Compute the changes to all checkpoints caused by adding a batch of
+    annotations, in the same form as `summary_deltas`.  The result is keyed
+    by (sound, bucket_seconds, checkpoint)
+    """
+    checkpoints = defaultdict(SummaryDelta)
+    for annotation in annotations:
+        sound = annotation['sound']
+        created_by = annotation['created_by']
+        tags = annotation['tags'] or []
+
+        for bucket_seconds in BUCKET_SECONDS:
+            first, last = bucket_range(
+                annotation['start_seconds'],
+                annotation['end_seconds'],
+                bucket_seconds)
+            # every checkpoint after the first bucket, up to and including
+            # the one just past the last bucket
+            for k in range(checkpoint(first) + 1, checkpoint(last + 1) + 1):
+                checkpoints[(sound, bucket_seconds, k)].add(
+                    1, created_by, tags)
+    return checkpoints
+
+
+def build_summary(
+        deltas,
+        bucket_seconds,
+        start_seconds,
+        end_seconds,
+        prefix=None):
+    """
+    Turn the deltas for a single sound and resolution, a mapping from bucket
+    to SummaryDelta, into a dense list of buckets overlapping the interval.
+    `prefix` is the sum of any deltas omitted from before the interval, e.g.,
+    a checkpoint
+    """
+    first, last = bucket_range(start_seconds, end_seconds, bucket_seconds)
+
+    count = 0
+    created_by = Counter()
+    tags = Counter()
+    buckets = []
+
+    if prefix is not None:
+        count = prefix.count
+        created_by.update(prefix.created_by)
+        tags.update(prefix.tags)
+
+    for bucket in sorted(deltas.keys()):
+        if bucket >= first:
+            break
+        delta = deltas[bucket]
+        count += delta.count
+        created_by.update(delta.created_by)
+        tags.update(delta.tags)
+
+    for bucket in range(first, last + 1):
+        delta = deltas.get(bucket)
+        if delta is not None:
+            count += delta.count
+            created_by.update(delta.created_by)
+            tags.update(delta.tags)
+
+        buckets.append({
+            'start_seconds': bucket * bucket_seconds,
+            'end_seconds': (bucket + 1) * bucket_seconds,
+            'count': count,
+            'created_by': {k: v for k, v in created_by.items() if v},
+            'tags': {k: v for k, v in tags.items() if v}
+        })
+
+    return buckets
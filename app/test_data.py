@@ -4,13 +4,28 @@ from mapping import UserMapper, SoundMapper, AnnotationMapper
 from scratch import \
     Session, ContextualValue, BaseRepository, SortOrder, QueryResult, \
     BaseEntity, BaseDescriptor
-from errors import PermissionsError, EntityNotFoundError, ImmutableError
+from errors import \
+    PermissionsError, EntityNotFoundError, ImmutableError, \
+    DuplicateEntityException
+from groupcommit import GroupCommitWriter
+from identifier import \
+    user_id_generator, encode_id, decode_id, is_valid_id
+from data import MongoRepository, AnnotationRepository
+from summary import \
+    summary_deltas, summary_checkpoints, build_summary, choose_bucket_seconds, \
+    checkpoint, CHECKPOINT_BUCKETS
+from app import SoundsBatchResource
+from pymongo.errors import BulkWriteError
+import falcon
+import threading
 
 
 class InMemoryRepository(BaseRepository):
     def __init__(self, cls, mapper):
         super().__init__(cls, mapper)
         self._data = {}
+        self.inserts = 0
+        self.upserts = 0
 
     def __len__(self):
         return len(self._data)
@@ -26,6 +41,13 @@ class InMemoryRepository(BaseRepository):
             except StopIteration:
                 # this is a new document.  insert it
                 self._data[query.literal_value] = storage_updates
+        self.upserts += len(updates)
+
+    def insert(self, *inserts):
+        for insert in inserts:
+            storage_updates = self.mapper.transform_updates(insert.values())
+            self._data[storage_updates['_id']] = storage_updates
+        self.inserts += len(inserts)
 
     def filter(
             self,
@@ -54,6 +76,37 @@ class InMemoryRepository(BaseRepository):
     def count(self, query):
         return len(tuple(self.filter(query)))
 
+    def group(
+            self,
+            query,
+            group_by,
+            min_of=(),
+            max_of=(),
+            page_size=100,
+            page_number=0):
+
+        f = query.to_lambda('item', self.mapper)
+        group_name = self.mapper.storage_data(group_by).storage_name
+        min_names = [self.mapper.storage_data(x).storage_name for x in min_of]
+        max_names = [self.mapper.storage_data(x).storage_name for x in max_of]
+
+        groups = {}
+        for item in filter(f, self._data.values()):
+            key = item[group_name]
+            group = groups.setdefault(key, {'_id': key, 'count': 0})
+            group['count'] += 1
+            for name in min_names:
+                group[f'min_{name}'] = \
+                    min(group.get(f'min_{name}', item[name]), item[name])
+            for name in max_names:
+                group[f'max_{name}'] = \
+                    max(group.get(f'max_{name}', item[name]), item[name])
+
+        results = sorted(groups.values(), key=lambda x: x['_id'])
+        start_pos = page_number * page_size
+        page = results[start_pos: start_pos + page_size]
+        return QueryResult(page, page_number, page_size, len(results))
+
 
 def user1(user_type=None):
     return dict(
@@ -436,6 +489,39 @@ class AnnotationDataTests(unittest2.TestCase):
             self.assertEqual(1, len(annotations))
             self.assertEqual(annotation.id, annotations[0].id)
 
+    def test_can_group_annotations_by_sound(self):
+        with self._session():
+            user = User.create(**user1(user_type=UserType.DATASET))
+            user_id = user.id
+
+        with self._session() as s:
+            user = next(s.filter(User.id == user_id))
+            snd1 = sound(user, audio_url='https://example.com/1')
+            snd2 = sound(user, audio_url='https://example.com/2')
+            for snd, start_seconds in ((snd1, 1), (snd1, 5), (snd2, 2)):
+                Annotation.create(
+                    creator=user,
+                    created_by=user,
+                    sound=snd,
+                    start_seconds=start_seconds,
+                    duration_seconds=1,
+                    tags=['drums'])
+
+        with self._session() as s:
+            result = s.group(
+                Annotation.created_by == user,
+                Annotation.sound,
+                min_of=(Annotation.start_seconds,),
+                max_of=(Annotation.end_seconds,))
+
+        self.assertEqual(2, result.total_count)
+        groups = {group['sound'].id: group for group in result.results}
+        self.assertEqual(2, groups[snd1.id]['count'])
+        self.assertEqual(1, groups[snd1.id]['min_start_seconds'])
+        self.assertEqual(6, groups[snd1.id]['max_end_seconds'])
+        self.assertEqual(1, groups[snd2.id]['count'])
+        self.assertIsInstance(groups[snd2.id]['sound'], Sound)
+
 
 class SoundDataTests(unittest2.TestCase):
     def setUp(self):
@@ -490,6 +576,20 @@ class SoundDataTests(unittest2.TestCase):
 
         self.assertEqual(date_created, snd.date_created)
 
+    def test_can_find_sounds_with_one_of_several_audio_urls(self):
+        urls = [f'https://example.com/{i}.wav' for i in range(3)]
+
+        with self._session():
+            user = User.create(**user1())
+            sound_ids = [sound(user, audio_url=url).id for url in urls]
+
+        with self._session() as s:
+            results = list(s.filter(Sound.audio_url.one_of(
+                urls[:2] + ['https://example.com/missing.wav'])))
+
+        self.assertEqual(
+            set(sound_ids[:2]), set(snd.id for snd in results))
+
 
 class DataTests(unittest2.TestCase):
     def setUp(self):
@@ -506,6 +606,25 @@ class DataTests(unittest2.TestCase):
         self.assertEqual(1, len(self.repo._data))
         self.assertIn(user_id, self.repo._data)
 
+    def test_new_user_is_inserted_rather_than_upserted(self):
+        with self._session():
+            User.create(**user1())
+
+        self.assertEqual(1, self.repo.inserts)
+        self.assertEqual(0, self.repo.upserts)
+
+    def test_modified_user_is_upserted_rather_than_inserted(self):
+        with self._session():
+            c = User.create(**user1())
+            user_id = c.id
+
+        with self._session() as s:
+            c2 = next(s.filter(User.id == user_id))
+            c2.about_me = ContextualValue(c2, 'modified')
+
+        self.assertEqual(1, self.repo.inserts)
+        self.assertEqual(1, self.repo.upserts)
+
     def test_can_retrieve_user_from_data_store(self):
         with self._session():
             c = User.create(**user1())
@@ -580,3 +699,325 @@ class DataTests(unittest2.TestCase):
             c2 = next(s.filter(query))
             c3 = next(s.filter(query))
             self.assertIs(c2, c3)
+
+
+class FakeCollection(object):
+    def __init__(self, full_name='annotate.annotations', duplicates=None):
+        super().__init__()
+        self.full_name = full_name
+        self.duplicates = set(duplicates or [])
+        self.bulk_writes = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(list(operations))
+        write_errors = [
+            {'index': i, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}
+            for i, op in enumerate(operations) if op in self.duplicates]
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors})
+
+
+class FakeSummaries(object):
+    def __init__(self):
+        super().__init__()
+        self.updated = []
+
+    def update(self, documents):
+        self.updated.extend(documents)
+
+
+class FakeAnnotationCollection(object):
+    def __init__(self, duplicate_ids):
+        super().__init__()
+        self.duplicate_ids = set(duplicate_ids)
+
+    def insert_many(self, documents, ordered=True):
+        write_errors = [
+            {'index': i, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}
+            for i, doc in enumerate(documents)
+            if doc['_id'] in self.duplicate_ids]
+        if write_errors:
+            raise BulkWriteError({'writeErrors': write_errors})
+
+
+class FakeInsert(dict):
+    def values(self):
+        return self.items()
+
+
+class FakeMapper(object):
+    @staticmethod
+    def transform_updates(updates):
+        return dict(updates)
+
+
+class AnnotationRepositoryTests(unittest2.TestCase):
+    def _repository(self, duplicate_ids=()):
+        summaries = FakeSummaries()
+        repo = AnnotationRepository(
+            FakeAnnotationCollection(duplicate_ids), summaries=summaries)
+        repo.mapper = FakeMapper
+        return repo, summaries
+
+    def test_summarizes_inserted_annotations(self):
+        repo, summaries = self._repository()
+        repo.insert(FakeInsert(_id='a'), FakeInsert(_id='b'))
+        self.assertEqual(['a', 'b'], [doc['_id'] for doc in summaries.updated])
+
+    def test_summarizes_written_annotations_when_some_are_duplicates(self):
+        repo, summaries = self._repository(duplicate_ids=['b'])
+        self.assertRaises(
+            DuplicateEntityException,
+            lambda: repo.insert(
+                FakeInsert(_id='a'), FakeInsert(_id='b'), FakeInsert(_id='c')))
+        self.assertEqual(['a', 'c'], [doc['_id'] for doc in summaries.updated])
+
+
+class GroupCommitWriterTests(unittest2.TestCase):
+    def _submit_concurrently(self, writer, collection, batches):
+        results = [None] * len(batches)
+
+        def submit(i, batch):
+            try:
+                writer.write(collection, batch)
+            except BulkWriteError as e:
+                results[i] = e
+
+        threads = [
+            threading.Thread(target=submit, args=(i, batch))
+            for i, batch in enumerate(batches)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesces_concurrent_writes_into_single_bulk_write(self):
+        writer = GroupCommitWriter(max_delay_seconds=0.5)
+        collection = FakeCollection()
+        self._submit_concurrently(
+            writer, collection, [['a', 'b'], ['c'], ['d', 'e']])
+        self.assertEqual(1, len(collection.bulk_writes))
+        self.assertEqual(
+            {'a', 'b', 'c', 'd', 'e'}, set(collection.bulk_writes[0]))
+
+    def test_flushes_early_when_max_batch_size_reached(self):
+        writer = GroupCommitWriter(max_delay_seconds=10, max_batch_size=2)
+        collection = FakeCollection()
+        writer.write(collection, ['a', 'b'])
+        self.assertEqual([['a', 'b']], collection.bulk_writes)
+
+    def test_write_errors_are_attributed_to_submitting_session(self):
+        writer = GroupCommitWriter(max_delay_seconds=0.5)
+        collection = FakeCollection(duplicates=['d'])
+        results = self._submit_concurrently(
+            writer, collection, [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertIsNone(results[0])
+        self.assertIsNone(results[2])
+        self.assertIsInstance(results[1], BulkWriteError)
+        write_errors = results[1].details['writeErrors']
+        self.assertEqual(1, len(write_errors))
+        self.assertEqual(1, write_errors[0]['index'])
+
+    def test_issues_one_bulk_write_per_collection(self):
+        writer = GroupCommitWriter(max_delay_seconds=0.5)
+        sounds = FakeCollection('annotate.sounds')
+        annotations = FakeCollection('annotate.annotations')
+        pending = [
+            writer.submit(sounds, ['a']),
+            writer.submit(annotations, ['b']),
+            writer.submit(sounds, ['c'])
+        ]
+        for p in pending:
+            p.result()
+        self.assertEqual([['a', 'c']], sounds.bulk_writes)
+        self.assertEqual([['b']], annotations.bulk_writes)
+
+
+class IdentifierTests(unittest2.TestCase):
+    def test_identifiers_are_monotonic(self):
+        ids = [user_id_generator(None) for _ in range(1000)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_binary_identifiers_are_sixteen_bytes(self):
+        self.assertEqual(16, len(encode_id(user_id_generator(None))))
+
+    def test_identifier_round_trips_through_binary_form(self):
+        _id = user_id_generator(None)
+        self.assertEqual(_id, decode_id(encode_id(_id)))
+
+    def test_binary_identifiers_preserve_ordering(self):
+        ids = [user_id_generator(None) for _ in range(1000)]
+        encoded = [encode_id(_id) for _id in ids]
+        self.assertEqual(encoded, sorted(encoded))
+
+    def test_invalid_identifier_is_not_encoded(self):
+        self.assertEqual('HalIncandenza', encode_id('HalIncandenza'))
+
+    def test_generated_identifiers_are_valid(self):
+        self.assertTrue(is_valid_id(user_id_generator(None)))
+
+    def test_malformed_identifiers_are_invalid(self):
+        self.assertFalse(is_valid_id('HalIncandenza'))
+        self.assertFalse(is_valid_id('0x' + user_id_generator(None)))
+        self.assertFalse(is_valid_id('abc'))
+        self.assertFalse(is_valid_id('f' * 40))
+
+    def test_mongo_queries_use_binary_identifiers(self):
+        repo = MongoRepository(Sound, SoundMapper, collection=None)
+        _id = user_id_generator(None)
+        query = repo._transform_query(Sound.id > _id)
+        self.assertEqual({'_id': {'$gt': encode_id(_id)}}, query)
+
+    def test_mongo_queries_use_binary_identifiers_for_references(self):
+        repo = MongoRepository(Sound, SoundMapper, collection=None)
+        user = User.create(**user1())
+        query = repo._transform_query(Sound.created_by == user)
+        self.assertEqual(
+            {'created_by': {'$eq': encode_id(user.id)}}, query)
+
+
+class AnnotationSummaryTests(unittest2.TestCase):
+    def _summary(self, annotations, bucket_seconds, start, end):
+        deltas = summary_deltas(annotations)
+        deltas = {
+            bucket: delta for (_, bs, bucket), delta in deltas.items()
+            if bs == bucket_seconds}
+        return build_summary(deltas, bucket_seconds, start, end)
+
+    def _annotation(self, start, end, created_by='user', tags=None):
+        return dict(
+            sound='sound',
+            created_by=created_by,
+            start_seconds=start,
+            end_seconds=end,
+            tags=tags)
+
+    def test_counts_annotations_overlapping_each_bucket(self):
+        buckets = self._summary([
+            self._annotation(0, 10),
+            self._annotation(1, 2),
+            self._annotation(5, 6)
+        ], 4, 0, 12)
+        self.assertEqual([2, 2, 1], [b['count'] for b in buckets])
+
+    def test_counts_by_creator_and_tag(self):
+        buckets = self._summary([
+            self._annotation(0, 1, created_by='a', tags=['kick']),
+            self._annotation(0, 1, created_by='b', tags=['kick', 'snare']),
+            self._annotation(5, 6, created_by='b', tags=['snare']),
+        ], 4, 0, 8)
+        self.assertEqual({'a': 1, 'b': 1}, buckets[0]['created_by'])
+        self.assertEqual({'kick': 2, 'snare': 1}, buckets[0]['tags'])
+        self.assertEqual({'b': 1}, buckets[1]['created_by'])
+        self.assertEqual({'snare': 1}, buckets[1]['tags'])
+
+    def test_summary_of_range_includes_annotations_starting_earlier(self):
+        buckets = self._summary([self._annotation(0, 100)], 16, 64, 96)
+        self.assertEqual([1, 1], [b['count'] for b in buckets])
+        self.assertEqual(64, buckets[0]['start_seconds'])
+
+    def test_each_annotation_contributes_constant_number_of_deltas(self):
+        deltas = summary_deltas([self._annotation(0, 10000)])
+        self.assertEqual(12, len(deltas))
+
+    def _summary_from_checkpoint(self, annotations, bucket_seconds, start, end):
+        deltas = summary_deltas(annotations)
+        checkpoints = summary_checkpoints(annotations)
+        k = checkpoint(int(start // bucket_seconds))
+        deltas = {
+            bucket: delta for (_, bs, bucket), delta in deltas.items()
+            if bs == bucket_seconds and bucket >= k * CHECKPOINT_BUCKETS}
+        prefix = checkpoints.get(('sound', bucket_seconds, k))
+        return build_summary(deltas, bucket_seconds, start, end, prefix)
+
+    def test_summary_from_checkpoint_matches_summary_from_start(self):
+        annotations = [
+            self._annotation(start, start + length, tags=[str(length)])
+            for start, length in (
+                (0, 1000), (10, 5), (63, 2), (64, 1), (127, 300), (500, 1))]
+        for start, end in ((0, 200), (64, 128), (100, 700), (640, 1100)):
+            self.assertEqual(
+                self._summary(annotations, 1, start, end),
+                self._summary_from_checkpoint(annotations, 1, start, end))
+
+    def test_checkpoints_are_only_updated_within_annotation(self):
+        checkpoints = summary_checkpoints([self._annotation(1000, 1200)])
+        self.assertEqual(
+            [16, 17, 18],
+            sorted(k for (_, bs, k) in checkpoints if bs == 1))
+
+    def test_chooses_finest_resolution_within_bucket_limit(self):
+        self.assertEqual(1, choose_bucket_seconds(0, 100, 256))
+        self.assertEqual(16, choose_bucket_seconds(0, 600, 64))
+        self.assertEqual(1024, choose_bucket_seconds(0, 1e9, 64))
+
+
+class FakeStoredSound(object):
+    def __init__(self, audio_url, _id):
+        super().__init__()
+        self.audio_url = audio_url
+        self.id = _id
+
+
+class FakeSoundSession(object):
+    def __init__(self, *stored):
+        super().__init__()
+        self.stored = stored
+
+    def filter(self, query, page_size, total_count):
+        return self.stored
+
+
+class FakeMedia(object):
+    def __init__(self, media):
+        super().__init__()
+        self.media = media
+
+
+class SoundsBatchConflictTests(unittest2.TestCase):
+    def _item(self, status, sound_id):
+        return {'status': status, 'id': sound_id, 'uri': f'/sounds/{sound_id}'}
+
+    def _resolve(self, audio_urls, items, *stored):
+        req = FakeMedia({'sounds': [{'audio_url': url} for url in audio_urls]})
+        resp = FakeMedia({'items': items})
+        SoundsBatchResource().on_conflict(
+            req, resp, FakeSoundSession(*stored))
+        return resp.media['items']
+
+    def test_sounds_registered_concurrently_are_reported_as_existing(self):
+        items = self._resolve(
+            ['a', 'b'],
+            [self._item('created', 'mine'), self._item('created', 'b1')],
+            FakeStoredSound('a', 'theirs'),
+            FakeStoredSound('b', 'b1'))
+        self.assertEqual(
+            [self._item('existing', 'theirs'), self._item('created', 'b1')],
+            items)
+
+    def test_in_batch_duplicates_of_a_replaced_sound_are_remapped(self):
+        items = self._resolve(
+            ['a', 'a', 'b'],
+            [
+                self._item('created', 'mine'),
+                self._item('existing', 'mine'),
+                self._item('created', 'b1')
+            ],
+            FakeStoredSound('a', 'theirs'),
+            FakeStoredSound('b', 'b1'))
+        self.assertEqual(
+            [
+                self._item('existing', 'theirs'),
+                self._item('existing', 'theirs'),
+                self._item('created', 'b1')
+            ],
+            items)
+
+    def test_conflict_when_a_created_sound_was_not_stored(self):
+        self.assertRaises(
+            falcon.HTTPConflict,
+            lambda: self._resolve(
+                ['a'],
+                [self._item('created', 'mine')]))
@@ -51,6 +51,8 @@ class IndexServer(AnacondaServer):
     def _inner_fulfill(self, connection):
         connection.run('mkdir -p remote/')
         connection.put('examples/spatial_index_api.py', 'remote/')
+        connection.put('examples/spatial_index.py', 'remote/')
+        connection.put('examples/sharded_index.py', 'remote/')
         connection.put('examples/hyperplane_tree.py', 'remote/')
         connection.put('examples/log.py', 'remote/')
 
@@ -115,6 +117,8 @@ class IndexApp(Requirement):
         connection = self.server.connection()
         data = self.server.data()
         connection.put('examples/spatial_index_api.py', 'remote/')
+        connection.put('examples/spatial_index.py', 'remote/')
+        connection.put('examples/sharded_index.py', 'remote/')
         connection.put('examples/hyperplane_tree.py', 'remote/')
         connection.put('examples/log.py', 'remote/')
         self.supervisord.copy_config(connection, variables=data['config'])
@@ -0,0 +1,267 @@
+import asyncio
+import os
+from http import client
+from urllib.parse import urlparse, urlunparse
+
+import aiohttp
+
+
+class AsyncClient(object):
+    """
+    An asyncio-based counterpart to `client.Client`, with the same method
+    surface.  All requests share a pool of keep-alive connections, and no more
+    than `max_concurrency` requests are ever in flight at once, e.g.
+
+    async with AsyncClient('https://api.cochlea.xyz', auth=auth) as c:
+        async for sound in c.sound_stream():
+            ...
+    """
+
+    def __init__(
+            self,
+            hostname,
+            auth=None,
+            logger=None,
+            max_concurrency=8,
+            annotation_batch_size=500):
+
+        super().__init__()
+        self.parsed = urlparse(hostname)
+        self.hostname = self.parsed.netloc
+        self.base_path = self.parsed.path
+        self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.annotation_batch_size = annotation_batch_size
+        self._auth = auth
+        self._session = None
+        self._semaphore = None
+
+    @property
+    def auth(self):
+        return self._auth
+
+    @auth.setter
+    def auth(self, value):
+        self._auth = value
+
+    def _basic_auth(self, auth=None):
+        auth = auth or self._auth
+        return aiohttp.BasicAuth(*auth) if auth else None
+
+    @property
+    def session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def uri(self, path):
+        parsed = self.parsed._replace(
+            path=os.path.join(self.parsed.path, path))
+        return urlunparse(parsed)
+
+    async def _request(
+            self,
+            method,
+            uri,
+            auth=None,
+            raise_for_status=False,
+            expected_statuses=None,
+            **kwargs):
+        """
+        Issue a request, returning the status code, headers and decoded JSON
+        body (if any).  Any status not in `expected_statuses`, when given,
+        raises `aiohttp.ClientResponseError`, just as error statuses do when
+        `raise_for_status` is set
+        """
+        session = self.session
+        async with self._semaphore:
+            async with session.request(
+                    method, uri, auth=self._basic_auth(auth), **kwargs) as resp:
+                if expected_statuses is not None \
+                        and resp.status not in expected_statuses:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info,
+                        resp.history,
+                        status=resp.status,
+                        message=resp.reason,
+                        headers=resp.headers)
+                if raise_for_status:
+                    resp.raise_for_status()
+                if resp.content_type == 'application/json':
+                    data = await resp.json()
+                else:
+                    data = None
+                return resp.status, resp.headers, data
+
+    async def _get_json(self, uri, params):
+        params = {k: v for k, v in params.items() if v is not None}
+        _, _, data = await self._request(
+            'GET', uri, params=params, raise_for_status=True)
+        return data
+
+    async def _upsert_user(
+            self,
+            user_type,
+            user_name,
+            email,
+            password,
+            about_me,
+            info_url=None):
+
+        user_data = {
+            'user_name': user_name,
+            'user_type': user_type,
+            'email': email,
+            'password': password,
+            'about_me': about_me,
+            'info_url': info_url
+        }
+        auth = (user_name, password)
+        status, headers, _ = await self._request(
+            'POST', self.uri('users'), json=user_data)
+        location = headers['location']
+        if status == client.CREATED:
+            self.logger.info(f'Created user {user_name}')
+        elif status == client.CONFLICT:
+            self.logger.info(f'user {user_name} already exists')
+            update_data = {'password': password, 'about_me': about_me}
+            await self._request(
+                'PATCH',
+                self.uri(location[1:]),
+                auth=auth,
+                json=update_data,
+                raise_for_status=True)
+            self.logger.info(f'Updated user {user_name}')
+        self.auth = auth
+        return location
+
+    async def upsert_user(self, user_name, email, password, about_me, info_url):
+        return await self._upsert_user(
+            'human', user_name, email, password, about_me, info_url)
+
+    async def upsert_dataset(
+            self, user_name, email, password, about_me, info_url=None):
+        return await self._upsert_user(
+            'dataset', user_name, email, password, about_me, info_url)
+
+    async def upsert_featurebot(
+            self, user_name, email, password, about_me, info_url=None):
+        return await self._upsert_user(
+            'featurebot', user_name, email, password, about_me, info_url)
+
+    async def upsert_aggregator(
+            self, user_name, email, password, about_me, info_url=None):
+        return await self._upsert_user(
+            'aggregator', user_name, email, password, about_me, info_url)
+
+    async def get_user(self, user_name):
+        data = await self._get_json(
+            self.uri('users'), {'page_size': 1, 'user_name': user_name})
+        try:
+            return data['items'][0]
+        except IndexError:
+            raise KeyError(f'No user with name {user_name}')
+
+    async def create_sound(
+            self,
+            audio_url,
+            low_quality_audio_url,
+            info_url,
+            license_type,
+            title,
+            duration_seconds,
+            tags=None):
+
+        status, headers, _ = await self._request(
+            'POST',
+            self.uri('sounds'),
+            expected_statuses=(client.CREATED, client.CONFLICT),
+            json={
+                'audio_url': audio_url,
+                'low_quality_audio_url': low_quality_audio_url,
+                'info_url': info_url,
+                'license_type': license_type,
+                'title': title,
+                'duration_seconds': duration_seconds,
+                'tags': tags
+            })
+        # Response should either be a 201 Created or a 409 Conflict, both of
+        # which should include location information
+        sound_uri = headers['location']
+        sound_id = os.path.split(sound_uri)[-1]
+        return status, sound_uri, sound_id
+
+    async def create_annotations(self, sound_id, *annotations):
+        """
+        Post annotations in batches, with all batches in flight concurrently
+        """
+        uri = self.uri(f'sounds/{sound_id}/annotations')
+        step = self.annotation_batch_size
+        responses = await asyncio.gather(*(
+            self._request(
+                'POST', uri, json={'annotations': annotations[i: i + step]})
+            for i in range(0, len(annotations), step)))
+        return max(status for status, _, _ in responses)
+
+    async def get_sounds(self, low_id=None, page_size=100):
+        return await self._get_json(
+            self.uri('sounds'), {'low_id': low_id, 'page_size': page_size})
+
+    async def get_annotations(self, user, low_id=None, page_size=100):
+        return await self._get_json(
+            self.uri(f'users/{user}/annotations'),
+            {'low_id': low_id, 'page_size': page_size})
+
+    async def _stream(self, fetch, low_id, wait_for_new, poll_interval):
+        """
+        Yield items page by page, fetching the next page in the background
+        while the current one is being processed
+        """
+        current = asyncio.ensure_future(fetch(low_id))
+        try:
+            while True:
+                items = (await current)['items']
+                if items:
+                    low_id = items[-1]['id']
+                elif not wait_for_new:
+                    return
+                else:
+                    await asyncio.sleep(poll_interval)
+
+                current = asyncio.ensure_future(fetch(low_id))
+                for item in items:
+                    yield item
+        finally:
+            current.cancel()
+
+    def sound_stream(
+            self, low_id=None, page_size=100, wait_for_new=False,
+            poll_interval=1):
+
+        async def fetch(low):
+            return await self.get_sounds(low_id=low, page_size=page_size)
+
+        return self._stream(fetch, low_id, wait_for_new, poll_interval)
+
+    def annotation_stream(
+            self, user, low_id=None, page_size=100, wait_for_new=False,
+            poll_interval=1):
+
+        async def fetch(low):
+            return await self.get_annotations(
+                user, low_id=low, page_size=page_size)
+
+        return self._stream(fetch, low_id, wait_for_new, poll_interval)
@@ -16,6 +16,7 @@ class Process(subprocess.Popen):
             password,
             annotate_endpoint,
             s3_endpoint,
+            s3_multipart_threshold_mb=None,
             **kwargs):
 
         self.s3_endpoint = s3_endpoint
@@ -32,6 +33,10 @@ class Process(subprocess.Popen):
         if s3_endpoint:
             cli_args.extend(['--s3-endpoint', s3_endpoint])
 
+        if s3_multipart_threshold_mb is not None:
+            cli_args.extend([
+                '--s3-multipart-threshold-mb', str(s3_multipart_threshold_mb)])
+
         for item in kwargs.items():
             cli_args.extend(filter(lambda x: bool(x), item))
 
@@ -64,6 +69,12 @@ if __name__ == '__main__':
         '--s3-endpoint',
         default=None,
         help='scheme, hostname and optional port of s3 endpoint')
+    parser.add_argument(
+        '--s3-multipart-threshold-mb',
+        type=int,
+        default=None,
+        help='passed on to each process; 0 disables multipart uploads, '
+             'which fake-s3 requires')
     args = parser.parse_args()
 
     password = 'password'
@@ -74,6 +85,7 @@ if __name__ == '__main__':
             password,
             args.annotate_api_endpoint,
             args.s3_endpoint,
+            args.s3_multipart_threshold_mb,
             **kwargs)
 
     processes = ProcessCollection(
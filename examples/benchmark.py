@@ -0,0 +1,414 @@
+"""
+Benchmarks for the indexes used by the example bots, run against synthetic
+data, e.g.
+
+python benchmark.py append --vectors 10000000
+python benchmark.py search --vectors 1000000
+python benchmark.py recall --vectors 1000000 --candidates 100 1000 10000
+python benchmark.py hamming --codes 1000000 10000000
+python benchmark.py multi-index --codes 1000000 10000000
+python benchmark.py sharded --vectors 1000000 --shards 1 2 4
+"""
+import argparse
+import resource
+import time
+import tracemalloc
+import numpy as np
+from scipy.spatial.distance import cdist
+from hyperplane_tree import unit_vectors, MultiHyperPlaneTree
+from spatial_index import Index
+from hamming_index import HammingIndex, MultiIndexHammingIndex
+from sharded_index import ShardedIndex
+
+
+def peak_memory_mb():
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def append(n_vectors, vectors_per_sound, report_every):
+    """
+    Ingest synthetic 3D embeddings through the spatial index one sound at a
+    time, reporting throughput as the index grows.  Throughput should only
+    fall off slowly as the trees deepen, since appending to the underlying
+    storage is amortized O(1) in the size of the index
+    """
+    index = Index(seconds_per_chunk=1, user_uri='/users/benchmark')
+
+    start = time.time()
+    last_report = start
+    last_count = 0
+    n_sounds = int(np.ceil(n_vectors / vectors_per_sound))
+
+    for i in range(n_sounds):
+        chunk = unit_vectors(vectors_per_sound, 3).astype(np.float32)
+        index.append(f'{i:032x}', chunk)
+        count = index.current_offset
+        if count - last_count >= report_every or i == n_sounds - 1:
+            now = time.time()
+            rate = (count - last_count) / (now - last_report)
+            print(
+                f'{count} vectors: {rate:.0f} vectors/s, '
+                f'peak memory {peak_memory_mb():.0f}MB')
+            last_report = now
+            last_count = count
+
+    elapsed = time.time() - start
+    print(
+        f'appended {index.current_offset} vectors in {elapsed:.1f}s '
+        f'({index.current_offset / elapsed:.0f}/s)')
+
+
+def search(n_vectors, n_queries, n_results):
+    """
+    Measure query latency, batched query throughput and the memory needed
+    per million vectors for trees made up of node objects, and for the same
+    trees once flattened into arrays
+    """
+    data = unit_vectors(n_vectors, 3).astype(np.float32)
+
+    tracemalloc.start()
+    tree = MultiHyperPlaneTree(data, smallest_node=1024, n_trees=5)
+    node_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    flat = tree.flatten()
+    queries = unit_vectors(n_queries, 3).astype(np.float32)
+
+    latencies = []
+    for query in queries:
+        start = time.time()
+        tree.search_with_priority_queue(query, n_results, threshold=0.001)
+        latencies.append(time.time() - start)
+    latencies = np.array(latencies) * 1000
+
+    start = time.time()
+    tree.search_batch(queries, n_results, threshold=0.001)
+    batch_elapsed = time.time() - start
+
+    millions = n_vectors / 1e6
+    print(
+        f'{n_vectors} vectors, {flat.n_nodes} nodes in {flat.n_trees} trees')
+    print(f'vectors: {data.nbytes / millions / 1e6:.1f}MB per million')
+    print(f'node objects: {node_bytes / millions / 1e6:.1f}MB per million')
+    print(f'flattened: {flat.nbytes / millions / 1e6:.1f}MB per million')
+    print(
+        f'{n_queries} queries for {n_results} results: '
+        f'mean {latencies.mean():.2f}ms, '
+        f'p50 {np.percentile(latencies, 50):.2f}ms, '
+        f'p99 {np.percentile(latencies, 99):.2f}ms')
+    print(
+        f'one batch of {n_queries} queries: {batch_elapsed * 1000:.0f}ms '
+        f'({n_queries / batch_elapsed:.0f} queries/s)')
+
+
+def exact_neighbors(data, queries, n_results, queries_per_chunk=16):
+    """
+    Find the true nearest neighbors of each query by brute force, a few
+    queries at a time to bound the size of the distance matrix
+    """
+    neighbors = []
+    for i in range(0, len(queries), queries_per_chunk):
+        dist = cdist(queries[i: i + queries_per_chunk], data, metric='cosine')
+        nearest = np.argpartition(dist, n_results, axis=-1)[:, :n_results]
+        neighbors.extend(set(row) for row in nearest)
+    return neighbors
+
+
+def recall(
+        n_vectors,
+        n_queries,
+        n_results,
+        candidates,
+        max_leaves,
+        max_leaves_per_tree,
+        threshold):
+    """
+    Measure recall@k against brute-force search, along with queries per
+    second, for a range of candidate budgets, so that an operating point can
+    be chosen for the spatial index API
+    """
+    data = unit_vectors(n_vectors, 3).astype(np.float32)
+    tree = MultiHyperPlaneTree(data, smallest_node=1024, n_trees=5)
+    tree.flatten()
+    queries = unit_vectors(n_queries, 3).astype(np.float32)
+    truth = exact_neighbors(data, queries, n_results)
+
+    print(
+        f'{n_vectors} vectors, {n_queries} queries, recall@{n_results}, '
+        f'max_leaves={max_leaves}, '
+        f'max_leaves_per_tree={max_leaves_per_tree}, '
+        f'threshold={threshold}')
+
+    for max_candidates in candidates:
+        start = time.time()
+        results = tree.search_batch(
+            queries,
+            n_results,
+            threshold,
+            max_candidates=max_candidates,
+            max_leaves=max_leaves,
+            max_leaves_per_tree=max_leaves_per_tree)
+        elapsed = time.time() - start
+
+        hits = sum(
+            len(expected.intersection(found.tolist()))
+            for expected, found in zip(truth, results))
+        print(
+            f'max_candidates={max_candidates}: '
+            f'recall {hits / (n_queries * n_results):.4f}, '
+            f'{n_queries / elapsed:.0f} queries/s')
+
+
+def random_codes(n_codes, n_words, seed=None):
+    rng = np.random.default_rng(seed)
+    return rng.integers(
+        0, np.iinfo(np.uint64).max, (n_codes, n_words),
+        dtype=np.uint64, endpoint=True)
+
+
+def clustered_codes(n_codes, n_bits, n_clusters, noise, seed=None):
+    """
+    Produce codes scattered around random cluster centers, by flipping each
+    bit of a center with probability `noise`.  Unlike uniformly random codes,
+    these have near neighbors, as codes for similar sounds do
+    """
+    rng = np.random.default_rng(seed)
+    centers = np.unpackbits(
+        random_codes(n_clusters, n_bits // 64, seed=0).view(np.uint8), axis=1)
+    flips = (rng.random((n_codes, n_bits)) < noise).astype(np.uint8)
+    bits = centers[rng.integers(0, n_clusters, n_codes)] ^ flips
+    return np.packbits(bits, axis=1).view(np.uint64)
+
+
+def hamming(
+        code_counts,
+        n_bits,
+        n_queries,
+        batch_size,
+        n_results,
+        n_threads,
+        codes_per_append=100000):
+    """
+    Measure single and batched query latency for brute-force hamming search
+    over random binary codes, like those produced by the MFCC indexer
+    """
+    n_words = n_bits // 64
+    index = HammingIndex(n_words, n_threads=n_threads)
+
+    for n_codes in sorted(code_counts):
+        start = time.time()
+        while len(index) < n_codes:
+            count = min(codes_per_append, n_codes - len(index))
+            index.append(random_codes(count, n_words))
+        append_elapsed = time.time() - start
+
+        queries = random_codes(n_queries, n_words)
+        latencies = []
+        for query in queries:
+            start = time.time()
+            index.search(query[None, :], n_results)
+            latencies.append(time.time() - start)
+        latencies = np.array(latencies) * 1000
+
+        start = time.time()
+        for i in range(0, n_queries, batch_size):
+            index.search(queries[i: i + batch_size], n_results)
+        batch_elapsed = time.time() - start
+
+        print(
+            f'{n_codes} {n_bits}-bit codes '
+            f'({index.nbytes / 1e6:.0f}MB, {index.n_threads} threads), '
+            f'appended at {n_codes / max(append_elapsed, 1e-9):.0f}/s')
+        print(
+            f'{n_queries} queries for {n_results} results: '
+            f'mean {latencies.mean():.1f}ms, '
+            f'p50 {np.percentile(latencies, 50):.1f}ms, '
+            f'p99 {np.percentile(latencies, 99):.1f}ms')
+        print(
+            f'batches of {batch_size}: '
+            f'{n_queries / batch_elapsed:.0f} queries/s')
+
+
+def multi_index(
+        code_counts,
+        n_bits,
+        n_queries,
+        n_results,
+        codes_per_cluster,
+        noise,
+        codes_per_append=100000):
+    """
+    Compare exact k-nearest-neighbor search with multi-index hashing against
+    a brute-force scan over the same clustered codes, checking that both
+    return the same results
+    """
+    n_words = n_bits // 64
+    brute_force = HammingIndex(n_words)
+    multi = MultiIndexHammingIndex(n_words)
+
+    for n_codes in sorted(code_counts):
+        n_clusters = max(1, n_codes // codes_per_cluster)
+        while len(multi) < n_codes:
+            count = min(codes_per_append, n_codes - len(multi))
+            codes = clustered_codes(count, n_bits, n_clusters, noise)
+            brute_force.append(codes)
+            multi.append(codes)
+
+        queries = clustered_codes(n_queries, n_bits, n_clusters, noise)
+        timings = []
+        results = []
+        for index in (brute_force, multi):
+            start = time.time()
+            results.append([
+                index.search(query[None, :], n_results)
+                for query in queries])
+            timings.append((time.time() - start) / n_queries * 1000)
+
+        exact = all(
+            (a[0] == b[0]).all() and (a[1] == b[1]).all()
+            for a, b in zip(*results))
+        print(
+            f'{n_codes} {n_bits}-bit codes in clusters of '
+            f'{codes_per_cluster} with noise {noise}: '
+            f'brute force {timings[0]:.2f}ms, '
+            f'multi-index {timings[1]:.2f}ms per query '
+            f'({timings[0] / timings[1]:.1f}x, '
+            f'{brute_force.nbytes / 1e6:.0f}MB vs '
+            f'{multi.nbytes / 1e6:.0f}MB), '
+            f'{"identical" if exact else "DIFFERENT"} results')
+
+
+def sharded(n_vectors, vectors_per_sound, shard_counts, n_queries, n_results):
+    """
+    Compare batched search throughput over an index partitioned across
+    different numbers of worker processes, and the time taken, and fraction
+    of sounds moved, when a shard is added
+    """
+    index = Index(0.5, 'benchmark')
+    index.extend(
+        (f'{i:032x}', unit_vectors(vectors_per_sound, 3).astype(np.float32))
+        for i in range(n_vectors // vectors_per_sound))
+    queries = unit_vectors(n_queries, 3).astype(np.float32)
+
+    start = time.time()
+    index.search_batch(queries, n_results)
+    elapsed = time.time() - start
+    print(
+        f'{len(index.tree)} vectors in one process: '
+        f'{n_queries / elapsed:.0f} queries/s')
+
+    for n_shards in shard_counts:
+        sharded_index = ShardedIndex.from_index(index, n_shards)
+        start = time.time()
+        sharded_index.search_batch(queries, n_results)
+        elapsed = time.time() - start
+
+        start = time.time()
+        sharded_index.add_shard()
+        rebalance_elapsed = time.time() - start
+        added = sharded_index.shard_info()[-1]
+        sharded_index.close()
+
+        print(
+            f'{n_shards} shards: {n_queries / elapsed:.0f} queries/s, '
+            f'adding a shard moved '
+            f'{added["sounds"] / len(index.ids):.1%} of sounds '
+            f'in {rebalance_elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    append_parser = subparsers.add_parser('append')
+    append_parser.add_argument('--vectors', type=int, default=10000000)
+    append_parser.add_argument('--vectors-per-sound', type=int, default=400)
+    append_parser.add_argument('--report-every', type=int, default=1000000)
+
+    search_parser = subparsers.add_parser('search')
+    search_parser.add_argument('--vectors', type=int, default=1000000)
+    search_parser.add_argument('--queries', type=int, default=1000)
+    search_parser.add_argument('--results', type=int, default=10)
+
+    recall_parser = subparsers.add_parser('recall')
+    recall_parser.add_argument('--vectors', type=int, default=1000000)
+    recall_parser.add_argument('--queries', type=int, default=1000)
+    recall_parser.add_argument('--results', type=int, default=10)
+    recall_parser.add_argument(
+        '--candidates',
+        type=int,
+        nargs='+',
+        default=[100, 250, 500, 1000, 2500, 5000, 10000])
+    recall_parser.add_argument('--max-leaves', type=int, default=None)
+    recall_parser.add_argument(
+        '--max-leaves-per-tree', type=int, default=None)
+    recall_parser.add_argument('--threshold', type=float, default=0.001)
+
+    hamming_parser = subparsers.add_parser('hamming')
+    hamming_parser.add_argument(
+        '--codes', type=int, nargs='+', default=[1000000, 10000000])
+    hamming_parser.add_argument('--bits', type=int, default=128)
+    hamming_parser.add_argument('--queries', type=int, default=100)
+    hamming_parser.add_argument('--batch-size', type=int, default=25)
+    hamming_parser.add_argument('--results', type=int, default=10)
+    hamming_parser.add_argument('--threads', type=int, default=None)
+
+    multi_index_parser = subparsers.add_parser('multi-index')
+    multi_index_parser.add_argument(
+        '--codes', type=int, nargs='+', default=[1000000, 10000000])
+    multi_index_parser.add_argument('--bits', type=int, default=128)
+    multi_index_parser.add_argument('--queries', type=int, default=100)
+    multi_index_parser.add_argument('--results', type=int, default=10)
+    multi_index_parser.add_argument(
+        '--codes-per-cluster', type=int, default=100)
+    multi_index_parser.add_argument('--noise', type=float, default=0.05)
+
+    sharded_parser = subparsers.add_parser('sharded')
+    sharded_parser.add_argument('--vectors', type=int, default=1000000)
+    sharded_parser.add_argument('--vectors-per-sound', type=int, default=400)
+    sharded_parser.add_argument(
+        '--shards', type=int, nargs='+', default=[1, 2, 4])
+    sharded_parser.add_argument('--queries', type=int, default=1000)
+    sharded_parser.add_argument('--results', type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'append':
+        append(args.vectors, args.vectors_per_sound, args.report_every)
+    elif args.benchmark == 'search':
+        search(args.vectors, args.queries, args.results)
+    elif args.benchmark == 'recall':
+        recall(
+            args.vectors,
+            args.queries,
+            args.results,
+            args.candidates,
+            args.max_leaves,
+            args.max_leaves_per_tree,
+            args.threshold)
+    elif args.benchmark == 'hamming':
+        hamming(
+            args.codes,
+            args.bits,
+            args.queries,
+            args.batch_size,
+            args.results,
+            args.threads)
+    elif args.benchmark == 'multi-index':
+        multi_index(
+            args.codes,
+            args.bits,
+            args.queries,
+            args.results,
+            args.codes_per_cluster,
+            args.noise)
+    elif args.benchmark == 'sharded':
+        sharded(
+            args.vectors,
+            args.vectors_per_sound,
+            args.shards,
+            args.queries,
+            args.results)
+    else:
+        parser.print_help()
@@ -4,14 +4,25 @@ import json
 from io import BytesIO
 import time
 import argparse
+import struct
+import zlib
+import hashlib
+import threading
+import queue
+from concurrent.futures import \
+    ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, \
+    FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 
 import requests
 from cli import DefaultArgumentParser
 from client import Client
-from s3client import ObjectStorageClient
+from checkpoint import CheckpointStore, IngestManifest
+from s3client import ObjectStorageClient, MB
 from zounds.persistence import DimensionEncoder, DimensionDecoder
 import zounds
-from mp3encoder import encode_mp3
+from mp3encoder import EncoderPool
 from http import client
 from pathlib import Path
 import soundfile
@@ -51,26 +62,50 @@ def annotation_stream(
         low_id, items = fetch(low_id)
 
 
-class PersistentValue(object):
-    def __init__(self, path):
-        self.path = path
+FEATURE_MAGIC = b'FEAT'
+FEATURE_FORMAT_VERSION = 1
+FEATURE_ALIGNMENT = 64
 
-    def __get__(self, instance, owner):
-        try:
-            with open(self.path, 'r') as f:
-                return f.read()
-        except IOError:
-            return None
+# magic, format version, reserved, header length
+FEATURE_PREAMBLE = struct.Struct('<4sHHI')
 
-    def __set__(self, instance, value):
-        with open(self.path, 'w') as f:
-            f.write(value)
+LEGACY_PREAMBLE = struct.Struct('<I')
+
+# Arrays are split into chunks of this many frames along their first (usually
+# time) axis, so that time slices can be located and fetched independently
+DEFAULT_CHUNK_FRAMES = 512
 
 
 class BinaryData(object):
-    def __init__(self, arr_with_units):
+    """
+    Pack an array with units into a self-describing binary format:
+
+        magic | version (uint16) | reserved (uint16) | header length (uint32)
+        | JSON header | padding | array data
+
+    Array data begins on a 64-byte boundary, so readers (including browsers)
+    can view it in place without copying.  Arrays may optionally be split into
+    chunks along their first axis, which are listed in the header and may be
+    compressed independently.  Given the header, the bytes holding any range
+    of frames can be computed, so time slices of stored features can be
+    fetched with HTTP range requests (see `fetch_time_slice`).
+
+    Objects written before this format existed, which begin with a uint32
+    header length and have no magic, can still be unpacked.
+    """
+
+    def __init__(
+            self,
+            arr_with_units,
+            chunk_frames=DEFAULT_CHUNK_FRAMES,
+            compression=None):
         super().__init__()
         self.arr = arr_with_units
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+
+        if compression not in (None, 'zlib'):
+            raise ValueError(f'Unsupported compression {compression}')
 
     def metadata(self):
         encoder = DimensionEncoder()
@@ -83,74 +118,603 @@ class BinaryData(object):
         }
         return metadata
 
+    def _chunk_bounds(self):
+        n_frames = len(self.arr)
+        step = self.chunk_frames or n_frames or 1
+        for start in range(0, n_frames, step):
+            yield start, min(n_frames, start + step)
+
     def packed_format(self):
+        """
+        Pack the array and its metadata into a single, pre-allocated buffer
+        """
+        arr = np.ascontiguousarray(self.arr)
+        frame_bytes = arr[:1].nbytes
+
+        chunked = self.chunk_frames or self.compression
+        chunks = []
+        payloads = []
+        offset = 0
+        for start, stop in (self._chunk_bounds() if chunked else []):
+            if self.compression == 'zlib':
+                payload = zlib.compress(memoryview(arr[start:stop]))
+                payloads.append(payload)
+                size = len(payload)
+            else:
+                size = (stop - start) * frame_bytes
+            chunks.append({
+                'start_frame': start,
+                'stop_frame': stop,
+                'offset': offset,
+                'size': size
+            })
+            offset += size
+
         metadata = self.metadata()
-        metadata_raw = json.dumps(metadata).encode()
-        payload = \
-            np.uint32(len(metadata_raw)).tostring() \
-            + metadata_raw \
-            + self.arr.tostring()
-        return payload
+        metadata.update(
+            version=FEATURE_FORMAT_VERSION,
+            compression=self.compression,
+            chunks=chunks or None)
+        header = json.dumps(metadata).encode()
+
+        header_end = FEATURE_PREAMBLE.size + len(header)
+        data_offset = \
+            -(-header_end // FEATURE_ALIGNMENT) * FEATURE_ALIGNMENT
+        data_size = offset if payloads else arr.nbytes
+
+        buf = bytearray(data_offset + data_size)
+        FEATURE_PREAMBLE.pack_into(
+            buf, 0, FEATURE_MAGIC, FEATURE_FORMAT_VERSION, 0, len(header))
+        buf[FEATURE_PREAMBLE.size: header_end] = header
+
+        if payloads:
+            for chunk, payload in zip(chunks, payloads):
+                start = data_offset + chunk['offset']
+                buf[start: start + chunk['size']] = payload
+        else:
+            data = np.frombuffer(
+                buf, dtype=arr.dtype, count=arr.size, offset=data_offset)
+            data[:] = arr.reshape(-1)
+
+        return buf
 
     def packed_file_like_object(self):
         return BytesIO(self.packed_format())
 
+    @staticmethod
+    def header_size(preamble):
+        """
+        Given at least the first `FEATURE_PREAMBLE.size` bytes of a packed
+        array, return the number of bytes needed to read its header
+        """
+        magic, _, _, header_length = FEATURE_PREAMBLE.unpack_from(preamble, 0)
+        if magic != FEATURE_MAGIC:
+            header_length, = LEGACY_PREAMBLE.unpack_from(preamble, 0)
+            return LEGACY_PREAMBLE.size + header_length
+        return FEATURE_PREAMBLE.size + header_length
+
+    @staticmethod
+    def unpack_header(packed):
+        """
+        Return the metadata of a packed array, and the offset at which its
+        array data begins
+        """
+        magic, version, _, header_length = \
+            FEATURE_PREAMBLE.unpack_from(packed, 0)
+
+        if magic != FEATURE_MAGIC:
+            header_length, = LEGACY_PREAMBLE.unpack_from(packed, 0)
+            start = LEGACY_PREAMBLE.size
+            metadata = json.loads(bytes(packed[start: start + header_length]))
+            return metadata, start + header_length
+
+        if version > FEATURE_FORMAT_VERSION:
+            raise ValueError(f'Unsupported feature format version {version}')
+
+        start = FEATURE_PREAMBLE.size
+        header_end = start + header_length
+        metadata = json.loads(bytes(packed[start: header_end]))
+        data_offset = \
+            -(-header_end // FEATURE_ALIGNMENT) * FEATURE_ALIGNMENT
+        return metadata, data_offset
+
+    @staticmethod
+    def _with_units(raw, metadata):
+        dim_decoder = DimensionDecoder()
+        return zounds.ArrayWithUnits(
+            raw, list(dim_decoder.decode(metadata['dimensions'])))
+
+    @staticmethod
+    def _decompress(packed, metadata, chunks, data_offset):
+        """
+        Decompress a contiguous run of chunks, where `data_offset` is the
+        position in `packed` of the first byte of array data
+        """
+        dtype = np.dtype(metadata['type'])
+        frame_shape = tuple(metadata['shape'][1:])
+        if not chunks:
+            return np.empty((0,) + frame_shape, dtype=dtype)
+
+        first_frame = chunks[0]['start_frame']
+        n_frames = chunks[-1]['stop_frame'] - first_frame
+        raw = np.empty((n_frames,) + frame_shape, dtype=dtype)
+        for chunk in chunks:
+            start = data_offset + chunk['offset']
+            decompressed = zlib.decompress(
+                packed[start: start + chunk['size']])
+            raw[chunk['start_frame'] - first_frame:
+                chunk['stop_frame'] - first_frame] = \
+                np.frombuffer(decompressed, dtype=dtype).reshape(
+                    (-1,) + frame_shape)
+        return raw
+
     @staticmethod
     def unpack(packed_array_with_units):
-        x = packed_array_with_units
-        json_length = np.fromstring(x[:4], dtype=np.uint32)[0]
-        data = json.loads(x[4: json_length + 4])
-        raw = np.fromstring(
-            x[json_length + 4:],
-            dtype=np.dtype(data['type'])).reshape(data['shape'])
+        """
+        Unpack an array from any bytes-like object.  Uncompressed data is a
+        read-only view of the packed buffer, rather than a copy
+        """
+        packed = memoryview(packed_array_with_units)
+        metadata, data_offset = BinaryData.unpack_header(packed)
+
+        if metadata.get('compression'):
+            raw = BinaryData._decompress(
+                packed, metadata, metadata['chunks'], data_offset)
+        else:
+            dtype = np.dtype(metadata['type'])
+            shape = metadata['shape']
+            raw = np.frombuffer(
+                packed,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=data_offset).reshape(shape)
+        return BinaryData._with_units(raw, metadata)
+
+    @staticmethod
+    def unpack_file(path):
+        """
+        Unpack an array stored on disk.  Uncompressed data is memory-mapped,
+        so it is only read from disk as it is accessed
+        """
+        with open(path, 'rb') as f:
+            preamble = f.read(FEATURE_PREAMBLE.size)
+            f.seek(0)
+            metadata, data_offset = BinaryData.unpack_header(
+                f.read(BinaryData.header_size(preamble)))
+
+        if metadata.get('compression'):
+            with open(path, 'rb') as f:
+                return BinaryData.unpack(f.read())
+
+        raw = np.memmap(
+            path,
+            dtype=np.dtype(metadata['type']),
+            mode='r',
+            offset=data_offset,
+            shape=tuple(metadata['shape']))
+        return BinaryData._with_units(raw, metadata)
+
+    @staticmethod
+    def frame_range(metadata, start_seconds, end_seconds):
+        """
+        Return the range of frames, `[first, stop)`, whose windows overlap the
+        interval `[start_seconds, end_seconds)`
+        """
         dim_decoder = DimensionDecoder()
-        arr = zounds.ArrayWithUnits(
-            raw, list(dim_decoder.decode(data['dimensions'])))
-        return arr
+        time_dimension = next(dim_decoder.decode(metadata['dimensions']))
+        if not isinstance(time_dimension, zounds.TimeDimension):
+            raise ValueError('The first dimension is not a time dimension')
+
+        frequency = time_dimension.frequency / zounds.Seconds(1)
+        duration = time_dimension.duration / zounds.Seconds(1)
+        n_frames = metadata['shape'][0]
+
+        first = int(np.floor((start_seconds - duration) / frequency)) + 1
+        first = max(0, first)
+        stop = min(n_frames, int(np.ceil(end_seconds / frequency)))
+        return first, max(first, stop)
+
+    @staticmethod
+    def byte_range(metadata, data_offset, first, stop):
+        """
+        Return the inclusive byte range holding frames `[first, stop)`, along
+        with the chunks it spans if the array is compressed
+        """
+        if metadata.get('compression'):
+            chunks = [
+                chunk for chunk in metadata['chunks']
+                if chunk['stop_frame'] > first and chunk['start_frame'] < stop]
+            start = data_offset + chunks[0]['offset']
+            end = data_offset + chunks[-1]['offset'] + chunks[-1]['size']
+            return (start, end - 1), chunks
+
+        frame_shape = metadata['shape'][1:]
+        frame_bytes = \
+            np.dtype(metadata['type']).itemsize * int(np.prod(frame_shape))
+        start = data_offset + (first * frame_bytes)
+        end = data_offset + (stop * frame_bytes)
+        return (start, end - 1), None
+
+    @staticmethod
+    def fetch_time_slice(
+            data_url,
+            start_seconds,
+            end_seconds,
+            session=requests,
+            header_bytes=16384):
+        """
+        Fetch only the frames of a stored feature that overlap
+        `[start_seconds, end_seconds)`, using HTTP range requests so that the
+        bytes transferred are proportional to the length of the slice.
+
+        Returns the sliced array and the index of its first frame.
+        """
+
+        def get_range(start, end):
+            resp = session.get(
+                data_url, headers={'Range': f'bytes={start}-{end}'})
+            resp.raise_for_status()
+            return resp.status_code == client.PARTIAL_CONTENT, resp.content
+
+        partial_content, head = get_range(0, header_bytes - 1)
+
+        if not partial_content:
+            # the server ignored the range and returned the entire object
+            arr = BinaryData.unpack(head)
+            first, stop = BinaryData.frame_range(
+                BinaryData.unpack_header(head)[0], start_seconds, end_seconds)
+            return arr[first: stop], first
+
+        size = BinaryData.header_size(head)
+        if size > len(head):
+            _, head = get_range(0, size - 1)
+
+        metadata, data_offset = BinaryData.unpack_header(head)
+        first, stop = BinaryData.frame_range(
+            metadata, start_seconds, end_seconds)
+        frame_shape = tuple(metadata['shape'][1:])
+        dtype = np.dtype(metadata['type'])
+
+        if first == stop:
+            raw = np.empty((0,) + frame_shape, dtype=dtype)
+            return BinaryData._with_units(raw, metadata), first
+
+        (start, end), chunks = BinaryData.byte_range(
+            metadata, data_offset, first, stop)
+        _, content = get_range(start, end)
+
+        if chunks:
+            raw = BinaryData._decompress(
+                memoryview(content), metadata, chunks, -chunks[0]['offset'])
+            offset = first - chunks[0]['start_frame']
+            raw = raw[offset: offset + (stop - first)]
+        else:
+            raw = np.frombuffer(content, dtype=dtype).reshape(
+                (-1,) + frame_shape)
+        return BinaryData._with_units(raw, metadata), first
+
+
+class FeatureCache(object):
+    """
+    A size-bounded, disk-backed cache of stored features, shared by every bot
+    and indexer on a host that uses the same directory.
+
+    Entries are content-addressed by URL and ETag.  Once fetched, a URL is
+    revalidated with a conditional request at most every
+    `revalidate_seconds`, so repeated reads of the same feature, e.g. by
+    chained bots or across training epochs, don't download it again.  The
+    least-recently-used entries are evicted once the cache exceeds
+    `max_bytes`.
+    """
 
+    def __init__(
+            self,
+            directory=None,
+            max_bytes=2 * 1024 ** 3,
+            revalidate_seconds=300,
+            session=requests):
+
+        super().__init__()
+        self.directory = directory or os.environ.get(
+            'FEATURE_CACHE_DIR',
+            os.path.expanduser('~/.cache/cochlea/features'))
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.session = session
+        self._lock = threading.Lock()
+        self._validated = {}
+        self._total_bytes = None
+
+    @staticmethod
+    def _digest(*parts):
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+    def _entry_path(self, url, etag):
+        # entries are named for both digests, so that eviction can find, and
+        # remove, the ETag that refers to them
+        digest = self._digest(url)
+        name = f'{digest}-{self._digest(etag)}'
+        return os.path.join(self.directory, 'data', digest[:2], name)
 
-class MetaListener(type):
-    def __init__(cls, name, bases, attrs):
-        super(MetaListener, cls).__init__(name, bases, attrs)
-        cls.low_id = PersistentValue(f'{cls.__name__}.dat')
+    def _etag_path(self, url):
+        return self._digest_etag_path(self._digest(url))
 
+    def _digest_etag_path(self, digest):
+        return os.path.join(self.directory, 'etags', digest[:2], digest)
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def _read_etag(self, url):
+        return self._read_etag_file(self._etag_path(url))
+
+    @staticmethod
+    def _read_etag_file(path):
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _remove_etag(self, entry_path):
+        """
+        Remove the ETag referring to an evicted entry, so that its URL is
+        fetched unconditionally next time
+        """
+        name = os.path.basename(entry_path)
+        url_digest, _, etag_digest = name.partition('-')
+        etag_path = self._digest_etag_path(url_digest)
+        etag = self._read_etag_file(etag_path)
+        if etag is None or self._digest(etag) != etag_digest:
+            # the URL has since been stored under a newer ETag
+            return
+        try:
+            os.remove(etag_path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        data_dir = os.path.join(self.directory, 'data')
+        for root, _, filenames in os.walk(data_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        """
+        Remove least-recently-used entries until the cache fits in
+        `max_bytes`.  Other processes may share the directory, so its actual
+        size is re-measured before evicting
+        """
+        entries = sorted(self._entries())
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._remove_etag(path)
+            self._total_bytes -= size
+
+    def _store(self, url, etag, content):
+        path = self._entry_path(url, etag)
+        self._write(path, content)
+        self._write(self._etag_path(url), etag.encode())
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._evict()
+            else:
+                self._total_bytes += len(content)
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        return path
+
+    def get_path(self, url):
+        """
+        Return the path of a local copy of the resource at `url`, fetching it
+        only if it isn't cached or has changed
+        """
+        etag = self._read_etag(url)
+        path = etag and self._entry_path(url, etag)
+
+        if path and os.path.exists(path):
+            with self._lock:
+                validated_at = self._validated.get(url, 0)
+            if time.time() - validated_at < self.revalidate_seconds:
+                os.utime(path)
+                return path
+            resp = self.session.get(url, headers={'If-None-Match': etag})
+        else:
+            resp = self.session.get(url)
+
+        if resp.status_code == client.NOT_MODIFIED:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # evicted, possibly by another process, while revalidating
+                resp = self.session.get(url)
+
+        if resp.status_code != client.NOT_MODIFIED:
+            resp.raise_for_status()
+            etag = resp.headers.get('ETag')
+            if etag is None:
+                # without an ETag there's no way to tell when the resource
+                # changes, so store it under a digest of its content
+                etag = hashlib.sha256(resp.content).hexdigest()
+            path = self._store(url, etag, resp.content)
+
+        with self._lock:
+            self._validated[url] = time.time()
+        return path
+
+    def get(self, url):
+        with open(self.get_path(url), 'rb') as f:
+            return f.read()
+
+
+class BaseListener(object):
+    """
+    Process a stream of resources, recording the id of the last resource
+    processed so that work can resume where it left off.
+
+    Listeners may split their work into three stages:
+
+        - `_fetch_resource`, which performs I/O to gather inputs
+        - `compute`, a picklable, CPU-bound function of those inputs
+        - `_store_result`, which performs I/O to persist the output
+
+    Listeners that do so can be run as a pipeline, with fetch and store stages
+    for many resources running concurrently on a thread pool, and the compute
+    stage on a process pool so that every core is put to work.
+    """
+
+    # A picklable function (e.g. a module-level function wrapped in
+    # staticmethod) transforming the output of `_fetch_resource` into the
+    # input of `_store_result`
+    compute = None
 
-class BaseListener(object, metaclass=MetaListener):
     def __init__(self, get_resources_func, s3_client, page_size=3, logger=None):
         super().__init__()
         self.logger = logger
         self.get_resources_func = get_resources_func
         self.s3_client = s3_client
         self.page_size = page_size
-
-    def _iter_resources(self):
-        self.logger.info(f'Resuming from {self.low_id}')
+        self.checkpoint = CheckpointStore.for_listener(self.__class__)
+        self.feature_cache = FeatureCache()
+
+    @property
+    def low_id(self):
+        return self.checkpoint.value
+
+    def _iter_resources(self, wait_while_idle=None):
+        """
+        Yield resources from the stream indefinitely, calling
+        `wait_while_idle` (by default, sleeping for a second) between polls
+        of an empty stream
+        """
+        wait_while_idle = wait_while_idle or partial(time.sleep, 1)
+        low_id = self.low_id
+        self.logger.info(f'Resuming from {low_id}')
         while True:
-            time.sleep(1)
-            data = self.get_resources_func(self.low_id, self.page_size)
+            data = self.get_resources_func(low_id, self.page_size)
+            if not data['items']:
+                wait_while_idle()
+                # persist progress made since the stream went quiet
+                self.checkpoint.maybe_flush()
             for item in data['items']:
                 yield item
+                low_id = item['id']
+
+    def _fetch_resource(self, resource):
+        raise NotImplementedError()
+
+    def _store_result(self, resource, result):
+        raise NotImplementedError()
+
+    def _process_staged(self, resource, cpu_pool=None):
+        fetched = self._fetch_resource(resource)
+        if cpu_pool is None:
+            result = self.compute(fetched)
+        else:
+            result = cpu_pool.submit(self.compute, fetched).result()
+        return self._store_result(resource, result)
 
     def _process_resource(self, resource):
         raise NotImplementedError()
 
+    def _process_pipelined(self, resource, cpu_pool):
+        self.logger.info(resource['id'])
+        if self.compute is None:
+            return self._process_resource(resource)
+        return self._process_staged(resource, cpu_pool)
+
+    def _complete(self, resource, wait_for_result):
+        try:
+            wait_for_result()
+        except BrokenProcessPool:
+            raise
+        except (ValueError, RuntimeError) as e:
+            # typically this is caused by audio in a bad format
+            self.logger.error(
+                f'Encountered error for {resource["id"]}: {e}')
+        self.checkpoint.finish(resource['id'])
+
     def _run(self):
         for resource in self._iter_resources():
             self.logger.info(resource['id'])
-            try:
-                self._process_resource(resource)
-            except (ValueError, RuntimeError) as e:
-                # typically this is caused by audio in a bad format
-                self.logger.error(
-                    f'Encountered error for {resource["id"]}: {e}')
-                pass
-            self.low_id = resource['id']
+            self.checkpoint.start(resource['id'])
+            self._complete(
+                resource, partial(self._process_resource, resource))
+
+    def _run_pipelined(self, io_workers, cpu_workers, max_pending=None):
+        """
+        Process up to `max_pending` resources concurrently.  Resources may
+        finish in any order, and the checkpoint only advances past the
+        contiguous run of finished resources at the front of the stream
+        """
+        max_pending = max_pending or io_workers * 2
+        pending = {}
+        cpu_pool = \
+            ProcessPoolExecutor(cpu_workers) \
+            if cpu_workers and self.compute is not None else None
+
+        def complete(futures):
+            for future in futures:
+                self._complete(pending.pop(future), future.result)
+
+        def wait_while_idle():
+            # keep collecting finished work while the stream is quiet, so the
+            # checkpoint doesn't lag behind the resources already processed
+            if pending:
+                done, _ = wait(pending, timeout=1)
+                complete(done)
+            else:
+                time.sleep(1)
 
-    def run(self):
         try:
-            self._run()
+            with ThreadPoolExecutor(io_workers) as io_pool:
+                try:
+                    for resource in self._iter_resources(wait_while_idle):
+                        self.checkpoint.start(resource['id'])
+                        future = io_pool.submit(
+                            self._process_pipelined, resource, cpu_pool)
+                        pending[future] = resource
+
+                        if len(pending) >= max_pending:
+                            done, _ = wait(
+                                pending, return_when=FIRST_COMPLETED)
+                        else:
+                            done = [f for f in pending if f.done()]
+                        complete(done)
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            if cpu_pool is not None:
+                cpu_pool.shutdown()
+
+    def run(self, io_workers=0, cpu_workers=0, max_pending=None):
+        try:
+            if io_workers:
+                self._run_pipelined(io_workers, cpu_workers, max_pending)
+            else:
+                self._run()
         except KeyboardInterrupt:
             return self
+        finally:
+            self.checkpoint.close()
 
     def __enter__(self):
         return self
@@ -165,8 +729,26 @@ class SoundListener(BaseListener):
         self.client = client
         super().__init__(client.get_sounds, s3_client, page_size, logger)
 
+    def _fetch_resource(self, sound):
+        resp = requests.get(sound['audio_url'])
+        return resp.content
+
+    def _store_result(self, sound, packed_feature):
+        data_url = self.s3_client.put_object(
+            sound['id'],
+            BytesIO(packed_feature),
+            'application/octet-stream')
+        self.logger.info(f'pushed binary data to {data_url}')
+
+        self.client.create_annotations(sound['id'], {
+            'start_seconds': 0,
+            'duration_seconds': sound['duration_seconds'],
+            'data_url': data_url
+        })
+        self.logger.info('created annotation')
+
     def _process_sound(self, sound):
-        raise NotImplementedError()
+        return self._process_staged(sound)
 
     def _process_resource(self, resource):
         return self._process_sound(resource)
@@ -199,7 +781,7 @@ class AnnotationListener(BaseListener):
         self.bot = None
         super().__init__(None, s3_client, page_size, logger)
 
-    def run(self):
+    def run(self, io_workers=0, cpu_workers=0, max_pending=None):
         self.bot = retry(self.client.get_user, 30)(self.subscribed_to)
         self.logger.info(f'subscribed to user {self.bot}')
 
@@ -208,19 +790,54 @@ class AnnotationListener(BaseListener):
                 self.bot['id'], low_id, page_size)
 
         self.get_resources_func = f
-        return super().run()
+        return super().run(io_workers, cpu_workers, max_pending)
 
     def _sound_id_from_uri(self, sound_uri):
         return os.path.split(sound_uri)[-1]
 
+    def _fetch_resource(self, annotation):
+        return self.feature_cache.get(annotation['data_url'])
+
+    def _store_result(self, annotation, packed_feature):
+        sound_id = self._sound_id_from_uri(annotation['sound'])
+
+        data_url = self.s3_client.put_object(
+            sound_id,
+            BytesIO(packed_feature),
+            'application/octet-stream')
+        self.logger.info(f'pushed binary data to {data_url}')
+
+        self.client.create_annotations(sound_id, {
+            'start_seconds': annotation['start_seconds'],
+            'duration_seconds': annotation['duration_seconds'],
+            'data_url': data_url
+        })
+        self.logger.info('created annotation')
+
     def _process_annotation(self, annotation):
-        raise NotImplementedError()
+        return self._process_staged(annotation)
 
     def _process_resource(self, resource):
         return self._process_annotation(resource)
 
 
 class BotDriver(object):
+    """
+    Import a dataset bot's sounds as a staged pipeline:
+
+        read -> encode -> upload -> register -> annotate
+
+    Sounds are read on a background thread, mp3s are encoded on an
+    `EncoderPool`, audio is uploaded by the object storage client's transfer
+    pool, and sounds are registered and annotated by a pool of ingest
+    workers.  Each stage has its own worker count, and reading pauses
+    whenever `max_pending` sounds are in flight.
+
+    Fully-imported sounds are recorded in a local manifest, and skipped when
+    an import is restarted.  Bots' `iter_sounds` methods are passed a `skip`
+    predicate, so they can avoid even downloading those sounds.
+    """
+
     def __init__(self, args, logger, bot):
         super().__init__()
         self.bot = bot
@@ -230,8 +847,12 @@ class BotDriver(object):
             region=args.s3_region,
             access_key=args.aws_access_key_id,
             secret=args.aws_secret_access_key,
-            bucket=bot.bucket_name)
+            bucket=bot.bucket_name,
+            max_concurrency=args.upload_workers,
+            multipart_threshold=args.s3_multipart_threshold_mb * MB)
         self.object_storage_client.ensure_bucket_exists()
+        self.manifest = IngestManifest(
+            args.manifest_path or f'{bot.user_name}.manifest.jsonl')
         self.args = args
         self.logger = logger
 
@@ -242,6 +863,30 @@ class BotDriver(object):
         except IOError:
             return self.bot.about_me
 
+    def _iter_sounds(self):
+        sounds = self.bot.iter_sounds(skip=self.manifest.__contains__)
+        for name, bio, metadata in sounds:
+            if name in self.manifest:
+                self.logger.info(f'Already imported {name}. Skipping.')
+                continue
+            yield name, bio, metadata
+
+    def _read(self, sounds, should_stop):
+        """
+        Read sounds into a bounded queue, blocking while it's full.  An error
+        raised while reading is kept, so that `run` can re-raise it once the
+        sounds read so far have been imported
+        """
+        try:
+            for sound in self._iter_sounds():
+                if should_stop.is_set():
+                    return
+                sounds.put(sound)
+        except BaseException as e:
+            self._read_error = e
+        finally:
+            sounds.put(None)
+
     def run(self):
         user_uri = self.annotate_client.upsert_dataset(
             user_name=self.bot.user_name,
@@ -251,53 +896,103 @@ class BotDriver(object):
             info_url=self.bot.info_url)
         self.logger.info(f'Added or updated user {user_uri}')
 
-        for name, bio, metadata in self.bot.iter_sounds():
+        max_pending = self.args.max_pending
+        sounds = queue.Queue(maxsize=max_pending)
+        should_stop = threading.Event()
+        self._read_error = None
+        reader = threading.Thread(
+            target=self._read, args=(sounds, should_stop), daemon=True)
+        reader.start()
+
+        pending = set()
+
+        with EncoderPool(self.args.encoder_workers) as encoder_pool, \
+                ThreadPoolExecutor(self.args.ingest_workers) as ingest_pool:
             try:
-                encoded = encode_mp3(bio)
-            except RuntimeError:
+                while True:
+                    sound = sounds.get()
+                    if sound is None:
+                        break
+                    name, bio, metadata = sound
+                    encoded = encoder_pool.submit(bio)
+                    pending.add(ingest_pool.submit(
+                        self._add_sound, name, bio, metadata, encoded))
+
+                    # apply backpressure, and surface any errors
+                    if len(pending) >= max_pending:
+                        done, pending = wait(
+                            pending, return_when=FIRST_COMPLETED)
+                    else:
+                        done = {future for future in pending if future.done()}
+                        pending -= done
+                    for future in done:
+                        future.result()
+
+                for future in as_completed(pending):
+                    future.result()
+
+                reader.join()
+                if self._read_error is not None:
+                    raise self._read_error
+            finally:
+                should_stop.set()
+                for future in pending:
+                    future.cancel()
                 self.logger.info(
-                    f'Error decoding audio for {name}. Skipping.')
-                continue
-            path = Path(name)
+                    f'Encoder metrics: {encoder_pool.metrics()}')
 
-            low_quality_id = \
-                str(Path('low-quality') / path.with_suffix('.mp3'))
-            low_quality_url = self.object_storage_client.put_object(
-                low_quality_id, encoded, 'audio/mp3')
-            self.logger.info(f'Pushed {low_quality_url} to s3')
-            bio.seek(0)
+    def _add_sound(self, name, bio, metadata, encoded):
+        try:
+            encoded = encoded.result()
+        except RuntimeError:
+            self.logger.info(f'Error decoding audio for {name}. Skipping.')
+            return
+
+        path = Path(name)
+
+        low_quality_id = \
+            str(Path('low-quality') / path.with_suffix('.mp3'))
+        _id = str(path)
+        bio.seek(0)
+        low_quality_url, url = [
+            future.result() for future in
+            self.object_storage_client.put_objects([
+                (low_quality_id, encoded, 'audio/mp3'),
+                (_id, bio, 'audio/wav')
+            ])]
+        self.logger.info(f'Pushed {low_quality_url} and {url} to s3')
+        bio.seek(0)
+
+        info = soundfile.info(bio)
 
-            _id = str(path)
-            url = self.object_storage_client.put_object(_id, bio, 'audio/wav')
-            self.logger.info(f'Pushed audio data for {url} to s3')
+        try:
+            status, sound_uri, sound_id = self.annotate_client.create_sound(
+                audio_url=url,
+                low_quality_audio_url=low_quality_url,
+                info_url=self.bot.get_info_url(name, metadata),
+                license_type=self.bot.get_license_type(name, metadata),
+                title=str(path),
+                duration_seconds=info.duration)
+        except requests.exceptions.HTTPError as e:
+            self.logger.error(e.response.content)
+            raise
+
+        if status == client.CREATED:
             bio.seek(0)
+            annotations = self.bot.get_annotations(name, metadata, bio)
+            if annotations:
+                self.annotate_client.create_annotations(
+                    sound_id, *annotations)
+                self.logger.info(f'Created annotations for {sound_uri}')
+        elif status == client.CONFLICT:
+            self.logger.warning(
+                f'Already created sound and annotation for {sound_uri}')
+            # we've already created this sound and annotation
+            pass
+        else:
+            raise RuntimeError(f'Unexpected {status} encountered')
 
-            info = soundfile.info(bio)
-
-            try:
-                status, sound_uri, sound_id = self.annotate_client.create_sound(
-                    audio_url=url,
-                    low_quality_audio_url=low_quality_url,
-                    info_url=self.bot.get_info_url(name, metadata),
-                    license_type=self.bot.get_license_type(name, metadata),
-                    title=str(path),
-                    duration_seconds=info.duration)
-            except requests.exceptions.HTTPError as e:
-                self.logger.error(e.response.content)
-                raise
-
-            if status == client.CREATED:
-                annotations = self.bot.get_annotations(name, metadata, bio)
-                if annotations:
-                    self.annotate_client.create_annotations(*annotations)
-                    self.logger.info(f'Created annotations for {sound_uri}')
-            elif status == client.CONFLICT:
-                self.logger.warning(
-                    f'Already created sound and annotation for {sound_uri}')
-                # we've already created this sound and annotation
-                pass
-            else:
-                raise RuntimeError(f'Unexpected {status} encountered')
+        self.manifest.add(name, sound_id=sound_id)
 
 
 def about_me_metadata(binary_data):
@@ -348,6 +1043,31 @@ def main(
         page_size=100,
         logger=None):
     parser = argparse.ArgumentParser(parents=[DefaultArgumentParser()])
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=0,
+        help='threads fetching and storing data concurrently.  When zero, '
+             'resources are processed one at a time')
+    parser.add_argument(
+        '--cpu-workers',
+        type=int,
+        default=0,
+        help='processes computing features concurrently, for listeners '
+             'that define a compute stage')
+    parser.add_argument(
+        '--checkpoint-dir',
+        default='checkpoints',
+        help='directory where progress is recorded, namespaced by bot')
+    parser.add_argument(
+        '--feature-cache-dir',
+        default=None,
+        help='directory of the feature cache shared by bots on this host')
+    parser.add_argument(
+        '--feature-cache-bytes',
+        type=int,
+        default=2 * 1024 ** 3,
+        help='maximum size of the feature cache')
     args = parser.parse_args()
     client = Client(args.annotate_api_endpoint, logger=logger)
 
@@ -356,10 +1076,15 @@ def main(
         region=args.s3_region,
         access_key=args.aws_access_key_id,
         secret=args.aws_secret_access_key,
-        bucket=bucket_name)
+        bucket=bucket_name,
+        multipart_threshold=args.s3_multipart_threshold_mb * MB)
 
     listener = listener_cls(
         client, object_storage_client, page_size, logger=logger)
+    listener.checkpoint = CheckpointStore.for_listener(
+        listener_cls, checkpoint_dir=args.checkpoint_dir, namespace=user_name)
+    listener.feature_cache = FeatureCache(
+        args.feature_cache_dir, max_bytes=args.feature_cache_bytes)
 
     # get metadata describing feature shape and dimensions
     try:
@@ -392,5 +1117,6 @@ def main(
         about_me,
         info_url)
 
-    with listener.run():
+    with listener.run(
+            io_workers=args.io_workers, cpu_workers=args.cpu_workers):
         pass
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+class CheckpointStore(object):
+    """
+    Track a listener's progress through a stream of resources.
+
+    Resources are registered with `start` in stream order and marked with
+    `finish` as they complete, in any order.  The checkpoint only advances to
+    the last resource in the contiguous run of finished resources at the head
+    of the stream, so resuming from it never skips unfinished work.
+
+    The checkpoint is held in memory and flushed to disk at most every
+    `flush_interval_seconds`, and on `close`.  Besides `finish`, callers that
+    may go a while without finishing anything (e.g. a listener waiting on an
+    idle stream) should call `maybe_flush` periodically, so that a crash loses
+    at most one interval of progress.  Each flush writes a temporary
+    file and renames it over the previous checkpoint, so a crash mid-write
+    leaves the prior checkpoint intact.
+    """
+
+    def __init__(self, path, flush_interval_seconds=5, legacy_path=None):
+        super().__init__()
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self.legacy_path = legacy_path
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._in_flight = deque()
+        self._finished = set()
+        self._value = self._read()
+        self._dirty = False
+        self._last_flush = time.time()
+
+    @classmethod
+    def for_listener(
+            cls,
+            listener_cls,
+            checkpoint_dir='checkpoints',
+            namespace=None,
+            **kwargs):
+        """
+        Build a checkpoint store namespaced by bot and listener, falling back
+        to the per-class file in the working directory used by earlier versions
+        """
+        name = listener_cls.__name__
+        path = os.path.join(checkpoint_dir, namespace or '', f'{name}.json')
+        return cls(path, legacy_path=f'{name}.dat', **kwargs)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)['low_id']
+        except (IOError, ValueError, KeyError):
+            pass
+
+        if self.legacy_path is None:
+            return None
+
+        try:
+            with open(self.legacy_path, 'r') as f:
+                return f.read() or None
+        except IOError:
+            return None
+
+    @property
+    def value(self):
+        return self._value
+
+    def start(self, _id):
+        with self._lock:
+            self._in_flight.append(_id)
+
+    def finish(self, _id):
+        with self._lock:
+            self._finished.add(_id)
+            while self._in_flight and self._in_flight[0] in self._finished:
+                self._value = self._in_flight.popleft()
+                self._finished.remove(self._value)
+                self._dirty = True
+
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        """
+        Flush the checkpoint if it has advanced and the flush interval has
+        elapsed since the last flush
+        """
+        with self._lock:
+            elapsed = time.time() - self._last_flush
+            should_flush = \
+                self._dirty and elapsed >= self.flush_interval_seconds
+
+        if should_flush:
+            self.flush()
+
+    def update(self, _id):
+        """
+        Record a resource that was processed synchronously
+        """
+        self.start(_id)
+        self.finish(_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                value = self._value
+                self._dirty = False
+                self._last_flush = time.time()
+
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump({'low_id': value}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+
+            # ensure the rename itself is durable
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        self.flush()
+
+
+class IngestManifest(object):
+    """
+    An append-only record of the items a dataset bot has fully imported, so
+    that an interrupted import can be restarted without repeating work.  Each
+    line of the manifest is a JSON object with at least a `name` key.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._names = set(self._read())
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)['name']
+                    except (ValueError, KeyError):
+                        # a partially-written final line from a crash
+                        continue
+        except IOError:
+            return
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name, **data):
+        record = dict(data, name=name)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._names.add(name)
@@ -28,6 +28,12 @@ class DefaultArgumentParser(argparse.ArgumentParser):
             '--aws-secret-access-key',
             required=False,
             default=None)
+        self.add_argument(
+            '--s3-multipart-threshold-mb',
+            type=int,
+            default=64,
+            help='size above which uploads are split into parts, or 0 to '
+                 'disable multipart uploads for stand-ins such as fake-s3')
 
 
 class DatasetArgumentParser(DefaultArgumentParser):
@@ -37,3 +43,37 @@ class DatasetArgumentParser(DefaultArgumentParser):
             '--metadata-path',
             required=True,
             help='path to dataset on disk')
+        self.add_argument(
+            '--encoder-workers',
+            type=int,
+            default=4,
+            help='number of concurrent mp3 encoders')
+
+
+class BotDriverArgumentParser(DefaultArgumentParser):
+    def __init__(self):
+        super().__init__()
+        self.add_argument(
+            '--encoder-workers',
+            type=int,
+            default=4,
+            help='number of concurrent mp3 encoders')
+        self.add_argument(
+            '--upload-workers',
+            type=int,
+            default=8,
+            help='number of concurrent uploads to object storage')
+        self.add_argument(
+            '--ingest-workers',
+            type=int,
+            default=8,
+            help='number of sounds being uploaded and registered at once')
+        self.add_argument(
+            '--max-pending',
+            type=int,
+            default=32,
+            help='maximum number of sounds read but not yet fully imported')
+        self.add_argument(
+            '--manifest-path',
+            default=None,
+            help='file recording imported sounds, so that imports can resume')
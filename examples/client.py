@@ -51,7 +51,7 @@ class Client(object):
         }
         auth = (user_data['user_name'], user_data['password'])
         resource = self.uri('users')
-        resp = requests.post(resource, json=user_data)
+        resp = self.session.post(resource, json=user_data)
         location = resp.headers['location']
         if resp.status_code == client.CREATED:
             self.logger.info(f'Created user {user_name}')
@@ -63,7 +63,7 @@ class Client(object):
                 'password': password,
                 'about_me': user_data['about_me']
             }
-            resp = requests.patch(uri, json=update_data, auth=auth)
+            resp = self.session.patch(uri, json=update_data, auth=auth)
             resp.raise_for_status()
             self.logger.info(f'Updated user {user_name}')
         self.session.auth = auth
@@ -131,6 +131,22 @@ class Client(object):
         else:
             resp.raise_for_status()
 
+    def create_sounds(self, *sounds):
+        """
+        Register many sounds, each a dict of the arguments accepted by
+        `create_sound`, returning a list of `{status, id, uri}` results in
+        the same order.  Sounds that already exist are not created again
+        """
+        uri = self.uri('sounds/batch')
+        step = 500
+        results = []
+        for i in range(0, len(sounds), step):
+            resp = self.session.post(
+                uri, json={'sounds': sounds[i: i + step]})
+            resp.raise_for_status()
+            results.extend(resp.json()['items'])
+        return results
+
     def create_annotations(self, sound_id, *annotations):
         uri = self.uri(f'sounds/{sound_id}/annotations')
         step = 500
@@ -0,0 +1,415 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from hyperplane_tree import GrowableArray
+
+# the number of set bits in every possible 16-bit value, used to count bits
+# on versions of numpy that lack `np.bitwise_count`
+_POPCOUNT_16 = np.array(
+    [bin(i).count('1') for i in range(2 ** 16)], dtype=np.uint8)
+
+
+def popcount(arr):
+    """
+    Count the set bits in each element of an array of unsigned 64-bit integers
+    """
+    try:
+        return np.bitwise_count(arr)
+    except AttributeError:
+        counts = _POPCOUNT_16[np.ascontiguousarray(arr).view(np.uint16)]
+        return counts.reshape(arr.shape + (4,)).sum(axis=-1, dtype=np.uint8)
+
+
+class HammingIndex(object):
+    """
+    A brute-force index of binary codes, packed into `n_words` unsigned 64-bit
+    integers each, searched by hamming distance.
+
+    Codes are stored column-wise, one growable array per word, so that the
+    distance kernel XORs and counts bits over long contiguous runs.  Searches
+    scan the index in chunks, keeping only the best results from each, so
+    memory use is bounded regardless of the index's size, and chunks are
+    spread across a pool of `n_threads` threads; numpy releases the GIL while
+    it works on them
+    """
+
+    def __init__(self, n_words, chunk_size=65536, n_threads=None):
+        super().__init__()
+        self.n_words = n_words
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self._columns = [
+            GrowableArray(np.zeros((0,), dtype=np.uint64))
+            for _ in range(n_words)]
+        # searches on other threads only ever see a single attribute
+        # assignment, so every column they read has the same length
+        self._view = tuple(column.view for column in self._columns)
+        self._pool = None
+
+    def __len__(self):
+        return len(self._view[0])
+
+    def __getitem__(self, index):
+        return np.array([column[index] for column in self._view])
+
+    @property
+    def n_bits(self):
+        return self.n_words * 64
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns)
+
+    @property
+    def distance_dtype(self):
+        return np.uint8 if self.n_bits < 256 else np.uint16
+
+    def append(self, codes):
+        """
+        Add codes, an array of shape (n_codes, n_words), to the index
+        """
+        codes = np.asarray(codes, dtype=np.uint64).reshape(-1, self.n_words)
+        for i, column in enumerate(self._columns):
+            column.extend(codes[:, i])
+        self._view = tuple(column.view for column in self._columns)
+
+    def attach(self, columns):
+        """
+        Search `columns`, one array of codes per word, e.g. read-only views of
+        memory shared with another process, in place of the index's own
+        storage.  An attached index shouldn't be appended to
+        """
+        self._view = tuple(columns)
+
+    def _distances(self, view, queries, start, end):
+        dtype = self.distance_dtype
+        distances = None
+        for i, column in enumerate(view):
+            counts = popcount(column[start: end] ^ queries[:, i: i + 1])
+            if distances is None:
+                distances = counts.astype(dtype, copy=False)
+            else:
+                distances += counts
+        return distances
+
+    def distances(self, queries):
+        """
+        Compute the hamming distance from each query to every code in the
+        index, returning an array of shape (n_queries, len(self))
+        """
+        queries = np.asarray(queries, dtype=np.uint64).reshape(
+            -1, self.n_words)
+        view = self._view
+        return self._distances(view, queries, 0, len(view[0]))
+
+    def _search_chunk(self, view, queries, n_results, start, end):
+        distances = self._distances(view, queries, start, end)
+        n_queries = len(queries)
+        n_distances = self.n_bits + 1
+
+        # distances are small integers, so the distance of the nth-nearest
+        # code for each query can be read from a histogram, without sorting
+        offsets = np.arange(
+            0,
+            n_queries * n_distances,
+            n_distances,
+            dtype=np.min_scalar_type(n_queries * n_distances))
+        histograms = np.bincount(
+            (distances + offsets[:, None]).ravel(),
+            minlength=n_queries * n_distances)
+        totals = np.cumsum(
+            histograms.reshape(n_queries, n_distances), axis=-1)
+        radii = np.where(
+            totals[:, -1] > n_results,
+            np.argmax(totals >= n_results, axis=-1),
+            n_distances)
+
+        # keep every code at least as near as the nth-nearest, including ties
+        near = np.flatnonzero(distances <= radii[:, None])
+        rows, columns = np.divmod(near, distances.shape[1])
+        return rows, columns + start, distances.ravel()[near]
+
+    def _map(self, f, *iterables):
+        if self.n_threads == 1:
+            return list(map(f, *iterables))
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.n_threads)
+        return list(self._pool.map(f, *iterables))
+
+    def _candidates(self, view, queries, n_results, start, end):
+        """
+        Scan codes in the range [start, end) by brute force, returning the
+        query row, index and distance of the nearest candidates to each query
+        """
+        if start >= end:
+            return (
+                np.zeros((0,), dtype=np.int64),
+                np.zeros((0,), dtype=np.int64),
+                np.zeros((0,), dtype=self.distance_dtype))
+
+        # bound the size of the (n_queries, chunk) distance matrix computed
+        # for each chunk when searching for many queries at once
+        chunk_size = max(
+            n_results, self.chunk_size // len(queries), 1024)
+        chunks = self._map(
+            lambda chunk_start: self._search_chunk(
+                view,
+                queries,
+                n_results,
+                chunk_start,
+                min(chunk_start + chunk_size, end)),
+            range(start, end, chunk_size))
+        return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+    @staticmethod
+    def _nearest(rows, indices, distances, n_queries, n_results):
+        """
+        Order candidates by query, distance and then index, and keep the first
+        `n_results` for each query
+        """
+        order = np.lexsort((indices, distances, rows))
+        rows = rows[order]
+        row_starts = np.searchsorted(rows, np.arange(n_queries))
+        ranks = np.arange(len(rows)) - row_starts[rows]
+        keep = order[ranks < n_results]
+        return (
+            indices[keep].reshape(n_queries, n_results),
+            distances[keep].reshape(n_queries, n_results))
+
+    def _prepare(self, queries, n_results):
+        queries = np.asarray(queries, dtype=np.uint64).reshape(
+            -1, self.n_words)
+        view = self._view
+        return queries, view, min(n_results, len(view[0]))
+
+    def _empty_results(self, n_queries):
+        empty = np.zeros((n_queries, 0), dtype=np.int64)
+        return empty, empty.astype(self.distance_dtype)
+
+    def search(self, queries, n_results):
+        """
+        Find the `n_results` codes nearest to each of `queries`, an array of
+        shape (n_queries, n_words), returning the indices and distances of the
+        results, each of shape (n_queries, n_results), ordered by distance
+        and then by index
+        """
+        queries, view, n_results = self._prepare(queries, n_results)
+        if n_results <= 0:
+            return self._empty_results(len(queries))
+
+        rows, indices, distances = self._candidates(
+            view, queries, n_results, 0, len(view[0]))
+        return self._nearest(
+            rows, indices, distances, len(queries), n_results)
+
+
+class MultiIndexHammingIndex(HammingIndex):
+    """
+    A hamming index that answers exact k-nearest-neighbor queries without
+    scanning every code, using multi-index hashing (Norouzi et al., 2012).
+
+    Each code is split into 16-bit substrings, and each substring position has
+    its own table mapping substring values to the codes that contain them.  By
+    the pigeonhole principle, a code within distance `r` of a query has at
+    least one substring within distance `r // n_substrings` of the query's
+    corresponding substring, so probing every table for substrings within a
+    growing radius finds every code within a growing bound, and the search
+    can stop as soon as the nth-nearest code found is within that bound.
+
+    Codes appended since the tables were last built are scanned by brute
+    force, until there are more than `MAX_UNINDEXED_CODES` of them, or
+    `MAX_UNINDEXED_FRACTION` of the indexed codes, at which point the tables
+    are rebuilt.  Queries whose neighbors are so distant that probing would
+    verify more than `MAX_CANDIDATE_FRACTION` of the index fall back to a
+    brute-force scan, which is cheaper per code
+    """
+    SUBSTRING_BITS = 16
+    MAX_UNINDEXED_CODES = 65536
+    MAX_UNINDEXED_FRACTION = 0.05
+    MAX_CANDIDATE_FRACTION = 0.05
+
+    # every substring value with exactly `radius` bits set, by radius
+    _MASKS = [
+        np.flatnonzero(_POPCOUNT_16 == radius)
+        for radius in range(SUBSTRING_BITS + 1)]
+
+    def __init__(self, n_words, chunk_size=65536, n_threads=None):
+        super().__init__(n_words, chunk_size=chunk_size, n_threads=n_threads)
+        self.n_substrings = self.n_bits // self.SUBSTRING_BITS
+        # the number of codes covered by the tables, along with the tables
+        # themselves, published together in a single attribute assignment
+        self._tables = (0, ())
+
+    @property
+    def nbytes(self):
+        _, tables = self._tables
+        return super().nbytes + sum(
+            ids.nbytes + offsets.nbytes for ids, offsets in tables)
+
+    def _substrings(self, words, substring):
+        # the words of each code are stored least-significant bits first
+        word, position = divmod(substring, 64 // self.SUBSTRING_BITS)
+        shift = np.uint64(position * self.SUBSTRING_BITS)
+        mask = np.uint64(2 ** self.SUBSTRING_BITS - 1)
+        return ((words[word] >> shift) & mask).astype(np.intp)
+
+    def build(self):
+        """
+        Rebuild the substring tables so they cover every code in the index
+        """
+        view = self._view
+        n_values = 2 ** self.SUBSTRING_BITS
+        id_dtype = np.uint32 if len(view[0]) < 2 ** 32 else np.uint64
+
+        tables = []
+        for substring in range(self.n_substrings):
+            keys = self._substrings(view, substring)
+            offsets = np.zeros((n_values + 1,), dtype=np.int64)
+            np.cumsum(np.bincount(keys, minlength=n_values), out=offsets[1:])
+            ids = np.argsort(keys, kind='stable').astype(id_dtype)
+            tables.append((ids, offsets))
+
+        self._tables = (len(view[0]), tuple(tables))
+
+    @property
+    def tables(self):
+        """
+        The number of codes covered by the substring tables, and the tables
+        themselves, a pair of sorted code ids and bucket offsets for each
+        substring
+        """
+        return self._tables
+
+    @property
+    def stale(self):
+        """
+        True when enough codes have been appended since the tables were built
+        that they should be rebuilt
+        """
+        n_indexed, _ = self._tables
+        unindexed = len(self) - n_indexed
+        return unindexed > max(
+            self.MAX_UNINDEXED_CODES,
+            n_indexed * self.MAX_UNINDEXED_FRACTION)
+
+    def append(self, codes):
+        super().append(codes)
+        if self.stale:
+            self.build()
+
+    def attach(self, columns, n_indexed=0, tables=()):
+        # the codes are published first, since searches read the tables
+        # first, and must find every code the tables cover
+        super().attach(columns)
+        self._tables = (n_indexed, tuple(tables))
+
+    @staticmethod
+    def _bucket_ids(ids, offsets, keys):
+        # gather the contents of many buckets at once
+        starts = offsets[keys]
+        lengths = offsets[keys + 1] - starts
+        total = lengths.sum()
+        if total == 0:
+            return ids[:0]
+        shifts = np.cumsum(lengths) - lengths - starts
+        return ids[np.arange(total) - np.repeat(shifts, lengths)]
+
+    def _code_distances(self, view, query, indices):
+        distances = None
+        for word, column in zip(query, view):
+            counts = popcount(np.take(column, indices) ^ word)
+            if distances is None:
+                distances = counts.astype(self.distance_dtype, copy=False)
+            else:
+                distances += counts
+        return distances
+
+    def _probe(self, view, tables, query, n_results, indices, distances):
+        """
+        Probe the substring tables for codes near a single query, starting
+        from the candidates already found in the unindexed codes.  Returns
+        None if the search would verify too many candidates
+        """
+        n_indexed = len(tables[0][0])
+        max_candidates = n_indexed * self.MAX_CANDIDATE_FRACTION
+        n_candidates = 0
+        keys = [
+            self._substrings(query[:, None], substring)[0]
+            for substring in range(self.n_substrings)]
+
+        for radius, masks in enumerate(self._MASKS):
+            candidates = np.concatenate([
+                self._bucket_ids(ids, offsets, masks ^ key)
+                for key, (ids, offsets) in zip(keys, tables)])
+            candidates.sort()
+            candidates = candidates[np.diff(candidates, prepend=-1) != 0]
+            n_candidates += len(candidates)
+            if n_candidates > max_candidates:
+                return None
+
+            candidates = candidates.astype(np.int64)
+            indices, first = np.unique(
+                np.concatenate([indices, candidates]), return_index=True)
+            distances = np.concatenate([
+                distances,
+                self._code_distances(view, query, candidates)])[first]
+            if len(indices) > n_results:
+                best = np.lexsort((indices, distances))[:n_results]
+                indices, distances = indices[best], distances[best]
+
+            # every indexed code within this distance has now been found
+            bound = self.n_substrings * (radius + 1) - 1
+            if len(indices) >= n_results and distances.max() <= bound:
+                break
+
+        return indices, distances
+
+    def search(self, queries, n_results):
+        # the tables are read first, since the codes only ever grow, so the
+        # view read next always includes every code they cover
+        n_indexed, tables = self._tables
+        queries, view, n_results = self._prepare(queries, n_results)
+        if n_results <= 0:
+            return self._empty_results(len(queries))
+
+        if not n_indexed:
+            return super().search(queries, n_results)
+
+        # the unindexed codes are always scanned by brute force
+        rows, indices, distances = self._candidates(
+            view, queries, n_results, n_indexed, len(view[0]))
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        indices = indices[order]
+        distances = distances[order]
+        row_starts = np.searchsorted(rows, np.arange(len(queries) + 1))
+
+        results = []
+        fallback = []
+        for i, query in enumerate(queries):
+            start, end = row_starts[i], row_starts[i + 1]
+            result = self._probe(
+                view,
+                tables,
+                query,
+                n_results,
+                indices[start: end],
+                distances[start: end])
+            if result is None:
+                fallback.append(i)
+            else:
+                results.append((np.full(len(result[0]), i), ) + result)
+
+        if fallback:
+            fallback = np.array(fallback)
+            fallback_rows, *candidates = self._candidates(
+                view, queries[fallback], n_results, 0, n_indexed)
+            results.append((fallback[fallback_rows], *candidates))
+            unindexed = np.isin(rows, fallback)
+            results.append(
+                (rows[unindexed], indices[unindexed], distances[unindexed]))
+
+        rows, indices, distances = (
+            np.concatenate(arrays) for arrays in zip(*results))
+        return self._nearest(
+            rows, indices, distances, len(queries), n_results)
@@ -1,9 +1,8 @@
-from scipy.spatial.distance import cdist
 import heapq
 import numpy as np
-import random
 from hashlib import sha1
 from itertools import zip_longest
+from collections import deque
 
 
 def batch_unit_norm(b, epsilon=1e-8):
@@ -52,6 +51,171 @@ def random_projection(plane_vectors, data, pack=True, binarize=True):
     return output
 
 
+class GrowableArray(object):
+    """
+    An array that over-allocates its storage as it grows, so that extending
+    it by n items costs amortized O(n) rather than a copy of everything
+    already stored.  `view` is always a contiguous array of the current items
+    """
+
+    def __init__(self, data, growth_factor=2, min_capacity=16):
+        super().__init__()
+        self.growth_factor = growth_factor
+        self.min_capacity = min_capacity
+        self._array = np.asarray(data)
+        self._size = len(self._array)
+        # readers on other threads (e.g., the persistor) only ever see a
+        # single attribute assignment, so never a half-updated array and size
+        self._view = self._array
+
+    @property
+    def view(self):
+        return self._view
+
+    @property
+    def capacity(self):
+        return len(self._array)
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._array.dtype)
+        size = self._size + len(values)
+
+        if size > len(self._array):
+            capacity = max(
+                size,
+                int(len(self._array) * self.growth_factor),
+                self.min_capacity)
+            grown = np.empty(
+                (capacity,) + self._array.shape[1:], dtype=self._array.dtype)
+            grown[:self._size] = self._array[:self._size]
+            self._array = grown
+
+        # existing views never include the region being written
+        self._array[self._size:size] = values
+        self._size = size
+        self._view = self._array[:size]
+
+
+class SegmentedView(object):
+    """
+    A read-only, array-like view of a base array followed by a tail array,
+    which supports the indexing the trees perform without ever copying the
+    base into one contiguous array
+    """
+
+    def __init__(self, base, tail):
+        super().__init__()
+        # indexing a plain array view is cheaper than indexing a memmap
+        self.base = np.asarray(base)
+        self.tail = tail
+        self.dtype = base.dtype
+        self.shape = (len(base) + len(tail),) + base.shape[1:]
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _rows(self, indices):
+        indices = np.asarray(indices)
+        n_base = len(self.base)
+        # most lookups, e.g. routing newly-appended vectors, fall entirely
+        # within one segment
+        if not indices.size or indices.min() >= n_base:
+            return self.tail[indices - n_base]
+        if indices.max() < n_base:
+            return self.base[indices]
+
+        in_base = indices < n_base
+        output = np.empty(indices.shape + self.shape[1:], dtype=self.dtype)
+        output[in_base] = self.base[indices[in_base]]
+        output[~in_base] = self.tail[indices[~in_base] - n_base]
+        return output
+
+    def __getitem__(self, key):
+        if isinstance(key, np.ndarray) and key.ndim:
+            return self._rows(key)
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            n_base = len(self.base)
+            if step != 1:
+                return self._rows(np.arange(start, stop, step))
+            if stop <= n_base:
+                return self.base[start:stop]
+            if start >= n_base:
+                return self.tail[start - n_base:stop - n_base]
+            return np.concatenate(
+                [self.base[start:], self.tail[:stop - n_base]])
+
+        if np.ndim(key) == 0:
+            index = int(key)
+            if index < 0:
+                index += len(self)
+            if index < len(self.base):
+                return self.base[index]
+            return self.tail[index - len(self.base)]
+
+        return self._rows(key)
+
+    def take(self, indices, axis=None, out=None, mode='raise'):
+        if axis != 0 or out is not None:
+            return np.take(np.asarray(self), indices, axis, out, mode)
+        return self._rows(indices)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.concatenate([self.base, self.tail]).astype(
+            dtype or self.dtype, copy=False)
+
+
+class SegmentedArray(object):
+    """
+    A read-only base array, e.g. memory-mapped from a file, followed by a
+    GrowableArray of items appended since, so that appending never copies
+    the base.  `view` is the base, the tail, or a `SegmentedView` of both
+    """
+
+    def __init__(self, base, tail=None):
+        super().__init__()
+        self.base = base
+        if tail is None:
+            tail = np.zeros((0,) + base.shape[1:], dtype=base.dtype)
+        self._tail = GrowableArray(tail)
+        self._view = None
+        self._update_view()
+
+    def _update_view(self):
+        tail = self._tail.view
+        if not len(tail):
+            self._view = self.base
+        elif not len(self.base):
+            self._view = tail
+        else:
+            self._view = SegmentedView(self.base, tail)
+
+    @property
+    def view(self):
+        return self._view
+
+    @property
+    def nbytes(self):
+        # the base is backed by the file, rather than by memory
+        return self._tail.nbytes
+
+    def __len__(self):
+        return len(self.base) + len(self._tail)
+
+    def extend(self, values):
+        self._tail.extend(values)
+        self._update_view()
+
+
 def traversal(roots, pop_from=0):
     build_queue = list(roots)
     while build_queue:
@@ -70,21 +234,36 @@ class HyperPlaneNode(object):
         else:
             self.plane = plane
 
-        self.data = \
-            data if data is not None else np.zeros((0,), dtype=np.uint64)
+        self._indices = GrowableArray(
+            data if data is not None else np.zeros((0,), dtype=np.uint64))
 
         self.left = None
         self.right = None
 
+        # a leaf whose vectors couldn't be separated (e.g., many identical
+        # vectors) isn't split again until it has grown to this size
+        self.min_split_size = 0
+
+    @property
+    def data(self):
+        return self._indices.view
+
+    @data.setter
+    def data(self, value):
+        self._indices = GrowableArray(value)
+
+    def extend(self, indices):
+        self._indices.extend(indices)
+
     def __hash__(self):
         return hash(sha1(self.plane).hexdigest())
 
     def traverse(self):
         for queue, node in traversal([self], pop_from=0):
             yield node
-            if node.left:
+            if node.left is not None:
                 queue.append(node.left)
-            if node.right:
+            if node.right is not None:
                 queue.append(node.right)
 
     def __eq__(self, other):
@@ -125,23 +304,206 @@ class HyperPlaneNode(object):
     def route(self, data, indices=None):
         if indices is None:
             indices = self.data
-        data = data[indices]
 
-        dist = self.distance(data)
-        left_indices = indices[dist > 0]
-        right_indices = indices[dist <= 0]
-        return left_indices, right_indices
+        # equivalent to self.distance(data[indices]), without the reshaping
+        # and transposing, whose overhead adds up when routing small batches
+        # through deep trees
+        is_left = np.dot(data[indices], self.plane.reshape(-1)) > 0
+        return indices[is_left], indices[~is_left]
+
+    def _bisecting_plane(self, data):
+        """
+        Choose a plane that separates two of the vectors owned by this node.
+        A plane chosen at random rarely divides vectors occupying a narrow
+        cone, which leads to long chains of nodes that every append and
+        search must pass through
+        """
+        if len(self.data) < 2:
+            return self.plane
+
+        a, b = data[np.random.choice(self.data, 2, replace=False)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            plane = (a / np.linalg.norm(a)) - (b / np.linalg.norm(b))
+            norm = np.linalg.norm(plane)
+        if not np.isfinite(norm) or norm == 0:
+            return self.plane
+        return (plane / norm).astype(np.float64).reshape(1, -1)
 
     def create_children(self, data):
+        """
+        Split this leaf in two, returning False if no plane could be found
+        that separates its vectors
+        """
+        self.plane = self._bisecting_plane(data)
         left_indices, right_indices = self.route(data)
+        if not len(left_indices) or not len(right_indices):
+            # splitting would only add a node that every append and search
+            # must pass through, so back off until this leaf has doubled
+            self.min_split_size = len(self) * 2
+            return False
+
         self.left = HyperPlaneNode(self.dimensions, left_indices)
         self.right = HyperPlaneNode(self.dimensions, right_indices)
+        # only leaves need to know which vectors they hold, so there's no
+        # reason to keep a copy of every index at every level of the tree
+        self.data = np.zeros((0,), dtype=np.uint64)
+        return True
+
+
+class FlatHyperPlaneTree(object):
+    """
+    A read-only form of MultiHyperPlaneTree, backed by the arrays produced by
+    `MultiHyperPlaneTree.to_arrays`.
+
+    Rather than pushing node objects through a heap and computing a dot
+    product for each node visited, a query is projected onto every node's
+    plane with a single matrix multiply, and traversal is a loop over integer
+    node ids
+    """
+
+    def __init__(self, arrays, n_trees, n_vectors):
+        super().__init__()
+        self.arrays = arrays
+        self.planes = arrays['planes']
+        self.children = arrays['children']
+        self.leaf_ranges = arrays['leaf_ranges']
+        self.indices = arrays['indices']
+        self.n_trees = n_trees
+        # the number of vectors present when the trees were flattened
+        self.n_vectors = n_vectors
+
+    @property
+    def n_nodes(self):
+        return len(self.planes)
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.arrays.values())
+
+    def _traverse(
+            self,
+            distances,
+            column,
+            threshold,
+            max_candidates,
+            max_leaves,
+            max_leaves_per_tree):
+
+        children = self.children
+        leaf_ranges = self.leaf_ranges
+
+        # assign arbitrary priorities to each root node, larger than the
+        # greatest possible distance, to ensure that each root node is
+        # processed first.  Node ids break ties, so no two entries are equal
+        heap = [(-((i + 1) * 10), i, i) for i in range(self.n_trees)]
+        tree_leaves = [0] * self.n_trees
+
+        chunks = []
+        n_candidates = 0
+
+        while heap \
+                and n_candidates < max_candidates \
+                and len(chunks) < max_leaves:
+
+            _, node, tree = heapq.heappop(heap)
+            if tree_leaves[tree] >= max_leaves_per_tree:
+                continue
+
+            left = children.item(node, 0)
+            if left < 0:
+                start = leaf_ranges.item(node, 0)
+                end = leaf_ranges.item(node, 1)
+                chunks.append(self.indices[start: end])
+                n_candidates += end - start
+                tree_leaves[tree] += 1
+                continue
+
+            dist = distances.item(node, column)
+            abs_dist = abs(dist)
+            below_threshold = abs_dist < threshold
+
+            if dist > 0 or below_threshold:
+                heapq.heappush(heap, (-abs_dist, left, tree))
+
+            if dist <= 0 or below_threshold:
+                heapq.heappush(
+                    heap, (-abs_dist, children.item(node, 1), tree))
+
+        return chunks
+
+    def candidates_batch(
+            self,
+            queries,
+            threshold,
+            max_candidates,
+            max_leaves=None,
+            max_leaves_per_tree=None):
+        """
+        Return the unique indices of vectors in the leaves nearest to each
+        query, visiting leaves until at least `max_candidates` indices
+        (counting duplicates across trees) have been gathered, `max_leaves`
+        leaves have been visited, or every tree has had `max_leaves_per_tree`
+        of its leaves visited
+        """
+        no_limit = float('inf')
+        if max_leaves is None:
+            max_leaves = no_limit
+        if max_leaves_per_tree is None:
+            max_leaves_per_tree = no_limit
+
+        # project every query onto every node's plane at once
+        distances = np.dot(self.planes, queries.T)
+
+        chunks = []
+        for i in range(len(queries)):
+            chunks.extend(
+                (i, chunk) for chunk in self._traverse(
+                    distances,
+                    i,
+                    threshold,
+                    max_candidates,
+                    max_leaves,
+                    max_leaves_per_tree))
+
+        # key each candidate by its query, so that a single pass can both
+        # remove duplicates and group candidates by query
+        n_vectors = np.uint64(max(self.n_vectors, 1))
+        keys = np.concatenate(
+            [np.zeros((0,), dtype=np.uint64)] +
+            [chunk.astype(np.uint64) + np.uint64(i) * n_vectors
+             for i, chunk in chunks])
+        keys.sort()
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        keys = keys[first]
+        bounds = np.searchsorted(
+            keys, np.arange(1, len(queries), dtype=np.uint64) * n_vectors)
+        return np.split(keys % n_vectors, bounds)
+
+    def candidates(self, query, threshold, max_candidates, **budget):
+        return self.candidates_batch(
+            query.reshape(1, -1), threshold, max_candidates, **budget)[0]
 
 
 class MultiHyperPlaneTree(object):
+    # Vectors appended after the trees were last flattened are searched
+    # exhaustively, until there are more than this many, or this fraction of
+    # the flattened vectors, at which point the trees are flattened again
+    MAX_UNFLATTENED_VECTORS = 65536
+    MAX_UNFLATTENED_FRACTION = 0.05
+
+    # Unless a search specifies its own budget, gather this many candidates
+    # for each result requested
+    DEFAULT_CANDIDATES_PER_RESULT = 100
+
+    # Unflattened vectors are scored against blocks of queries holding at
+    # most this many distances at once
+    MAX_SCORED_PER_BLOCK = 2 ** 20
+
     def __init__(self, data, smallest_node, n_trees=10):
         super(MultiHyperPlaneTree, self).__init__()
-        self.data = data
+        self._vectors = GrowableArray(data)
+        self._flat = None
         indices = np.arange(0, len(data), dtype=np.uint64)
         self.smallest_node = smallest_node
 
@@ -154,21 +516,47 @@ class MultiHyperPlaneTree(object):
 
             if len(node) <= smallest_node:
                 continue
-            else:
-                node.create_children(self.data)
+            elif node.create_children(self.data):
                 build_queue.extend(node.children)
 
+    @property
+    def data(self):
+        return self._vectors.view
+
+    @data.setter
+    def data(self, value):
+        self._vectors = GrowableArray(value)
+
     @property
     def dimensions(self):
         return self.data.shape[1]
 
+    @property
+    def roots(self):
+        if self._roots is None:
+            # the trees were loaded in flattened form, and node objects are
+            # only needed once new vectors are appended
+            self._roots = self._build_nodes(
+                self._flat.arrays, self._flat.n_trees)
+        return self._roots
+
+    @roots.setter
+    def roots(self, value):
+        self._roots = value
+
+    @property
+    def n_trees(self):
+        if self._roots is None:
+            return self._flat.n_trees
+        return len(self._roots)
+
     def check(self):
         output = []
         for queue, node in traversal(list(self.roots), pop_from=0):
             output.append(str(node))
-            if node.left:
+            if node.left is not None:
                 queue.append(node.left)
-            if node.right:
+            if node.right is not None:
                 queue.append(node.right)
         return output
 
@@ -178,6 +566,7 @@ class MultiHyperPlaneTree(object):
             return HyperPlaneNode(state['shape'], data, plane)
 
         roots = [build_node(*data) for data in state['roots']]
+        self._flat = None
         self.roots = roots
         self.data = state['data']
         self.smallest_node = state['smallest_node']
@@ -193,6 +582,9 @@ class MultiHyperPlaneTree(object):
                 right = build_node(*right)
                 next_node.right = right
                 queue.append(right)
+            if not next_node.is_leaf:
+                # snapshots from earlier versions kept indices for every node
+                next_node.data = np.zeros((0,), dtype=np.uint64)
 
     def __getstate__(self):
 
@@ -205,13 +597,13 @@ class MultiHyperPlaneTree(object):
             left = next_node.left
             right = next_node.right
 
-            if left:
+            if left is not None:
                 queue.append(left)
                 item.append(node_state(left))
             else:
                 item.append(None)
 
-            if right:
+            if right is not None:
                 queue.append(right)
                 item.append(node_state(right))
             else:
@@ -229,6 +621,121 @@ class MultiHyperPlaneTree(object):
             'data': self.data
         }
 
+    def nodes(self):
+        """
+        Yield every node breadth-first, so that the roots come first
+        """
+        queue = deque(self.roots)
+        while queue:
+            node = queue.popleft()
+            yield node
+            if not node.is_leaf:
+                queue.append(node.left)
+                queue.append(node.right)
+
+    def to_arrays(self):
+        """
+        Flatten the trees into a handful of contiguous arrays, with nodes
+        numbered breadth-first so that the roots have ids 0 through
+        n_trees - 1:
+
+        - `planes` - the plane for each node
+        - `children` - the ids of each node's left and right children, or -1
+          for leaves
+        - `leaf_ranges` - the slice of `indices` owned by each node, which is
+          empty for all but leaves
+        - `indices` - the vector indices owned by each leaf, concatenated.
+          These are 32-bit whenever possible, since they make up the bulk of
+          the flattened trees
+        """
+        if self._roots is None:
+            return self._flat.arrays
+
+        nodes = list(self.nodes())
+        node_ids = {id(node): i for i, node in enumerate(nodes)}
+
+        children = np.full((len(nodes), 2), -1, dtype=np.int64)
+        leaf_ranges = np.zeros((len(nodes), 2), dtype=np.int64)
+        start = 0
+        for i, node in enumerate(nodes):
+            if not node.is_leaf:
+                children[i] = node_ids[id(node.left)], node_ids[id(node.right)]
+            leaf_ranges[i] = start, start + len(node)
+            start += len(node)
+
+        return {
+            'planes': np.concatenate([node.plane for node in nodes]),
+            'children': children,
+            'leaf_ranges': leaf_ranges,
+            'indices': np.concatenate([node.data for node in nodes]).astype(
+                np.uint32 if len(self) < 2 ** 32 else np.uint64)
+        }
+
+    @staticmethod
+    def _build_nodes(arrays, n_trees):
+        planes = arrays['planes']
+        children = arrays['children']
+        leaf_ranges = arrays['leaf_ranges']
+        indices = arrays['indices']
+        dimensions = planes.shape[1]
+
+        # planes are views onto the arrays, rather than copies.  Indices are
+        # too, unless they must be widened, so that appends can't overflow
+        nodes = [
+            HyperPlaneNode(
+                dimensions,
+                indices[start: end].astype(np.uint64, copy=False),
+                planes[i: i + 1])
+            for i, (start, end) in enumerate(leaf_ranges)]
+
+        for node, (left, right) in zip(nodes, children):
+            if left >= 0:
+                node.left = nodes[left]
+                node.right = nodes[right]
+
+        return nodes[:n_trees]
+
+    @classmethod
+    def from_arrays(cls, arrays, data, smallest_node, n_trees):
+        """
+        Restore trees flattened by `to_arrays`.  The arrays are used as-is,
+        so they may be memory-mapped, and node objects aren't created until
+        they're needed to append new vectors.  Appended vectors are kept
+        apart from `data`, which is never copied
+        """
+        tree = cls.__new__(cls)
+        tree._vectors = SegmentedArray(data)
+        tree._flat = FlatHyperPlaneTree(arrays, n_trees, len(data))
+        tree._roots = None
+        tree.smallest_node = smallest_node
+        return tree
+
+    def remap(self, base):
+        """
+        Replace the first `len(base)` vectors with `base`, e.g. the same
+        vectors memory-mapped from the file they've just been saved to, so
+        that only vectors appended since are held in memory
+        """
+        self._vectors = SegmentedArray(base, np.array(self.data[len(base):]))
+
+    def flatten(self):
+        """
+        Return a FlatHyperPlaneTree for searching, reusing the last one built
+        unless too many vectors have been appended since
+        """
+        flat = self._flat
+        if flat is not None:
+            unflattened = len(self) - flat.n_vectors
+            limit = max(
+                self.MAX_UNFLATTENED_VECTORS,
+                flat.n_vectors * self.MAX_UNFLATTENED_FRACTION)
+            if unflattened <= limit:
+                return flat
+
+        flat = FlatHyperPlaneTree(self.to_arrays(), self.n_trees, len(self))
+        self._flat = flat
+        return flat
+
     def __eq__(self, other):
         return all(s == r for (s, r) in zip(self.roots, other.roots))
 
@@ -238,104 +745,193 @@ class MultiHyperPlaneTree(object):
     def append(self, chunk):
 
         # compute the new set of indices that need to be added to the tree
-        new_indices = np.arange(0, len(chunk), dtype=np.uint64) + len(self.data)
+        offset = np.uint64(len(self.data))
+        chunk_indices = np.arange(0, len(chunk), dtype=np.uint64)
 
         # ensure that the chunk of vectors are added to the available vector
-        # data
-        self.data = np.concatenate([self.data, chunk])
+        # data.  Storage grows geometrically, so this is amortized O(1) per
+        # vector, rather than a copy of the entire index
+        self._vectors.extend(chunk)
+        chunk = self.data[int(offset):]
 
-        # initialize the search queue with all root nodes
-        search_queue = list([(r, new_indices) for r in self.roots])
+        # initialize the search queue with all root nodes.  New vectors are
+        # routed by their position in the chunk, which is cheaper to index
+        # than all of the data
+        search_queue = list([(r, chunk_indices) for r in self.roots])
 
         while search_queue:
 
-            # add the indices to the node's data
             node, indices = search_queue.pop()
 
-            node.data = np.concatenate([node.data, indices])
-
-            if len(node) <= self.smallest_node:
-                # this will be a leaf node.  There's no need to further route
-                # the data or add further child nodes (for now)
+            if not len(indices):
+                # none of the new vectors fall under this node
                 continue
 
-            if node.is_leaf:
-                # we'll be creating new child nodes.  At this point, we need
-                # to route *all* of the data currently owned by this node
-                node.create_children(self.data)
-            else:
+            if not node.is_leaf:
                 # this node already has children, so it's only necessary to
                 # route new indices
-                left_indices, right_indices = node.route(self.data, indices)
+                left_indices, right_indices = node.route(chunk, indices)
                 search_queue.append((node.left, left_indices))
                 search_queue.append((node.right, right_indices))
+                continue
 
-    def search_with_priority_queue(
+            # add the indices to the leaf's data
+            node.extend(indices + offset)
+
+            if len(node) <= self.smallest_node \
+                    or len(node) < node.min_split_size:
+                # this will be a leaf node.  There's no need to further route
+                # the data or add further child nodes (for now)
+                continue
+
+            # we'll be creating new child nodes.  At this point, we need
+            # to route *all* of the data currently owned by this node.  A
+            # large chunk may leave the children too big as well, so keep
+            # splitting, as when building the trees
+            split_queue = [node]
+            while split_queue:
+                node = split_queue.pop()
+                if len(node) <= self.smallest_node \
+                        or len(node) < node.min_split_size:
+                    continue
+                if node.create_children(self.data):
+                    split_queue.extend(node.children)
+
+    @staticmethod
+    def _cosine_distances(vectors, unit_queries):
+        """
+        Compute the cosine distance between each row of `vectors` and the
+        corresponding row of `unit_queries`, which have already been
+        normalized
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dot = np.einsum('ij,ij->i', vectors, unit_queries)
+            norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))
+            return 1 - (dot / norms)
+
+    def _search_unflattened(self, unit_queries, start, n_results):
+        """
+        Find the `n_results` nearest of the vectors from `start` onward for
+        each query, scoring each block of queries against all of them with a
+        single matrix multiply, rather than gathering them once per query
+        """
+        vectors = np.asarray(self.data[start:], dtype=np.float32)
+        k = min(n_results, len(vectors))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse_norms = 1 / np.sqrt(
+                np.einsum('ij,ij->i', vectors, vectors))
+
+        block_size = max(1, self.MAX_SCORED_PER_BLOCK // len(vectors))
+        indices = []
+        dists = []
+        for i in range(0, len(unit_queries), block_size):
+            block = unit_queries[i: i + block_size].astype(np.float32)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dist = 1 - np.dot(block, vectors.T) * inverse_norms
+            dist[np.isnan(dist)] = np.inf
+            nearest = np.argpartition(dist, k - 1, axis=-1)[:, :k]
+            indices.extend(nearest.astype(np.uint64) + np.uint64(start))
+            dists.extend(np.take_along_axis(dist, nearest, axis=-1))
+        return indices, dists
+
+    def search_batch(
             self,
-            query,
+            queries,
             n_results,
             threshold,
             return_distances=False,
-            return_vectors=False):
-
-        query = query.reshape(1, self.dimensions)
-
-        indices = set()
-
-        # this is kinda arbitrary.
-        # How do I pick this intelligently?
-        to_consider = n_results * 100
-
-        # put the root nodes in the queue
-
-        # KLUDGE: Assign arbitrary values to each root node, taking on values
-        # larger than the greatest possible cosine distance to ensure that
-        # each root node is processed first
-
-        # KLUDGE: Add a random number in the second position to ensure that
-        # hyperplane nodes are never compared in the event of identical
-        # distances
-        heap = [
-            (-((i + 1) * 10), random.random(), root)
-            for i, root in enumerate(self.roots)
-            ]
+            return_vectors=False,
+            max_candidates=None,
+            max_leaves=None,
+            max_leaves_per_tree=None):
+        """
+        Search for the nearest neighbors of many queries at once, returning a
+        list with one result per query, in the same form returned by
+        `search_with_priority_queue`.
+
+        The work done for each query is bounded by `max_candidates`, the
+        number of indices gathered from leaves (counting duplicates across
+        trees), along with the optional `max_leaves` visited overall and
+        `max_leaves_per_tree`.  Larger budgets trade latency for recall; use
+        `benchmark.py recall` to choose an operating point
+        """
+        queries = np.asarray(queries).reshape(-1, self.dimensions)
+
+        if n_results < 1:
+            raise ValueError('n_results must be at least one')
+
+        if max_candidates is None:
+            max_candidates = n_results * self.DEFAULT_CANDIDATES_PER_RESULT
+
+        # traverse the trees, finding candidate indices for each query
+        flat = self.flatten()
+        candidates = flat.candidates_batch(
+            queries,
+            threshold,
+            max_candidates,
+            max_leaves=max_leaves,
+            max_leaves_per_tree=max_leaves_per_tree)
+
+        # score every candidate for every query in a single pass
+        counts = np.array([len(c) for c in candidates])
+        all_candidates = np.concatenate(candidates).astype(np.intp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unit_queries = \
+                queries / np.linalg.norm(queries, axis=-1, keepdims=True)
+        dist = self._cosine_distances(
+            np.take(self.data, all_candidates, axis=0),
+            np.repeat(unit_queries, counts, axis=0))
+        # sort nan distances (e.g. for zero-length vectors) last
+        dist[np.isnan(dist)] = np.inf
+        query_dists = np.split(dist, np.cumsum(counts)[:-1])
+
+        if flat.n_vectors < len(self):
+            # vectors appended since the trees were flattened aren't in any of
+            # its leaves, so every query considers the best of them too
+            tail_indices, tail_dists = self._search_unflattened(
+                unit_queries, flat.n_vectors, n_results)
+            candidates = [
+                np.concatenate([c, i])
+                for c, i in zip(candidates, tail_indices)]
+            query_dists = [
+                np.concatenate([d, t])
+                for d, t in zip(query_dists, tail_dists)]
+
+        results = []
+        for indices, query_dist in zip(candidates, query_dists):
+
+            if len(query_dist) > n_results:
+                partitioned_indices = \
+                    np.argpartition(query_dist, n_results)[:n_results]
+            else:
+                partitioned_indices = np.arange(len(query_dist))
+            sorted_indices = np.argsort(query_dist[partitioned_indices])
+            srt_indices = partitioned_indices[sorted_indices]
 
-        # traverse the tree, finding candidate indices
-        while heap and (len(indices) < to_consider):
-            current_distance, _, current_node = heapq.heappop(heap)
+            final_indices = indices[srt_indices]
 
-            if current_node.is_leaf:
-                indices.update(current_node.data)
-                continue
+            if return_vectors:
+                results.append((final_indices, self.data[final_indices]))
+            elif return_distances:
+                results.append((final_indices, query_dist[srt_indices]))
+            else:
+                results.append(final_indices)
 
-            dist = current_node.distance(query)
-            abs_dist = np.abs(dist)
-            below_threshold = abs_dist < threshold
+        return results
 
-            # KLUDGE: Add a random number in the second position to ensure that
-            # hyperplane nodes are never compared in the event of identical
-            # distances
-            if dist > 0 or below_threshold:
-                heapq.heappush(
-                    heap, (-abs_dist, random.random(), current_node.left))
+    def search_with_priority_queue(
+            self,
+            query,
+            n_results,
+            threshold,
+            return_distances=False,
+            return_vectors=False,
+            **budget):
 
-            if dist <= 0 or below_threshold:
-                heapq.heappush(
-                    heap, (-abs_dist, random.random(), current_node.right))
-
-        # perform a brute-force distance search over a subset of the data
-        indices = np.array(list(indices), dtype=np.uint64)
-        data = self.data[indices]
-        dist = cdist(query, data, metric='cosine').squeeze()
-        partitioned_indices = np.argpartition(dist, n_results)[:n_results]
-        sorted_indices = np.argsort(dist[partitioned_indices])
-        srt_indices = partitioned_indices[sorted_indices]
-
-        final_indices = indices[srt_indices]
-
-        if return_vectors:
-            return final_indices, self.data[final_indices]
-        elif return_distances:
-            return final_indices, dist[sorted_indices]
-        else:
-            return final_indices
+        return self.search_batch(
+            query.reshape(1, self.dimensions),
+            n_results,
+            threshold,
+            return_distances=return_distances,
+            return_vectors=return_vectors,
+            **budget)[0]
@@ -0,0 +1,305 @@
+"""
+RPC between the HTTP workers serving an index and the single process that
+holds it in memory.
+
+Connections are persistent and multiplexed: a client may send many requests
+over one connection without waiting for responses, and the server answers
+each as soon as its search completes, tagged with the request's id.  Messages
+in both directions are JSON, e.g.
+
+{"id": 7, "query": {"sound": "...", "seconds": 1.5, "nresults": 10},
+ "timeout": 5}
+
+{"id": 7, "results": [...]}
+
+{"id": 7, "error": "...", "kind": "timeout" | "not_found" | "error"}
+"""
+import os
+import json
+import queue
+import threading
+import time
+from itertools import count
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.connection import Listener, Client as TcpClient
+from log import module_logger
+
+logger = module_logger(__file__)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchError(Exception):
+    def __init__(self, message, kind):
+        super().__init__(message)
+        self.kind = kind
+
+
+class _PendingSearch(object):
+    def __init__(self, reply, request_id, query, deadline):
+        super().__init__()
+        self.reply = reply
+        self.request_id = request_id
+        self.query = dict(query)
+        self.nresults = self.query.pop('nresults', 10)
+        self.deadline = deadline
+
+    def respond(self, results=None, error=None, kind=None):
+        if self.request_id is None:
+            # a client using the original protocol, of one bare query per
+            # connection, expects bare results
+            self.reply(results if error is None else [])
+        elif error is None:
+            self.reply({'id': self.request_id, 'results': results})
+        else:
+            self.reply({'id': self.request_id, 'error': error, 'kind': kind})
+
+
+class IndexServer(Listener):
+    """
+    Serve searches over an index with `search` and `search_batch` methods to
+    any number of persistent client connections.
+
+    Searches from every connection are queued, and each of `n_workers`
+    threads repeatedly takes all the queued searches, up to
+    `max_batch_size`, and runs them as a single batch, so that batches grow
+    naturally with load without delaying searches when the server is idle.
+    Searches whose deadline passes while they're queued are answered with a
+    timeout rather than run
+    """
+
+    def __init__(
+            self,
+            address,
+            index,
+            n_workers=4,
+            max_batch_size=64,
+            default_timeout=10):
+
+        super().__init__(address)
+        self.index = index
+        self.max_batch_size = max_batch_size
+        self.default_timeout = default_timeout
+        self._pending = queue.Queue()
+
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logger.info('Started index TCP server')
+
+    def run(self):
+        while True:
+            connection = self.accept()
+            threading.Thread(
+                target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        send_lock = threading.Lock()
+
+        def reply(message):
+            try:
+                with send_lock:
+                    connection.send_bytes(json.dumps(message).encode())
+            except (OSError, EOFError):
+                # the client has gone away, and has no use for the response
+                pass
+
+        try:
+            while True:
+                message = json.loads(connection.recv_bytes().decode())
+                if 'id' in message:
+                    request_id = message['id']
+                    query = message['query']
+                    timeout = message.get('timeout') or self.default_timeout
+                else:
+                    request_id = None
+                    query = message
+                    timeout = self.default_timeout
+                self._pending.put(_PendingSearch(
+                    reply, request_id, query, time.time() + timeout))
+        except (OSError, EOFError):
+            connection.close()
+
+    def _next_batch(self):
+        batch = [self._pending.get()]
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _search(self, search):
+        try:
+            results = self.index.search(
+                nresults=search.nresults, **search.query)
+        except KeyError as e:
+            search.respond(error=f'Unindexed sound {e}', kind='not_found')
+        except Exception as e:
+            logger.exception('search failed')
+            search.respond(error=str(e), kind='error')
+        else:
+            search.respond(results)
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+
+            now = time.time()
+            searches = []
+            for search in batch:
+                if search.deadline < now:
+                    search.respond(error='Search timed out', kind='timeout')
+                else:
+                    searches.append(search)
+
+            if len(searches) == 1:
+                self._search(searches[0])
+                continue
+
+            nresults = max(search.nresults for search in searches)
+            try:
+                results = self.index.search_batch(
+                    [search.query for search in searches], nresults=nresults)
+            except Exception:
+                # isolate whichever searches caused the batch to fail
+                for search in searches:
+                    self._search(search)
+                continue
+
+            for search, search_results in zip(searches, results):
+                search.respond(search_results[:search.nresults])
+
+
+class _MultiplexedConnection(object):
+    def __init__(self, address):
+        super().__init__()
+        self._connection = TcpClient(address)
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._ids = count()
+        self.closed = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def request(self, query, timeout):
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError('Connection to index server closed')
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+
+        message = {'id': request_id, 'query': query, 'timeout': timeout}
+        try:
+            with self._send_lock:
+                self._connection.send_bytes(json.dumps(message).encode())
+        except (OSError, EOFError) as e:
+            self._close(e)
+        return request_id, future
+
+    def cancel(self, request_id):
+        with self._lock:
+            self._futures.pop(request_id, None)
+
+    def _read(self):
+        try:
+            while True:
+                response = json.loads(self._connection.recv_bytes().decode())
+                with self._lock:
+                    future = self._futures.pop(response['id'], None)
+                if future is None:
+                    # the request timed out, and nobody is waiting for it
+                    continue
+                if 'error' not in response:
+                    future.set_result(response['results'])
+                elif response['kind'] == 'timeout':
+                    future.set_exception(SearchTimeout(response['error']))
+                else:
+                    future.set_exception(
+                        SearchError(response['error'], response['kind']))
+        except (OSError, EOFError) as e:
+            self._close(e)
+
+    def _close(self, error):
+        with self._lock:
+            self.closed = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+
+        for future in futures:
+            future.set_exception(
+                ConnectionError(f'Connection to index server lost: {error}'))
+
+        try:
+            self._connection.close()
+        except OSError:
+            pass
+
+
+class IndexClient(object):
+    """
+    A pool of persistent, multiplexed connections to an `IndexServer`, which
+    may be shared by any number of threads.
+
+    Connections are opened lazily, and opened again in each process after a
+    fork, so a client may be created before gunicorn forks its workers
+    """
+
+    def __init__(self, address, pool_size=2, timeout=10):
+        super().__init__()
+        self.address = address
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connections = []
+        self._next = count()
+
+    def _connection(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # connections and their reader threads don't survive a fork
+                self._pid = os.getpid()
+                self._connections = []
+
+            self._connections = [c for c in self._connections if not c.closed]
+            if len(self._connections) < self.pool_size:
+                connection = _MultiplexedConnection(self.address)
+                self._connections.append(connection)
+                return connection
+
+            index = next(self._next) % len(self._connections)
+            return self._connections[index]
+
+    def search(self, sound, seconds, nresults=10, timeout=None):
+        """
+        Search for segments similar to the one at `seconds` into `sound`,
+        raising `SearchTimeout` if no results arrive within `timeout` seconds
+        """
+        timeout = min(timeout or self.timeout, self.timeout)
+        query = {'sound': sound, 'seconds': seconds, 'nresults': nresults}
+
+        # retry once, in case a pooled connection was closed by the server
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                request_id, future = connection.request(query, timeout)
+                break
+            except ConnectionError:
+                if attempt:
+                    raise
+
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            connection.cancel(request_id)
+            raise SearchTimeout(f'No results within {timeout} seconds')
@@ -32,24 +32,28 @@ import zounds
 from log import module_logger
 from client import Client
 from cli import DefaultArgumentParser
-from bot_helper import BinaryData, retry
+from bot_helper import BinaryData, FeatureCache, retry
 import argparse
-import requests
 import numpy as np
 import threading
 import time
 from sklearn.cluster import MiniBatchKMeans
 from gunicorn.app.base import BaseApplication
 import falcon
+import math
 import os
-from multiprocessing.connection import Listener, Client as TcpClient
-import json
+from shared_hamming_index import HammingIndexWriter, HammingIndexReader
+from index_rpc import IndexServer, IndexClient, SearchTimeout, SearchError
 
 logger = module_logger(__file__)
 
 SHINGLE_SIZE = 10
 WINDOW_SIZE = 42
 
+# features are read repeatedly while training, and are likely to already have
+# been fetched by other bots on this host
+feature_cache = FeatureCache()
+
 
 def mfcc_stream(client, wait_for_new=False):
     bot = retry(client.get_user, 30)('mfcc')
@@ -79,9 +83,21 @@ def infinite_mfcc_stream(client):
         yield from mfcc_stream(client)
 
 
-def compute_feature(annotation):
-    resp = requests.get(annotation['data_url'])
-    arr = BinaryData.unpack(resp.content)
+def compute_feature(annotation, start_seconds=None, end_seconds=None):
+    """
+    Compute shingled, unit-normed frames for an MFCC annotation.  If a time
+    range is given, only the frames overlapping `[start_seconds, end_seconds)`
+    are fetched, with HTTP range requests, instead of the whole feature
+    """
+    if start_seconds is None:
+        arr = BinaryData.unpack_file(
+            feature_cache.get_path(annotation['data_url']))
+    else:
+        arr, _ = BinaryData.fetch_time_slice(
+            annotation['data_url'],
+            start_seconds,
+            end_seconds,
+            session=feature_cache.session)
 
     # TODO: Consider a larger "shingle" size
     # sliding window
@@ -92,7 +108,7 @@ def compute_feature(annotation):
     orig_shape = arr.shape
     arr = arr.reshape((arr.shape[0], -1))
     norms = np.linalg.norm(arr, axis=-1, keepdims=True)
-    arr /= (norms + 1e-8)
+    arr = arr / (norms + 1e-8)
     arr = arr.reshape(orig_shape)
     arr = zounds.ArrayWithUnits(arr, dims)
 
@@ -145,26 +161,36 @@ def train_model(client, n_iterations=10000, batch_size=256):
 
 
 class Index(threading.Thread):
-    def __init__(self, client, model, user_uri):
+    """
+    Stream MFCC annotations into a shared hamming index in `index_directory`,
+    which processes on this host can search with a `HammingIndexReader`
+    """
+
+    def __init__(self, client, model, user_uri, index_directory):
         super().__init__(daemon=True)
         self.user_uri = user_uri
         self.model = model
         self.client = client
-        self.index = None
-        self.time_slices = []
-        self.current_offset = 0
-        self.sound_offsets = {}
         self.window_size_frames = WINDOW_SIZE
-        self.frequency = self._fetch_frequency()
-
-    def __len__(self):
-        return len(self.index)
-
-    def _fetch_frequency(self):
+        frequency, duration = self._fetch_time_dimension()
+        # each code is a binary vector with one bit per cluster, packed into
+        # 64-bit words
+        self.writer = HammingIndexWriter(
+            index_directory,
+            n_words=int(np.ceil(model.n_clusters / 64)),
+            seconds_per_code=frequency / zounds.Seconds(1),
+            duration_seconds=duration / zounds.Seconds(1),
+            user_uri=user_uri)
+
+    def _fetch_time_dimension(self):
         annotation = next(mfcc_stream(self.client))
-        feature = compute_feature(annotation)
-        _, windowed = feature.sliding_window_with_leftovers(42, dopad=True)
-        return windowed.dimensions[0].frequency
+        # the time dimension doesn't depend on the feature's length, so a
+        # short slice is enough
+        feature = compute_feature(annotation, 0, 1)
+        _, windowed = feature.sliding_window_with_leftovers(
+            self.window_size_frames, dopad=True)
+        time_dimension = windowed.dimensions[0]
+        return time_dimension.frequency, time_dimension.duration
 
     def run(self):
         for annotation in mfcc_stream(self.client, wait_for_new=True):
@@ -173,9 +199,6 @@ class Index(threading.Thread):
             _, windowed = feature.sliding_window_with_leftovers(
                 self.window_size_frames, dopad=True)
 
-            time_dimension = windowed.dimensions[0]
-            duration = time_dimension.duration
-
             original_shape = windowed.shape[:2]
             flattened_dim = windowed.shape[-2] * windowed.shape[-1]
             windowed = windowed.reshape((-1, flattened_dim))
@@ -190,46 +213,10 @@ class Index(threading.Thread):
             pooled = sparse.max(axis=1)
 
             packed = np.packbits(pooled, axis=-1).view(np.uint64)
-            if self.index is None:
-                self.index = packed
-            else:
-                self.index = np.concatenate([self.index, packed])
             sound_id = annotation['sound']
             logger.info(
                 f'building index for {sound_id} from process {os.getpid()}')
-            self.time_slices.extend(
-                (sound_id,
-                 zounds.TimeSlice(start=i * self.frequency, duration=duration))
-                for i in range(len(packed)))
-            self.sound_offsets[sound_id] = self.current_offset
-            self.current_offset += len(packed)
-
-    def _get_code(self, sound, seconds):
-        frequency = self.frequency / zounds.Seconds(1)
-        offset = self.sound_offsets[sound]
-        window_index = offset + int(seconds / frequency)
-        return self.index[window_index]
-
-    def _transform_indices(self, indices):
-        for index in indices:
-            sound_id, time_slice = self.time_slices[index]
-            start = time_slice.start / zounds.Seconds(1)
-            duration = time_slice.duration / zounds.Seconds(1)
-            data = {
-                'created_by': self.user_uri,
-                'sound': sound_id,
-                'start_seconds': start,
-                'duration_seconds': duration,
-                'end_seconds': start + duration
-            }
-            yield data
-
-    def search(self, sound, seconds, nresults=10):
-        logger.info(f'searching from process {os.getpid()}')
-        code = self._get_code(sound, seconds)
-        dist = zounds.nputil.packed_hamming_distance(code, self.index)
-        indices = np.argsort(dist)[:nresults]
-        return list(self._transform_indices(indices))
+            self.writer.append(sound_id, packed)
 
 
 class StandaloneApplication(BaseApplication):
@@ -246,21 +233,38 @@ class StandaloneApplication(BaseApplication):
 
 
 class IndexResource(object):
-    def __init__(self, index_server_address):
-        self.index_server_address = index_server_address
+    def __init__(self, index):
+        # either a HammingIndexReader, searching the shared index locally, or
+        # an IndexClient, searching it in the index server's process
+        self.index = index
 
     def on_get(self, req, resp):
         resp.set_header('Access-Control-Allow-Origin', '*')
 
         sound = req.get_param('sound')
         seconds = req.get_param_as_float('seconds')
+        if sound is None or seconds is None:
+            raise falcon.HTTPBadRequest(
+                description='Please specify a sound and a time in seconds')
+        if not math.isfinite(seconds) or seconds < 0:
+            raise falcon.HTTPBadRequest(
+                description='seconds must be a non-negative number')
         nresults = req.get_param_as_int('nresults') or 10
+        timeout = req.get_param_as_float('timeout')
 
-        connection = TcpClient(self.index_server_address)
-        query_data = {'sound': sound, 'seconds': seconds, 'nresults': nresults}
-        connection.send_bytes(json.dumps(query_data).encode())
-        raw_resp = connection.recv_bytes()
-        results = json.loads(raw_resp.decode())
+        try:
+            results = self.index.search(
+                sound, seconds, nresults=nresults, timeout=timeout)
+        except KeyError:
+            raise falcon.HTTPNotFound()
+        except SearchTimeout:
+            raise falcon.HTTPError(falcon.HTTP_504)
+        except SearchError as e:
+            if e.kind == 'not_found':
+                raise falcon.HTTPNotFound()
+            raise
+        except ConnectionError:
+            raise falcon.HTTPError(falcon.HTTP_503)
 
         resp.media = {
             'total_count': len(results),
@@ -268,24 +272,6 @@ class IndexResource(object):
         }
 
 
-class IndexServer(Listener):
-    def __init__(self, address, index):
-        super().__init__(address)
-        self.index = index
-        self.thread = threading.Thread(target=self.run, daemon=True)
-        self.thread.start()
-        logger.info('Started index TCP server')
-
-    def run(self):
-        while True:
-            connection = self.accept()
-            raw_query = connection.recv_bytes().decode()
-            query = json.loads(raw_query)
-            results = self.index.search(**query)
-            connection.send_bytes(json.dumps(results).encode())
-            connection.close()
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(parents=[DefaultArgumentParser()])
     parser.add_argument(
@@ -302,8 +288,23 @@ if __name__ == '__main__':
         '--index-server-port',
         default=8081,
         type=int)
+    parser.add_argument(
+        '--index-dir',
+        default='mfcc_index',
+        help='directory in which the index is shared with HTTP workers')
+    parser.add_argument(
+        '--search-over-rpc',
+        action='store_true',
+        help='search from HTTP workers via the index server, rather than '
+             'by mapping the shared index')
+    parser.add_argument(
+        '--feature-cache-dir',
+        default=None,
+        help='directory of the feature cache shared by bots on this host')
     args = parser.parse_args()
 
+    feature_cache = FeatureCache(args.feature_cache_dir)
+
     api_client = Client(args.annotate_api_endpoint, logger=logger)
     # TODO: Should I introduce an indexer user type, since anonymous access
     # isn't allowed?
@@ -318,15 +319,22 @@ if __name__ == '__main__':
     if args.train:
         model = train_model(api_client, n_iterations=args.iterations)
 
-    # begin to build the index, and start up an index server that will host
-    # the in-memory index and respond to requests from HTTP workers
+    # begin to build the shared index, and start up an index server that
+    # will search it on behalf of clients that can't map it themselves
     index_server_address = ('', args.index_server_port)
-    index = Index(api_client, model, user_uri)
+    index = Index(api_client, model, user_uri, args.index_dir)
     index.start()
-    index_server = IndexServer(index_server_address, index)
+    index_server = IndexServer(
+        index_server_address, HammingIndexReader(args.index_dir))
+
+    if args.search_over_rpc:
+        searcher = IndexClient(index_server_address)
+    else:
+        # each HTTP worker maps the shared index and searches it directly
+        searcher = HammingIndexReader(args.index_dir)
 
     # serve the index over HTTP using a standalone gunicorn application
     api = falcon.API()
-    api.add_route('/', IndexResource(index_server_address))
+    api.add_route('/', IndexResource(searcher))
     logger.info(f'serving index on port {args.bind}')
     StandaloneApplication(api, args.bind).run()
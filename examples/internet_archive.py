@@ -1,5 +1,5 @@
 import argparse
-from cli import DefaultArgumentParser
+from cli import BotDriverArgumentParser
 from client import Client
 import requests
 import urllib
@@ -84,16 +84,18 @@ class InternetArchiveBot(object):
         self.about_me = 'internet_archive.md'
         self.email = 'john.vinyard+internet-archive@gmail.com'
 
-    def iter_sounds(self):
+    def iter_sounds(self, skip=lambda name: False):
         for dataset in datasets:
             for item in dataset:
+                path = Path(urllib.parse.urlparse(item.request.url).path)
+                relative_path = path.relative_to('/download').with_suffix('')
+                if skip(str(relative_path)):
+                    continue
                 session = requests.Session()
                 prepped = item.request.prepare()
                 resp = session.send(prepped)
                 bio = BytesIO(resp.content)
                 logger.info(item)
-                path = Path(urllib.parse.urlparse(item.request.url).path)
-                relative_path = path.relative_to('/download').with_suffix('')
                 meta = requests.get(
                     self._details_url(relative_path), params={'output': 'json'})
                 yield str(relative_path), bio, meta.json()
@@ -124,7 +126,7 @@ class InternetArchiveBot(object):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(parents=[
-        DefaultArgumentParser()
+        BotDriverArgumentParser()
     ])
     args = parser.parse_args()
     annotate_client = Client(args.annotate_api_endpoint, logger=logger)
@@ -1,4 +1,3 @@
-import requests
 import zounds
 import numpy as np
 from bot_helper import BinaryData, main, AnnotationListener
@@ -14,7 +13,30 @@ frequency_band = zounds.FrequencyBand(20, SAMPLE_RATE.nyquist)
 scale = zounds.MelScale(frequency_band, N_FREQUENCY_BANDS)
 
 
+def compute_mfcc(packed_fft):
+    fft_feature = BinaryData.unpack(packed_fft)
+
+    # compute the mfcc feature
+    mel_spectrogram = scale.apply(
+        fft_feature,
+        zounds.HanningWindowingFunc())
+    mel_spectrogram = zounds.ArrayWithUnits(mel_spectrogram, [
+        fft_feature.dimensions[0],
+        zounds.FrequencyDimension(scale)
+    ])
+    mel_spectrogram = 20 * np.log10(mel_spectrogram + 1)
+    mfcc = np.abs(dct(mel_spectrogram, axis=1)[:, 1: 14])
+    mfcc = zounds.ArrayWithUnits(mfcc, [
+        fft_feature.dimensions[0],
+        zounds.IdentityDimension()
+    ]).astype(np.float32)
+
+    return BinaryData(mfcc).packed_format()
+
+
 class MFCCListener(AnnotationListener):
+    compute = staticmethod(compute_mfcc)
+
     def __init__(self, client, s3_client, page_size=3, logger=None):
         super().__init__(
             'stft_bot', client, s3_client, page_size, logger=logger)
@@ -38,45 +60,6 @@ class MFCCListener(AnnotationListener):
             ]
         }
 
-    def _process_annotation(self, annotation):
-        # fetch the fft data
-        resp = requests.get(annotation['data_url'])
-        fft_feature = BinaryData.unpack(resp.content)
-
-        # compute the chroma feature
-        mel_spectrogram = scale.apply(
-            fft_feature,
-            zounds.HanningWindowingFunc())
-        mel_spectrogram = zounds.ArrayWithUnits(mel_spectrogram, [
-            fft_feature.dimensions[0],
-            zounds.FrequencyDimension(scale)
-        ])
-        mel_spectrogram = 20 * np.log10(mel_spectrogram + 1)
-        mfcc = np.abs(dct(mel_spectrogram, axis=1)[:, 1: 14])
-        mfcc = zounds.ArrayWithUnits(mfcc, [
-            fft_feature.dimensions[0],
-            zounds.IdentityDimension()
-        ]).astype(np.float32)
-
-        # pack the chroma data and create the resources
-        binary_data = BinaryData(mfcc)
-        sound_id = self._sound_id_from_uri(annotation['sound'])
-
-        # push output to s3
-        data_url = self.s3_client.put_object(
-            sound_id,
-            binary_data.packed_file_like_object(),
-            'application/octet-stream')
-        logger.info(f'pushed binary data to {data_url}')
-
-        # create annotation
-        self.client.create_annotations(sound_id, {
-            'start_seconds': annotation['start_seconds'],
-            'duration_seconds': annotation['duration_seconds'],
-            'data_url': data_url
-        })
-        logger.info('created annotation')
-
 
 if __name__ == '__main__':
     main(
@@ -1,19 +1,41 @@
 import soundfile
 import subprocess
-import numpy as np
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+# Number of frames read and passed to ffmpeg at a time
+BLOCK_FRAMES = 65536
+
 
 class Mp3Encoder(object):
-    def __init__(self):
+    """
+    Encode audio as mp3 by streaming blocks of 16-bit PCM into an ffmpeg
+    process, so that the decoded audio is never held in memory all at once
+    """
+
+    def __init__(self, block_frames=BLOCK_FRAMES):
         super().__init__()
+        self.block_frames = block_frames
 
-    def __call__(self, flo):
+    def _feed(self, f, stdin):
+        try:
+            for block in f.blocks(self.block_frames, dtype='int16'):
+                stdin.write(block.tobytes())
+        except BrokenPipeError:
+            # ffmpeg exited early, and its error will be reported below
+            pass
+        finally:
+            stdin.close()
+
+    def encode(self, flo):
+        """
+        Encode the audio in a path or file-like object, returning the encoded
+        bytes and the duration of the audio in seconds
+        """
         with soundfile.SoundFile(flo) as f:
-            samples = f.read()
-            samples *= ((2 ** 16) // 2)
-            samples = samples.astype(np.int16)
-            bio = BytesIO()
             proc = subprocess.Popen(
                 args=[
                     'ffmpeg',
@@ -30,12 +52,125 @@ class Mp3Encoder(object):
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE)
-            stdout, stderr = proc.communicate(input=samples.tobytes())
-            bio.write(stdout)
-            bio.seek(0)
-            return bio
+
+            # write PCM on a separate thread, and read stdout and stderr
+            # concurrently, so that no pipe can fill up and block ffmpeg
+            feeder = threading.Thread(target=self._feed, args=(f, proc.stdin))
+            feeder.start()
+            stderr = []
+            drain = threading.Thread(
+                target=lambda: stderr.append(proc.stderr.read()))
+            drain.start()
+            stdout = proc.stdout.read()
+            drain.join()
+            feeder.join()
+            proc.wait()
+            stderr = stderr[0]
+
+            if proc.returncode != 0:
+                raise RuntimeError(
+                    f'ffmpeg exited with {proc.returncode}: {stderr.decode()}')
+
+            return stdout, f.frames / f.samplerate
+
+    def __call__(self, flo):
+        encoded, _ = self.encode(flo)
+        return BytesIO(encoded)
+
+
+class EncoderPool(object):
+    """
+    Run up to `workers` ffmpeg encoders at once, so that encoding overlaps
+    with other work such as uploads, and keep throughput metrics, e.g.
+
+        pool = EncoderPool(workers=8)
+        for path, future in pool.imap(paths):
+            object_storage_client.put_object(
+                key, future.result(), 'audio/mp3')
+        logger.info(pool.metrics())
+    """
+
+    def __init__(self, workers=4, block_frames=BLOCK_FRAMES):
+        super().__init__()
+        self.workers = workers
+        self.encoder = Mp3Encoder(block_frames)
+        self.executor = ThreadPoolExecutor(workers)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._files = 0
+        self._failures = 0
+        self._audio_seconds = 0
+        self._encoded_bytes = 0
+        self._busy_seconds = 0
+
+    def _encode(self, flo):
+        start = time.time()
+        try:
+            encoded, audio_seconds = self.encoder.encode(flo)
+        except Exception:
+            with self._lock:
+                self._failures += 1
+            raise
+
+        with self._lock:
+            self._files += 1
+            self._audio_seconds += audio_seconds
+            self._encoded_bytes += len(encoded)
+            self._busy_seconds += time.time() - start
+        return BytesIO(encoded)
+
+    def submit(self, flo):
+        """
+        Begin encoding a path or file-like object, returning a future whose
+        result is a file-like object containing mp3 data
+        """
+        return self.executor.submit(self._encode, flo)
+
+    def imap(self, items, key=None, lookahead=None):
+        """
+        Yield `(item, future)` pairs in order, keeping up to `lookahead`
+        encodes in flight ahead of the consumer.  `key` extracts the path or
+        file-like object to encode from each item
+        """
+        key = key or (lambda item: item)
+        lookahead = lookahead or self.workers * 2
+        pending = deque()
+
+        try:
+            for item in items:
+                pending.append((item, self.submit(key(item))))
+                if len(pending) >= lookahead:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def metrics(self):
+        with self._lock:
+            elapsed = time.time() - self._started
+            return {
+                'files': self._files,
+                'failures': self._failures,
+                'audio_seconds': self._audio_seconds,
+                'encoded_bytes': self._encoded_bytes,
+                'files_per_second': self._files / elapsed,
+                'audio_seconds_per_second': self._audio_seconds / elapsed,
+                'utilization':
+                    self._busy_seconds / (elapsed * self.workers)
+            }
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
 
 
 def encode_mp3(flo):
     encoder = Mp3Encoder()
-    return encoder(flo)
\ No newline at end of file
+    return encoder(flo)
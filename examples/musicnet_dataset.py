@@ -5,10 +5,10 @@ import argparse
 import os
 from csv import DictReader
 from zounds.util import midi_to_note, midi_instrument
-from s3client import ObjectStorageClient
+from s3client import ObjectStorageClient, MB
 import soundfile
 from log import module_logger
-from mp3encoder import encode_mp3
+from mp3encoder import EncoderPool
 
 logger = module_logger(__file__)
 
@@ -53,23 +53,27 @@ def get_annotations(filename, samplerate):
 
 
 def add_sounds(data_dir, labels_dir, metadata, tags):
-    for audio_filename in os.listdir(data_dir):
+    # encode upcoming files while the current one is uploaded
+    audio_files = encoder_pool.imap(
+        (os.path.join(data_dir, audio_filename)
+         for audio_filename in os.listdir(data_dir)))
+
+    for audio_path, encoded in audio_files:
+        audio_filename = os.path.basename(audio_path)
         _id = os.path.splitext(audio_filename)[0]
         data = metadata[_id]
-        audio_path = os.path.join(data_dir, audio_filename)
         labels_path = os.path.join(labels_dir, f'{_id}.csv')
 
-        # push audio data to s3
-        with open(audio_path, 'rb') as f:
-            url = object_storage_client.put_object(_id, f, 'audio/wav')
-            logger.info(f'pushed {url} to s3')
-
+        # push the original and low-quality audio data to s3 concurrently
+        low_quality_id = os.path.join('low-quality', _id)
         with open(audio_path, 'rb') as f:
-            encoded = encode_mp3(f)
-            low_quality_id = os.path.join('low-quality', _id)
-            low_quality_url = object_storage_client.put_object(
-                low_quality_id, encoded, 'audio/mp3')
-            logger.info(f'pushed {low_quality_url} to s3')
+            url, low_quality_url = [
+                future.result() for future in
+                object_storage_client.put_objects([
+                    (_id, f, 'audio/wav'),
+                    (low_quality_id, encoded.result(), 'audio/mp3')
+                ])]
+        logger.info(f'pushed {url} and {low_quality_url} to s3')
 
         # create a sound
         info = soundfile.info(audio_path)
@@ -119,9 +123,12 @@ if __name__ == '__main__':
         region=args.s3_region,
         access_key=args.aws_access_key_id,
         secret=args.aws_secret_access_key,
-        bucket=bucket_name)
+        bucket=bucket_name,
+        multipart_threshold=args.s3_multipart_threshold_mb * MB)
     object_storage_client.ensure_bucket_exists()
 
+    encoder_pool = EncoderPool(args.encoder_workers)
+
     with open('musicnet.md', 'r') as f:
         about_me = f.read()
 
@@ -146,3 +153,5 @@ if __name__ == '__main__':
         os.path.join(args.metadata_path, 'train_labels'),
         metadata,
         ['train'])
+
+    logger.info(f'Encoder metrics: {encoder_pool.metrics()}')
@@ -6,9 +6,9 @@ import soundfile
 from client import Client
 from cli import DatasetArgumentParser
 from http import client
-from s3client import ObjectStorageClient
+from s3client import ObjectStorageClient, MB
 from log import module_logger
-from mp3encoder import encode_mp3
+from mp3encoder import EncoderPool
 
 logger = module_logger(__file__)
 
@@ -55,27 +55,37 @@ if __name__ == '__main__':
         region=args.s3_region,
         access_key=args.aws_access_key_id,
         secret=args.aws_secret_access_key,
-        bucket=bucket_name)
+        bucket=bucket_name,
+        multipart_threshold=args.s3_multipart_threshold_mb * MB)
 
     audio_path = os.path.join(args.metadata_path, 'audio')
 
     object_storage_client.ensure_bucket_exists()
 
-    for filename in os.listdir(audio_path):
-        full_path = os.path.join(audio_path, filename)
-        key, _ = os.path.splitext(filename)
+    encoder_pool = EncoderPool(args.encoder_workers)
 
-        # push the audio data to s3
-        with open(full_path, 'rb') as f:
-            url = object_storage_client.put_object(key, f, 'audio/wav')
-            logger.info(f'Created s3 resource at {url}')
+    # encode upcoming files while the current one is uploaded
+    audio_files = encoder_pool.imap(
+        (os.path.join(audio_path, filename)
+         for filename in os.listdir(audio_path)))
+
+    for i, (full_path, encoded) in enumerate(audio_files):
+        filename = os.path.basename(full_path)
+        key, _ = os.path.splitext(filename)
 
+        # push the original and low-quality audio data to s3 concurrently
+        low_quality_key = os.path.join('low-quality', key)
         with open(full_path, 'rb') as f:
-            encoded = encode_mp3(f)
-            low_quality_key = os.path.join('low-quality', key)
-            low_quality_url = object_storage_client.put_object(
-                low_quality_key, encoded, 'audio/mp3')
-            logger.info(f'pushed {low_quality_url} to s3')
+            url, low_quality_url = [
+                future.result() for future in
+                object_storage_client.put_objects([
+                    (key, f, 'audio/wav'),
+                    (low_quality_key, encoded.result(), 'audio/mp3')
+                ])]
+        logger.info(f'Created s3 resources at {url} and {low_quality_url}')
+
+        if i % 1000 == 0:
+            logger.info(f'Encoder metrics: {encoder_pool.metrics()}')
 
         duration_seconds = soundfile.info(full_path).duration
         status, sound_uri, sound_id = annotate_client.create_sound(
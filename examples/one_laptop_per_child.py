@@ -6,7 +6,7 @@ import os
 from zipfile import ZipFile
 from http import client
 from pathlib import Path
-from cli import DefaultArgumentParser
+from cli import BotDriverArgumentParser
 from bot_helper import BotDriver
 from io import BytesIO
 from log import module_logger
@@ -66,8 +66,10 @@ class OLPCBot(object):
         self.about_me = 'one_laptop_per_child.md'
         self.email = 'john.vinyard+one-laptop-per-child@gmail.com'
 
-    def iter_sounds(self):
+    def iter_sounds(self, skip=lambda name: False):
         for _id, path, f, metadata in iter_sounds():
+            if skip(path):
+                continue
             yield path, BytesIO(f.read()), metadata
 
 
@@ -90,7 +92,7 @@ class OLPCBot(object):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(parents=[
-        DefaultArgumentParser()
+        BotDriverArgumentParser()
     ])
     args = parser.parse_args()
     driver = BotDriver(args, logger, OLPCBot())
@@ -1,16 +1,62 @@
+import time
+import random
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import \
+    ClientError, BotoCoreError, HTTPClientError, \
+    ConnectionError as BotoConnectionError
 from botocore.config import Config
 from botocore import UNSIGNED
 
+MB = 1024 ** 2
+
+RETRYABLE_ERROR_CODES = {
+    'RequestTimeout',
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'InternalError',
+    'ServiceUnavailable'
+}
+
 
 class ObjectStorageClient(object):
-    def __init__(self, endpoint, region, access_key, secret, bucket):
+    """
+    Upload objects to S3 (or a compatible stand-in such as fake-s3).
+
+    Objects larger than `multipart_threshold` bytes are split into parts of
+    `multipart_chunksize` bytes which are uploaded in parallel.  Whole uploads
+    may also be run concurrently with `put_objects`, on a pool of
+    `max_concurrency` threads.  Individual requests are retried by botocore,
+    and uploads that still fail are restarted up to `max_attempts` times with
+    jittered, exponential backoff.  Setting `multipart_threshold` to `None` or
+    zero (e.g. with `--s3-multipart-threshold-mb 0`) disables multipart
+    uploads, for stand-ins that don't support them.
+    """
+
+    def __init__(
+            self,
+            endpoint,
+            region,
+            access_key,
+            secret,
+            bucket,
+            max_concurrency=8,
+            multipart_threshold=64 * MB,
+            multipart_chunksize=16 * MB,
+            max_attempts=5,
+            backoff_seconds=0.5):
+
         self.bucket = bucket
         self.secret = secret
         self.access_key = access_key
         self.region = region
         self.endpoint = endpoint
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
 
         config = Config()
         config.signature_version = UNSIGNED
@@ -20,7 +66,20 @@ class ObjectStorageClient(object):
             endpoint_url=self.endpoint,
             region_name=self.region,
             aws_access_key_id=self.access_key,
-            aws_secret_access_key=self.secret)
+            aws_secret_access_key=self.secret,
+            config=Config(
+                # leave room for concurrent uploads which each upload several
+                # parts at once
+                max_pool_connections=max_concurrency * 4,
+                retries={'mode': 'standard'}))
+
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold or float('inf'),
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=4,
+            use_threads=True)
+
+        self.executor = ThreadPoolExecutor(max_concurrency)
 
         self.url_generator = boto3.client('s3', config=config)
 
@@ -44,14 +103,70 @@ class ObjectStorageClient(object):
                 }
             )
 
+    def _is_retryable(self, error):
+        """
+        Retry connection failures and timeouts, and server errors or
+        throttling, but not e.g. bad credentials or a missing bucket
+        """
+        if isinstance(error, S3UploadFailedError):
+            # boto3 raises this while handling the underlying error
+            error = error.__cause__ or error.__context__
+        if isinstance(error, (BotoConnectionError, HTTPClientError)):
+            return True
+        if not isinstance(error, ClientError):
+            return False
+        response = error.response
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        code = response.get('Error', {}).get('Code')
+        return status >= 500 or code in RETRYABLE_ERROR_CODES
+
+    def _upload(self, key, body, content_type):
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            body = BytesIO(body)
+        start = body.tell()
+
+        for attempt in range(self.max_attempts):
+            body.seek(start)
+            try:
+                self.s3.upload_fileobj(
+                    body,
+                    self.bucket,
+                    key,
+                    ExtraArgs={
+                        'ACL': 'public-read',
+                        'ContentType': content_type
+                    },
+                    Config=self.transfer_config)
+                return self.object_url(key)
+            except (ClientError, BotoCoreError, S3UploadFailedError) as e:
+                if attempt == self.max_attempts - 1 \
+                        or not self._is_retryable(e):
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+
     def put_object(self, key, body, content_type):
-        self.s3.put_object(
-            Bucket=self.bucket,
-            Body=body,
-            Key=key,
-            ACL='public-read',
-            ContentType=content_type)
+        """
+        Upload bytes or a seekable file-like object, returning its url
+        """
+        return self._upload(key, body, content_type)
+
+    def submit_put(self, key, body, content_type):
+        """
+        Begin uploading an object, returning a future whose result is its url
+        """
+        return self.executor.submit(self._upload, key, body, content_type)
+
+    def put_objects(self, objects):
+        """
+        Begin uploading each `(key, body, content_type)` tuple concurrently,
+        returning a list of futures whose results are the objects' urls
+        """
+        return [
+            self.submit_put(key, body, content_type)
+            for key, body, content_type in objects]
 
+    def object_url(self, key):
         # KLUDGE: It would be nice if this would work correctly with boto3
         # and fake s3, but for local dev environments, it seems that uris must
         # be built by hand
@@ -0,0 +1,580 @@
+"""
+A spatial index partitioned across worker processes on the same host, so
+that its size isn't limited by the memory of a single process and searches
+use as many cores as there are shards.
+
+Sounds are assigned to shards by hashing their ids onto a ring of virtual
+nodes, so that adding a shard only moves the sounds the new shard takes over,
+about `1 / n_shards` of them, rather than reshuffling every sound.  Searches
+are sent to every shard at once, and each shard's results, already ordered by
+distance, are merged with a heap.
+
+Each shard is a `spatial_index.Index` in its own process, connected to the
+coordinating process by a pipe.  Requests over a pipe are multiplexed: each
+is tagged with an id, and searches run concurrently on a pool of threads in
+the shard, while appends and other changes run in the order they arrive.
+
+A sharded index is persisted to a directory holding `shards.json`, which
+names the shards, and a `shard.{id}/` directory for each, in the layout
+written by `Index.save`
+"""
+import os
+import json
+import heapq
+import threading
+import multiprocessing
+from bisect import bisect
+from contextlib import contextmanager
+from hashlib import sha1
+from itertools import count
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+from spatial_index import Index
+from log import module_logger
+
+logger = module_logger(__file__)
+
+MANIFEST = 'shards.json'
+
+
+def _hash(key):
+    return int.from_bytes(sha1(key.encode()).digest()[:8], 'big')
+
+
+def _shard_directory(directory, shard_id):
+    return os.path.join(directory, f'shard.{shard_id}')
+
+
+def _write_json(path, data):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class HashRing(object):
+    """
+    Map keys onto shards with consistent hashing.  Each shard owns
+    `replicas` points on the ring, and a key belongs to the shard owning the
+    first point at or after the key's hash
+    """
+
+    def __init__(self, shard_ids, replicas=64):
+        super().__init__()
+        self.shard_ids = tuple(shard_ids)
+        self.replicas = replicas
+        points = sorted(
+            (_hash(f'{shard_id}:{replica}'), shard_id)
+            for shard_id in self.shard_ids
+            for replica in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard_id for _, shard_id in points]
+
+    def with_shard(self, shard_id):
+        return HashRing(self.shard_ids + (shard_id,), self.replicas)
+
+    def shard(self, key):
+        i = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._shards[i]
+
+
+def _cosine_distances(points, query):
+    norms = np.linalg.norm(points, axis=-1) * np.linalg.norm(query)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = 1 - (points @ query) / norms
+    return np.nan_to_num(distances, nan=np.inf)
+
+
+class _ReadWriteLock(object):
+    """
+    Allow any number of readers at once, or a single writer.  Writers that
+    are waiting take precedence over new readers, so that a steady stream of
+    searches can't hold off appends indefinitely
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _Shard(object):
+    """
+    The state of a single shard, within its worker process.
+
+    Searches and other reads run concurrently on a pool of threads, but the
+    index's trees can't be read while they're being changed, so changes wait
+    for reads in progress and hold off new ones.  Snapshots are safe to take
+    while the index changes, and only exclude replacing the index
+    """
+
+    def __init__(self, shard_id, index):
+        super().__init__()
+        self.shard_id = shard_id
+        self.index = index
+        self._lock = _ReadWriteLock()
+        # a snapshot must not be interleaved with replacing the index
+        self._save_lock = threading.Lock()
+
+    def append(self, _id, data):
+        with self._lock.writing():
+            # sounds appended again after a restart, because they arrived
+            # after the last snapshot's `low_id` was recorded, are already
+            # here
+            if _id not in self.index.sound_offsets:
+                self.index.append(_id, data)
+
+    def extend(self, sounds):
+        with self._lock.writing():
+            index = self.index
+            index.extend(
+                (_id, data) for _id, data in sounds
+                if _id not in index.sound_offsets)
+
+    def reset(self):
+        with self._lock.writing():
+            self.index.reset()
+
+    def info(self):
+        with self._lock.reading():
+            return self.index.info()
+
+    def get_embedding(self, sound_id, time):
+        with self._lock.reading():
+            # the embedding may be a view of a memory-mapped file
+            return np.array(self.index.get_embedding(sound_id, time))
+
+    def search_batch(self, queries, n_results, threshold, budget):
+        """
+        Search for each query, returning `(distance, result)` pairs ordered
+        by distance, so the coordinator can merge them
+        """
+        with self._lock.reading():
+            batch = self.index.search_batch(
+                queries, n_results=n_results, threshold=threshold, **budget)
+        pairs = []
+        for query, results in zip(queries, batch):
+            if not results:
+                pairs.append([])
+                continue
+            points = np.array([result['point'] for result in results])
+            distances = _cosine_distances(points, query).tolist()
+            pairs.append(sorted(
+                zip(distances, results), key=lambda pair: pair[0]))
+        return pairs
+
+    def export(self, ring):
+        """
+        List the sounds that belong to another shard under `ring`, along with
+        their vectors
+        """
+        with self._lock.reading():
+            return [
+                (_id, np.array(data))
+                for _id, data in self.index.sounds()
+                if ring.shard(_id) != self.shard_id]
+
+    def drop(self, sound_ids):
+        sound_ids = set(sound_ids)
+        with self._lock.writing(), self._save_lock:
+            index = self.index
+            self.index = index.subset(
+                _id for _id in index.ids if _id not in sound_ids)
+
+    def save(self, directory):
+        with self._save_lock:
+            self.index.save(directory)
+
+
+# requests that change a shard, which must run in the order they were sent
+_MUTATIONS = {'append', 'extend', 'reset', 'drop'}
+
+
+def _serve_shard(
+        connection,
+        shard_id,
+        directory,
+        seconds_per_chunk,
+        user_uri,
+        n_threads):
+
+    if directory and os.path.exists(os.path.join(directory, Index.MANIFEST)):
+        index = Index.load(directory, seconds_per_chunk, user_uri)
+    else:
+        index = Index(seconds_per_chunk, user_uri)
+    shard = _Shard(shard_id, index)
+
+    send_lock = threading.Lock()
+    executor = ThreadPoolExecutor(n_threads)
+
+    def run(request_id, method, args):
+        try:
+            response = (request_id, True, getattr(shard, method)(*args))
+        except Exception as e:
+            response = (request_id, False, e)
+        with send_lock:
+            try:
+                connection.send(response)
+            except (OSError, EOFError):
+                pass
+            except Exception as e:
+                # the exception couldn't be pickled
+                connection.send((request_id, False, RuntimeError(str(e))))
+
+    while True:
+        try:
+            request = connection.recv()
+        except (OSError, EOFError):
+            break
+        if request is None:
+            # the coordinator is closing the index
+            break
+        request_id, method, args = request
+        if method in _MUTATIONS:
+            run(request_id, method, args)
+        else:
+            executor.submit(run, request_id, method, args)
+
+    executor.shutdown()
+    connection.close()
+
+
+class _ShardProcess(object):
+    """
+    The coordinator's end of the pipe to a shard's worker process
+    """
+
+    def __init__(
+            self,
+            shard_id,
+            directory,
+            seconds_per_chunk,
+            user_uri,
+            n_threads):
+
+        super().__init__()
+        self.shard_id = shard_id
+        # the coordinator may already be running threads, which forking
+        # doesn't play well with
+        context = multiprocessing.get_context('spawn')
+        self._connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_serve_shard,
+            args=(
+                child_connection,
+                shard_id,
+                directory,
+                seconds_per_chunk,
+                user_uri,
+                n_threads),
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._ids = count()
+        self.closed = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def request(self, method, *args):
+        future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError(f'Shard {self.shard_id} has exited')
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+
+        try:
+            with self._send_lock:
+                self._connection.send((request_id, method, args))
+        except (OSError, EOFError) as e:
+            self._close(e)
+        return future
+
+    def call(self, method, *args):
+        return self.request(method, *args).result()
+
+    def _read(self):
+        try:
+            while True:
+                request_id, ok, value = self._connection.recv()
+                with self._lock:
+                    future = self._futures.pop(request_id)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        except (OSError, EOFError) as e:
+            self._close(e)
+
+    def _close(self, error):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            futures = list(self._futures.values())
+            self._futures.clear()
+
+        logger.error(f'Lost connection to shard {self.shard_id}: {error}')
+        for future in futures:
+            future.set_exception(
+                ConnectionError(f'Shard {self.shard_id} has exited: {error}'))
+
+        try:
+            self._connection.close()
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        try:
+            with self._send_lock:
+                self._connection.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._connection.close()
+
+
+class ShardedIndex(object):
+    """
+    A drop-in replacement for `spatial_index.Index`, which partitions sounds
+    across `n_shards` worker processes.  `shard_ids` names the shards when
+    reopening a persisted index, whose ids needn't be contiguous.
+
+    Search budgets apply to each shard, so a search considers up to
+    `n_shards` times as many candidates as the same search over an `Index`
+    """
+
+    def __init__(
+            self,
+            n_shards,
+            seconds_per_chunk,
+            user_uri,
+            directory=None,
+            n_threads=4,
+            replicas=64,
+            shard_ids=None):
+
+        super().__init__()
+        self.seconds_per_chunk = seconds_per_chunk
+        self.user_uri = user_uri
+        self.n_threads = n_threads
+        self.low_id = None
+
+        self.ring = HashRing(shard_ids or range(n_shards), replicas)
+        self.shards = {
+            shard_id: self._start_shard(shard_id, directory)
+            for shard_id in self.ring.shard_ids}
+
+        # serializes appends and resets with the movement of sounds between
+        # shards
+        self._lock = threading.Lock()
+        # serializes snapshots with the addition of shards
+        self._rebalance_lock = threading.Lock()
+
+    def _start_shard(self, shard_id, directory):
+        return _ShardProcess(
+            shard_id,
+            directory and _shard_directory(directory, shard_id),
+            self.seconds_per_chunk,
+            self.user_uri,
+            self.n_threads)
+
+    @classmethod
+    def load(cls, directory, seconds_per_chunk, user_uri, **kwargs):
+        """
+        Open a sharded index persisted with `save`, starting a worker process
+        for each shard
+        """
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            manifest = json.load(f)
+
+        index = cls(
+            len(manifest['shard_ids']),
+            seconds_per_chunk,
+            user_uri,
+            directory=directory,
+            replicas=manifest['replicas'],
+            shard_ids=manifest['shard_ids'],
+            **kwargs)
+        index.low_id = manifest['low_id']
+        return index
+
+    @classmethod
+    def from_index(cls, index, n_shards, **kwargs):
+        """
+        Partition the sounds of an unsharded `Index`
+        """
+        sharded = cls(
+            n_shards, index.seconds_per_chunk, index.user_uri, **kwargs)
+        by_shard = {shard_id: [] for shard_id in sharded.shards}
+        for _id, data in index.sounds():
+            by_shard[sharded.ring.shard(_id)].append((_id, np.array(data)))
+        sharded._gather({
+            shard_id: sharded.shards[shard_id].request('extend', sounds)
+            for shard_id, sounds in by_shard.items()})
+        sharded.low_id = index.low_id
+        return sharded
+
+    def _shard(self, sound_id):
+        return self.shards[self.ring.shard(sound_id)]
+
+    @staticmethod
+    def _gather(futures):
+        return {key: future.result() for key, future in futures.items()}
+
+    def _scatter(self, method, *args):
+        return self._gather({
+            shard_id: shard.request(method, *args)
+            for shard_id, shard in list(self.shards.items())})
+
+    def info(self):
+        infos = self._scatter('info').values()
+        return {
+            'sounds': sum(info['sounds'] for info in infos),
+            'segments': sum(info['segments'] for info in infos),
+            'shards': len(infos)
+        }
+
+    def shard_info(self):
+        return [
+            dict(info, shard=shard_id)
+            for shard_id, info in sorted(self._scatter('info').items())]
+
+    def reset(self):
+        with self._lock:
+            self._scatter('reset')
+            self.low_id = None
+
+    def append(self, _id, data):
+        with self._lock:
+            self._shard(_id).call('append', _id, data)
+            self.low_id = _id
+
+    def get_embedding(self, sound_id, time):
+        return self._shard(sound_id).call('get_embedding', sound_id, time)
+
+    @staticmethod
+    def _merge(shard_results, n_results):
+        merged = heapq.merge(*shard_results, key=lambda pair: pair[0])
+        # while sounds are moving to a new shard, they may briefly be found
+        # on both
+        seen = set()
+        results = []
+        for _, result in merged:
+            key = (result['sound'], result['start_seconds'])
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(result)
+            if len(results) == n_results:
+                break
+        return results
+
+    def search_batch(self, queries, n_results, threshold=0.001, **budget):
+        """
+        Search every shard for each of `queries`, returning a list of results
+        for each
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        by_shard = self._scatter(
+            'search_batch', queries, n_results, threshold, budget).values()
+        return [
+            self._merge(shard_results, n_results)
+            for shard_results in zip(*by_shard)]
+
+    def search(self, query, n_results, threshold=0.001, **budget):
+        return self.search_batch(
+            query[None, :], n_results, threshold, **budget)[0]
+
+    def add_shard(self):
+        """
+        Start a new, empty shard, and move the sounds it now owns to it from
+        the existing shards
+        """
+        with self._rebalance_lock, self._lock:
+            shard_id = max(self.ring.shard_ids) + 1
+            ring = self.ring.with_shard(shard_id)
+            shard = self._start_shard(shard_id, None)
+
+            exported = self._scatter('export', ring)
+            moved = [sound for sounds in exported.values() for sound in sounds]
+            shard.call('extend', moved)
+
+            # searches may find the moved sounds on both shards until they're
+            # dropped, which `_merge` accounts for
+            self.shards = {**self.shards, shard_id: shard}
+            self.ring = ring
+            self._gather({
+                donor: self.shards[donor].request(
+                    'drop', [_id for _id, _ in sounds])
+                for donor, sounds in exported.items()})
+
+        logger.info(
+            f'Added shard {shard_id}, moving {len(moved)} sounds to it')
+        return shard_id
+
+    def save(self, directory):
+        """
+        Persist every shard, and then the manifest naming them
+        """
+        with self._rebalance_lock:
+            # anything appended after this is recorded is appended again
+            # when the indexer resumes, and ignored by shards that have it
+            low_id = self.low_id
+            ring = self.ring
+            self._gather({
+                shard_id: shard.request(
+                    'save', _shard_directory(directory, shard_id))
+                for shard_id, shard in self.shards.items()})
+            os.makedirs(directory, exist_ok=True)
+            _write_json(os.path.join(directory, MANIFEST), {
+                'version': Index.VERSION,
+                'shard_ids': list(ring.shard_ids),
+                'replicas': ring.replicas,
+                'low_id': low_id
+            })
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
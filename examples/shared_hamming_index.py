@@ -0,0 +1,343 @@
+"""
+A hamming index published as files in a directory, so that any number of
+processes on the same host (e.g., gunicorn workers) can map it read-only and
+search it locally, while a single writer process appends to it.
+
+The directory holds:
+
+- `manifest.json`, describing the codes and the sounds they belong to
+- `codes.{word}.u64`, one append-only file per 64-bit word of the codes
+- `offsets.i64`, the index of the first code of each sound, and `ids.txt`,
+    the newline-delimited id of each sound, both append-only
+- `tables.{generation}/`, the multi-index hashing tables covering the first
+    `n_indexed` codes, rebuilt into a new directory as the index grows
+- `header.i64`, the current counts and table generation, protected by a
+    seqlock.  The writer makes the sequence number odd, updates the counts
+    and then makes it even again, so readers retry whenever the sequence is
+    odd or changes while they read.  A new writer clears the directory and
+    publishes a new header file, rather than reusing the old one, so readers
+    reopen the index whenever the header's inode changes.
+
+Everything a reader can see through the header is written to the files
+before the header is updated, and never changes afterward, so readers never
+need to take a lock shared with the writer
+"""
+import os
+import json
+import shutil
+import threading
+import time
+import numpy as np
+from hamming_index import MultiIndexHammingIndex
+
+HEADER_FIELDS = (
+    'sequence', 'n_codes', 'n_sounds', 'id_bytes', 'generation', 'n_indexed')
+
+
+def _path(directory, filename):
+    return os.path.join(directory, filename)
+
+
+def _append_to_file(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def _map_array(path, dtype, length):
+    # zero-length files can't be mapped
+    if not length:
+        return np.zeros((0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+
+def _tables_directory(directory, generation):
+    return _path(directory, f'tables.{generation}')
+
+
+class HammingIndexWriter(object):
+    """
+    Append codes for one sound at a time to a shared hamming index, clearing
+    anything previously stored in `directory`.  Readers of the cleared index
+    keep searching it until they notice the new header
+    """
+
+    def __init__(
+            self,
+            directory,
+            n_words,
+            seconds_per_code,
+            duration_seconds,
+            user_uri):
+
+        super().__init__()
+        self.directory = directory
+        self.n_words = n_words
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        for word in range(n_words):
+            open(self._codes_path(word), 'wb').close()
+        open(_path(directory, 'offsets.i64'), 'wb').close()
+        open(_path(directory, 'ids.txt'), 'wb').close()
+
+        with open(_path(directory, 'manifest.json'), 'w') as f:
+            json.dump({
+                'n_words': n_words,
+                'seconds_per_code': seconds_per_code,
+                'duration_seconds': duration_seconds,
+                'user_uri': user_uri
+            }, f)
+
+        # the header is published last, and in a single step, so a reader that
+        # finds it also finds the manifest and files it describes
+        header_path = _path(directory, 'header.i64')
+        np.zeros(len(HEADER_FIELDS), dtype=np.int64).tofile(
+            f'{header_path}.tmp')
+        os.replace(f'{header_path}.tmp', header_path)
+        self._header = np.memmap(
+            header_path,
+            dtype=np.int64,
+            mode='r+',
+            shape=(len(HEADER_FIELDS),))
+        self._state = dict.fromkeys(HEADER_FIELDS, 0)
+
+        # used to rebuild the tables over the codes written so far
+        self._index = MultiIndexHammingIndex(n_words, n_threads=1)
+
+    def _codes_path(self, word):
+        return _path(self.directory, f'codes.{word}.u64')
+
+    def _publish(self, **values):
+        header = self._header
+        self._state.update(values)
+        header[0] += 1
+        for i, field in enumerate(HEADER_FIELDS[1:], 1):
+            header[i] = self._state[field]
+        header[0] += 1
+
+    def append(self, sound_id, codes):
+        codes = np.asarray(codes, dtype=np.uint64).reshape(-1, self.n_words)
+        state = self._state
+
+        for word in range(self.n_words):
+            _append_to_file(
+                self._codes_path(word),
+                np.ascontiguousarray(codes[:, word]).tobytes())
+        _append_to_file(
+            _path(self.directory, 'offsets.i64'),
+            np.int64(state['n_codes']).tobytes())
+        encoded_id = f'{sound_id}\n'.encode()
+        _append_to_file(_path(self.directory, 'ids.txt'), encoded_id)
+
+        self._publish(
+            n_codes=state['n_codes'] + len(codes),
+            n_sounds=state['n_sounds'] + 1,
+            id_bytes=state['id_bytes'] + len(encoded_id))
+
+        self._index.attach(
+            [self._map_codes(word) for word in range(self.n_words)],
+            *self._index.tables)
+        if self._index.stale:
+            self._build_tables()
+
+    def _map_codes(self, word):
+        return _map_array(
+            self._codes_path(word), np.uint64, self._state['n_codes'])
+
+    def _build_tables(self):
+        self._index.build()
+        n_indexed, tables = self._index.tables
+
+        generation = self._state['generation'] + 1
+        directory = _tables_directory(self.directory, generation)
+        os.makedirs(directory)
+        for i, (ids, offsets) in enumerate(tables):
+            np.save(_path(directory, f'ids.{i}.npy'), ids)
+            np.save(_path(directory, f'offsets.{i}.npy'), offsets)
+
+        self._publish(generation=generation, n_indexed=n_indexed)
+
+        # readers that have already mapped the previous tables keep them
+        # until they unmap them, even once their files are removed
+        shutil.rmtree(
+            _tables_directory(self.directory, generation - 1),
+            ignore_errors=True)
+
+
+class HammingIndexReader(object):
+    """
+    Search a shared hamming index written by a `HammingIndexWriter`, mapping
+    new codes and tables as they're published
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._open()
+
+    def _header_inode(self):
+        try:
+            return os.stat(_path(self.directory, 'header.i64')).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _open(self):
+        """
+        Map the header of the index currently published in the directory,
+        discarding everything read from any previous index
+        """
+        with open(_path(self.directory, 'header.i64'), 'rb') as f:
+            # the mapping holds the file open, so its inode can't be reused
+            # by a later header while it's mapped
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._header = np.memmap(
+                f, dtype=np.int64, mode='r', shape=(len(HEADER_FIELDS),))
+
+        with open(_path(self.directory, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        self.n_words = manifest['n_words']
+        self.seconds_per_code = manifest['seconds_per_code']
+        self.duration_seconds = manifest['duration_seconds']
+        self.user_uri = manifest['user_uri']
+
+        self._state = None
+        self._ids = []
+        self._sound_offsets = {}
+        self._offsets = np.zeros((0,), dtype=np.int64)
+        self._tables = []
+        self._index = MultiIndexHammingIndex(self.n_words)
+
+    def _read_header(self):
+        header = self._header
+        while True:
+            sequence = int(header[0])
+            if sequence % 2 == 0:
+                values = [int(value) for value in header]
+                if int(header[0]) == sequence:
+                    return dict(zip(HEADER_FIELDS, values))
+            # the writer is mid-update
+            time.sleep(0)
+
+    def _load_tables(self, state):
+        directory = _tables_directory(self.directory, state['generation'])
+        return [
+            (np.load(_path(directory, f'ids.{i}.npy'), mmap_mode='r'),
+             np.load(_path(directory, f'offsets.{i}.npy'), mmap_mode='r'))
+            for i in range(self._index.n_substrings)]
+
+    def refresh(self):
+        """
+        Map any codes and tables published since the last refresh, reopening
+        the index if a new writer has cleared it
+        """
+        with self._lock:
+            if self._header_inode() != self._inode:
+                try:
+                    self._open()
+                except FileNotFoundError:
+                    # the new writer hasn't published its header yet, so keep
+                    # searching the previous index
+                    return
+
+            try:
+                self._refresh()
+            except (FileNotFoundError, ValueError):
+                if self._header_inode() == self._inode:
+                    raise
+                # the index was cleared while it was being read, and will be
+                # reopened on the next refresh
+
+    def _refresh(self):
+        while True:
+            state = self._read_header()
+            if state == self._state:
+                return
+            if self._state \
+                    and state['generation'] == self._state['generation']:
+                tables = self._tables
+                break
+            try:
+                tables = self._load_tables(state) \
+                    if state['generation'] else []
+                break
+            except FileNotFoundError:
+                if self._header_inode() != self._inode:
+                    raise
+                # the tables were replaced after the header was read
+                continue
+
+        with open(_path(self.directory, 'ids.txt'), 'rb') as f:
+            previous_bytes = self._state['id_bytes'] if self._state else 0
+            f.seek(previous_bytes)
+            new_ids = f.read(
+                state['id_bytes'] - previous_bytes).decode().splitlines()
+
+        offsets = _map_array(
+            _path(self.directory, 'offsets.i64'),
+            np.int64,
+            state['n_sounds'])
+        codes = [
+            _map_array(
+                _path(self.directory, f'codes.{word}.u64'),
+                np.uint64,
+                state['n_codes'])
+            for word in range(self.n_words)]
+
+        if self._header_inode() != self._inode:
+            # some of these files may already belong to a new index
+            return
+
+        self._offsets = offsets
+        for i, sound_id in enumerate(new_ids, len(self._ids)):
+            self._sound_offsets[sound_id] = int(offsets[i])
+        self._ids.extend(new_ids)
+
+        self._index.attach(codes, state['n_indexed'], tables)
+        self._tables = tables
+        self._state = state
+
+    def __len__(self):
+        self.refresh()
+        return len(self._index)
+
+    def _get_code(self, sound, seconds):
+        offset = self._sound_offsets[sound]
+        return self._index[offset + int(seconds / self.seconds_per_code)]
+
+    def _transform_indices(self, indices):
+        offsets = self._offsets
+        sound_indices = np.searchsorted(offsets, indices, side='right') - 1
+        for index, sound_index in zip(indices, sound_indices):
+            start = (index - offsets[sound_index]) * self.seconds_per_code
+            yield {
+                'created_by': self.user_uri,
+                'sound': self._ids[sound_index],
+                'start_seconds': float(start),
+                'duration_seconds': self.duration_seconds,
+                'end_seconds': float(start) + self.duration_seconds
+            }
+
+    def search(self, sound, seconds, nresults=10, timeout=None):
+        """
+        Search for segments similar to the one at `seconds` into `sound`.
+        `timeout` is accepted for compatibility with `IndexClient`, but local
+        searches run to completion
+        """
+        self.refresh()
+        code = self._get_code(sound, seconds)
+        indices, _ = self._index.search(code[None, :], nresults)
+        return list(self._transform_indices(indices[0]))
+
+    def search_batch(self, queries, nresults=10):
+        """
+        Search for many sound id and time pairs at once, returning a list of
+        results for each
+        """
+        self.refresh()
+        codes = np.array([
+            self._get_code(query['sound'], query['seconds'])
+            for query in queries])
+        indices, _ = self._index.search(codes, nresults)
+        return [list(self._transform_indices(row)) for row in indices]
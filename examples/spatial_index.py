@@ -0,0 +1,413 @@
+from hyperplane_tree import MultiHyperPlaneTree, GrowableArray
+import numpy as np
+import os
+import json
+import shutil
+import threading
+import time
+from log import module_logger
+
+logger = module_logger(__file__)
+
+
+class Index(object):
+    """
+    A spatial index over embeddings of fixed-length segments of sounds.
+
+    Indexes are persisted to a directory with the following layout, which can
+    be opened by memory-mapping every file, rather than deserializing:
+
+    - `manifest.json` - counts and settings describing the current snapshot.
+      It's always written last and atomically replaced, so the files it
+      names are complete
+    - `vectors.{epoch}.f32` - raw embeddings, one row per segment
+    - `offsets.{epoch}.i64` - the offset of each sound's first segment
+    - `ids.{epoch}.txt` - one sound id per line
+    - `tree.{generation}/` - the flattened trees, as `.npy` files
+
+    The vector, offset and id files are append-only, so each snapshot only
+    writes what's been added since the last one.  The epoch changes only
+    when the index is reset.  The trees are rewritten with each snapshot,
+    into a new generation directory
+    """
+
+    VERSION = 1
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, seconds_per_chunk, user_uri):
+        super().__init__()
+        self.user_uri = user_uri
+        self.seconds_per_chunk = seconds_per_chunk
+        self.tree = None
+        self.ids = None
+        self.offsets = None
+        self.sound_offsets = None
+        self.current_offset = 0
+        self.low_id = None
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._generation = 0
+        self._persisted = (0, 0, 0)
+        self.reset()
+
+    def __setstate__(self, state):
+        # indexes pickled by earlier versions kept offsets in a list
+        offsets = state.pop('offsets')
+        self.__dict__.update(state)
+        self.offsets = GrowableArray(np.array(offsets, dtype=np.int64))
+        self.tree.data = np.asarray(self.tree.data, dtype=np.float32)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._generation = 0
+        self._persisted = (0, 0, 0)
+
+    def info(self):
+        return {
+            'sounds': len(self.ids),
+            'segments': len(self.tree)
+        }
+
+    def reset(self):
+        with self._lock:
+            self.tree = MultiHyperPlaneTree(
+                data=np.zeros((0, 3), dtype=np.float32),
+                smallest_node=1024,
+                n_trees=5)
+            self.ids = []
+            self.offsets = GrowableArray(np.zeros((0,), dtype=np.int64))
+            self.sound_offsets = {}
+            self.current_offset = 0
+            self.low_id = None
+            # start new append-only files, rather than truncating files that
+            # may be memory-mapped by other processes
+            self._epoch += 1
+            self._persisted = (0, 0, 0)
+
+    def append(self, _id, data):
+        with self._lock:
+            self.low_id = _id
+            self.ids.append(_id)
+            self.offsets.extend([self.current_offset])
+            self.sound_offsets[_id] = self.current_offset
+            self.current_offset += len(data)
+            self.tree.append(data.astype(np.float32))
+
+    def extend(self, sounds):
+        """
+        Append many `(_id, data)` pairs at once, adding all of their vectors
+        to the tree in a single step
+        """
+        sounds = list(sounds)
+        if not sounds:
+            return
+        with self._lock:
+            for _id, data in sounds:
+                self.low_id = _id
+                self.ids.append(_id)
+                self.offsets.extend([self.current_offset])
+                self.sound_offsets[_id] = self.current_offset
+                self.current_offset += len(data)
+            self.tree.append(np.concatenate(
+                [data for _, data in sounds]).astype(np.float32))
+
+    def sounds(self):
+        """
+        Yield the id and vectors of each sound, in the order they were
+        appended
+        """
+        offsets = self.offsets.view
+        ends = np.append(offsets[1:], self.current_offset)
+        data = self.tree.data
+        for _id, start, end in zip(self.ids, offsets, ends):
+            yield _id, data[start:end]
+
+    def subset(self, sound_ids):
+        """
+        Build a new index holding only the sounds in `sound_ids`.  When saved,
+        it starts new append-only files rather than sharing this index's files
+        """
+        sound_ids = set(sound_ids)
+        index = Index(self.seconds_per_chunk, self.user_uri)
+        # reset() has already advanced the new index's epoch by one
+        index._epoch += self._epoch
+        index._generation = self._generation
+        index.extend(
+            (_id, data) for _id, data in self.sounds() if _id in sound_ids)
+        index.low_id = self.low_id
+        return index
+
+    @staticmethod
+    def _append_to_file(path, persisted_bytes, data):
+        """
+        Write `data` to the end of the first `persisted_bytes` of a file,
+        discarding anything written by a snapshot that never completed
+        """
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.truncate(persisted_bytes)
+            f.seek(persisted_bytes)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return persisted_bytes + len(data)
+
+    @staticmethod
+    def _write_json(path, data):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _snapshot(self):
+        n_sounds, vector_bytes, _ = self._persisted
+        n_vectors = len(self.tree)
+        persisted_vectors = vector_bytes // (self.tree.dimensions * 4)
+        return {
+            'epoch': self._epoch,
+            'persisted': self._persisted,
+            'n_sounds': len(self.ids),
+            'n_vectors': n_vectors,
+            'low_id': self.low_id,
+            # these are views of the region before the current end of each
+            # array, which appends never write to
+            'vectors': self.tree.data[persisted_vectors:n_vectors],
+            'offsets': self.offsets.view,
+            'ids': self.ids[n_sounds:],
+            'tree': self.tree.to_arrays(),
+            'smallest_node': self.tree.smallest_node,
+            'n_trees': self.tree.n_trees,
+            'dimensions': self.tree.dimensions
+        }
+
+    def save(self, directory):
+        """
+        Persist everything appended since the last call to `save`.  The
+        saved vectors are then memory-mapped, so that only those appended
+        since are held in memory
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            snapshot = self._snapshot()
+            self._generation += 1
+            generation = self._generation
+
+        epoch = snapshot['epoch']
+        n_sounds, vector_bytes, id_bytes = snapshot['persisted']
+        vectors_path = os.path.join(directory, f'vectors.{epoch}.f32')
+
+        vector_bytes = self._append_to_file(
+            vectors_path, vector_bytes, snapshot['vectors'].tobytes())
+        self._append_to_file(
+            os.path.join(directory, f'offsets.{epoch}.i64'),
+            n_sounds * 8,
+            snapshot['offsets'][n_sounds:].tobytes())
+        id_bytes = self._append_to_file(
+            os.path.join(directory, f'ids.{epoch}.txt'),
+            id_bytes,
+            ''.join(f'{_id}\n' for _id in snapshot['ids']).encode())
+
+        tree_directory = os.path.join(directory, f'tree.{generation}')
+        os.makedirs(tree_directory, exist_ok=True)
+        for name, arr in snapshot['tree'].items():
+            with open(os.path.join(tree_directory, f'{name}.npy'), 'wb') as f:
+                np.save(f, arr)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._write_json(os.path.join(directory, self.MANIFEST), {
+            'version': self.VERSION,
+            'epoch': epoch,
+            'generation': generation,
+            'n_sounds': snapshot['n_sounds'],
+            'n_vectors': snapshot['n_vectors'],
+            'vector_bytes': vector_bytes,
+            'id_bytes': id_bytes,
+            'low_id': snapshot['low_id'],
+            'dimensions': snapshot['dimensions'],
+            'smallest_node': snapshot['smallest_node'],
+            'n_trees': snapshot['n_trees']
+        })
+
+        vectors = self._map_vectors(
+            vectors_path, snapshot['n_vectors'], snapshot['dimensions'])
+
+        with self._lock:
+            if self._epoch == epoch:
+                self._persisted = (
+                    snapshot['n_sounds'], vector_bytes, id_bytes)
+                self.tree.remap(vectors)
+
+        self._remove_stale_files(directory, epoch, generation)
+
+    @staticmethod
+    def _remove_stale_files(directory, epoch, generation):
+        current = {
+            f'vectors.{epoch}.f32',
+            f'offsets.{epoch}.i64',
+            f'ids.{epoch}.txt',
+            f'tree.{generation}',
+            Index.MANIFEST
+        }
+        for name in os.listdir(directory):
+            if name in current or name.endswith('.tmp'):
+                continue
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    @staticmethod
+    def _map_vectors(path, n_vectors, dimensions):
+        if not n_vectors:
+            # empty files can't be memory-mapped
+            return np.zeros((0, dimensions), dtype=np.float32)
+        return np.memmap(
+            path, dtype=np.float32, mode='r', shape=(n_vectors, dimensions))
+
+    @staticmethod
+    def _load_array(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except ValueError:
+            # empty arrays can't be memory-mapped
+            return np.load(path)
+
+    @classmethod
+    def load(cls, directory, seconds_per_chunk, user_uri):
+        """
+        Open an index persisted with `save`.  Vectors and trees are
+        memory-mapped read-only, so opening is fast regardless of the size of
+        the index and pages are shared by every process that opens it.
+        Anything appended afterward is held in memory until the next `save`
+        """
+        with open(os.path.join(directory, cls.MANIFEST), 'r') as f:
+            manifest = json.load(f)
+
+        epoch = manifest['epoch']
+        n_sounds = manifest['n_sounds']
+        n_vectors = manifest['n_vectors']
+        dimensions = manifest['dimensions']
+
+        vectors = cls._map_vectors(
+            os.path.join(directory, f'vectors.{epoch}.f32'),
+            n_vectors,
+            dimensions)
+
+        offsets = np.fromfile(
+            os.path.join(directory, f'offsets.{epoch}.i64'),
+            dtype=np.int64,
+            count=n_sounds)
+
+        with open(os.path.join(directory, f'ids.{epoch}.txt'), 'rb') as f:
+            ids = f.read(manifest['id_bytes']).decode().splitlines()
+
+        tree_directory = os.path.join(
+            directory, f'tree.{manifest["generation"]}')
+        arrays = {
+            name: cls._load_array(os.path.join(tree_directory, f'{name}.npy'))
+            for name in ('planes', 'children', 'leaf_ranges', 'indices')}
+
+        index = cls(seconds_per_chunk, user_uri)
+        index.tree = MultiHyperPlaneTree.from_arrays(
+            arrays,
+            vectors,
+            smallest_node=manifest['smallest_node'],
+            n_trees=manifest['n_trees'])
+        index.ids = ids
+        index.offsets = GrowableArray(offsets)
+        index.sound_offsets = dict(zip(ids, offsets.tolist()))
+        index.current_offset = n_vectors
+        index.low_id = manifest['low_id']
+        index._epoch = epoch
+        index._generation = manifest['generation']
+        index._persisted = (
+            n_sounds, manifest['vector_bytes'], manifest['id_bytes'])
+        return index
+
+    def get_embedding(self, sound_id, time):
+        segment = int(time / self.seconds_per_chunk)
+        offset = self.sound_offsets[sound_id]
+        embedding_index = segment + offset
+        return self.tree.data[embedding_index]
+
+    def _results(self, indices, vectors):
+        # using the raw indices, find the sound id of each result
+        offsets = self.offsets.view
+        id_indices = np.searchsorted(offsets, indices, side='right') - 1
+        _ids = [self.ids[i] for i in id_indices]
+
+        # find the start offset for each sound id in the result list
+        base_offsets = offsets[id_indices]
+
+        # find the offset in seconds of each result
+        time_offsets = [
+            (i - bo) * self.seconds_per_chunk
+            for (i, bo) in zip(indices, base_offsets)
+            ]
+
+        results = []
+        for _id, time_offset, vector in zip(_ids, time_offsets, vectors):
+            sound_uri = f'/sounds/{_id}'
+            results.append({
+                'created_by': self.user_uri,
+                'sound': sound_uri,
+                'start_seconds': time_offset,
+                'duration_seconds': self.seconds_per_chunk,
+                'end_seconds': time_offset + self.seconds_per_chunk,
+                'point': list(vector.astype(np.float64))
+            })
+
+        return results
+
+    def search(self, query, n_results, threshold=0.001, **budget):
+        """
+        Search for the nearest neighbors of `query`.  `budget` may include
+        `max_candidates`, `max_leaves` and `max_leaves_per_tree`, as
+        understood by `MultiHyperPlaneTree.search_batch`
+        """
+        # get the raw indices from the underlying hyperplane tree along with
+        # associated vectors
+        indices, vectors = self.tree.search_with_priority_queue(
+            query,
+            threshold=threshold,
+            n_results=n_results,
+            return_vectors=True,
+            **budget)
+        return self._results(indices, vectors)
+
+    def search_batch(self, queries, n_results, threshold=0.001, **budget):
+        """
+        Search for many queries at once, returning a list of results for each
+        """
+        return [
+            self._results(indices, vectors)
+            for indices, vectors in self.tree.search_batch(
+                queries,
+                threshold=threshold,
+                n_results=n_results,
+                return_vectors=True,
+                **budget)]
+
+
+class Persistor(threading.Thread):
+    def __init__(self, index, frequency, directory):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.frequency = frequency
+        self.index = index
+
+    def run(self):
+        while True:
+            time.sleep(self.frequency)
+            try:
+                self.index.save(self.directory)
+                info = self.index.info()
+                logger.info(
+                    'Persisted index with {sounds} sounds and {segments} segments'
+                        .format(**info))
+            except Exception as e:
+                logger.error(f'Encountered error persisting index {e}')
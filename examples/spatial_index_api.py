@@ -1,127 +1,29 @@
 import falcon
+from spatial_index import Index, Persistor
+from sharded_index import ShardedIndex
 from hyperplane_tree import MultiHyperPlaneTree
 import numpy as np
 import os
-import threading
 import time
 import pickle
 from log import module_logger
-import datetime
 
 logger = module_logger(__file__)
 
-filename = 'index.dat'
-temp_index_filename = 'index_temp.dat'
+index_directory = 'index'
+# indexes partitioned across worker processes, when `INDEX_SHARDS` is set
+sharded_index_directory = 'sharded_index'
+# snapshots written by earlier versions, which pickled the entire index
+legacy_filename = 'index.dat'
 persistor_frequency = 60 * 5
+max_batch_queries = 1000
+# upper bounds on the results and per-query search budgets that clients may
+# request
+max_nresults = 1000
+max_search_candidates = 100000
 seconds_per_chunk = 0.743038541824
 
 
-class Index(object):
-    def __init__(self, seconds_per_chunk, user_uri):
-        super().__init__()
-        self.user_uri = user_uri
-        self.seconds_per_chunk = seconds_per_chunk
-        self.tree = None
-        self.ids = None
-        self.offsets = None
-        self.sound_offsets = None
-        self.current_offset = 0
-        self.low_id = None
-        self.reset()
-
-    def info(self):
-        return {
-            'sounds': len(self.ids),
-            'segments': len(self.tree)
-        }
-
-    def reset(self):
-        self.tree = MultiHyperPlaneTree(
-            data=np.zeros((0, 3), dtype=np.float32),
-            smallest_node=1024,
-            n_trees=5)
-        self.ids = []
-        self.offsets = []
-        self.sound_offsets = {}
-        self.current_offset = 0
-        self.low_id = None
-
-    def append(self, _id, data):
-        self.low_id = _id
-        self.ids.append(_id)
-        self.offsets.append(self.current_offset)
-        self.sound_offsets[_id] = self.current_offset
-        self.current_offset += len(data)
-        self.tree.append(data.astype(np.float32))
-
-    def get_embedding(self, sound_id, time):
-        segment = int(time / self.seconds_per_chunk)
-        offset = self.sound_offsets[sound_id]
-        embedding_index = segment + offset
-        return self.tree.data[embedding_index]
-
-    def search(self, query, n_results):
-        # get the raw indices from the underlying hyperplane tree along with
-        # associated vectors
-        indices, vectors = self.tree.search_with_priority_queue(
-            query, threshold=0.001, n_results=n_results, return_vectors=True)
-
-        # using the raw indices, find the sound id of each result
-        id_indices = np.searchsorted(
-            self.offsets, indices, side='right') - 1
-        _ids = [self.ids[i] for i in id_indices]
-
-        # find the start offset for each sound id in the result list
-        base_offsets = [self.offsets[i] for i in id_indices]
-
-        # find the offset in seconds of each result
-        time_offsets = [
-            (i - bo) * self.seconds_per_chunk
-            for (i, bo) in zip(indices, base_offsets)
-            ]
-
-        results = []
-        for _id, time_offset, vector in zip(_ids, time_offsets, vectors):
-            sound_uri = f'/sounds/{_id}'
-            results.append({
-                'created_by': self.user_uri,
-                'sound': sound_uri,
-                'start_seconds': time_offset,
-                'duration_seconds': self.seconds_per_chunk,
-                'end_seconds': time_offset + self.seconds_per_chunk,
-                'point': list(vector.astype(np.float64))
-            })
-
-        return results
-
-
-class Persistor(threading.Thread):
-    def __init__(self, index, frequency, filename, temp_filename):
-        super().__init__(daemon=True)
-        self.temp_filename = temp_filename
-        self.filename = filename
-        self.frequency = frequency
-        self.index = index
-
-    def run(self):
-        while True:
-            time.sleep(self.frequency)
-            try:
-                with open(self.temp_filename, 'wb') as f:
-                    pickle.dump(self.index, f, pickle.HIGHEST_PROTOCOL)
-                os.rename(self.temp_filename, self.filename)
-                info = self.index.info()
-                logger.info(
-                    'Persisted index with {sounds} sounds and {segments} segments'
-                        .format(**info))
-            except Exception as e:
-                try:
-                    os.remove(self.temp_filename)
-                except FileNotFoundError:
-                    pass
-                logger.error(f'Encountered error pickling index {e}')
-
-
 class CorsMiddleware(object):
     def process_response(self, req, resp, resource, req_succeeded):
         resp.set_header('Access-Control-Allow-Origin', '*')
@@ -162,17 +64,20 @@ class Resource(object):
         self.index.reset()
         resp.status_code = falcon.HTTP_NO_CONTENT
 
+    def _get_embedding(self, sound_id, time):
+        try:
+            return self.index.get_embedding(sound_id, time)
+        except KeyError:
+            raise falcon.HTTPBadRequest(
+                f'Unindexed sound id {sound_id} specified')
+
     def _get_query(self, req):
         sound_id = req.get_param('sound_id')
         time = req.get_param_as_float('time')
 
         if sound_id is not None:
             # the query was specified as an existing sound id and time
-            try:
-                point = self.index.get_embedding(sound_id, time)
-            except KeyError:
-                raise falcon.HTTPBadRequest(
-                    f'Unindexed sound id {sound_id} specified')
+            point = self._get_embedding(sound_id, time)
         else:
             # the query was specified as a raw embedding
             point = [
@@ -183,18 +88,62 @@ class Resource(object):
 
         return np.array(point, dtype=np.float32)
 
-    def _get_nresults(self, req):
+    def _get_nresults(self, params):
         try:
-            return int(req.params['nresults'])
-        except (KeyError, IndexError):
-            return 100
+            nresults = int(params.get('nresults', 100))
+        except (TypeError, ValueError):
+            nresults = 0
+        if not (1 <= nresults <= max_nresults):
+            raise falcon.HTTPBadRequest(
+                f'nresults must be an integer between 1 and {max_nresults}')
+        return nresults
+
+    def _get_budget(self, params, nresults):
+        """
+        Read optional search budgets from query string parameters or a
+        request body, omitting any that weren't specified so the index's
+        defaults apply.  The exception is the number of candidates, whose
+        default grows with `nresults` and so is capped here like any other
+        requested budget
+        """
+        budget = {
+            'max_candidates': min(
+                nresults * MultiHyperPlaneTree.DEFAULT_CANDIDATES_PER_RESULT,
+                max_search_candidates)
+        }
+
+        for name in ('max_candidates', 'max_leaves', 'max_leaves_per_tree'):
+            if params.get(name) is None:
+                continue
+            try:
+                value = int(params[name])
+            except (TypeError, ValueError):
+                value = 0
+            if not (1 <= value <= max_search_candidates):
+                raise falcon.HTTPBadRequest(
+                    f'{name} must be an integer between '
+                    f'1 and {max_search_candidates}')
+            budget[name] = value
+
+        if params.get('threshold') is not None:
+            try:
+                threshold = float(params['threshold'])
+            except (TypeError, ValueError):
+                threshold = -1
+            if not (0 <= threshold <= 1):
+                raise falcon.HTTPBadRequest(
+                    'threshold must be a number between 0 and 1')
+            budget['threshold'] = threshold
+
+        return budget
 
     @anonymous
     def on_get(self, req, resp):
-        nresults = self._get_nresults(req)
+        nresults = self._get_nresults(req.params)
         query = self._get_query(req)
+        budget = self._get_budget(req.params, nresults)
         start = time.time()
-        results = self.index.search(query, n_results=nresults)
+        results = self.index.search(query, n_results=nresults, **budget)
         resp.media = {
             'query': list(query.astype(np.float64)),
             'items': results,
@@ -202,6 +151,66 @@ class Resource(object):
             'time': time.time() - start
         }
 
+    def _get_batch_query(self, query):
+        if isinstance(query, dict):
+            # the query was specified as an existing sound id and time
+            try:
+                return self._get_embedding(
+                    query['sound_id'], float(query['time']))
+            except (KeyError, TypeError, ValueError):
+                raise falcon.HTTPBadRequest(
+                    'Queries must include a sound_id and time')
+
+        # the query was specified as a raw embedding
+        try:
+            point = np.array(query, dtype=np.float32)
+        except (TypeError, ValueError):
+            point = None
+        if point is None or point.shape != (3,):
+            raise falcon.HTTPBadRequest(
+                'Embedding queries must be a list of three numbers')
+        return point
+
+    @anonymous
+    def on_post(self, req, resp):
+        """
+        Search for many queries in a single request.  Each query is either a
+        raw embedding or an existing sound id and time, e.g.
+
+        {
+            "queries": [[x, y, z], {"sound_id": "...", "time": 1.5}],
+            "nresults": 10
+        }
+
+        The same optional search budgets accepted by `on_get` may be included
+        alongside "nresults"
+        """
+        body = req.media or {}
+        queries = body.get('queries')
+        if not isinstance(queries, list) or not queries:
+            raise falcon.HTTPBadRequest('A list of queries is required')
+        if len(queries) > max_batch_queries:
+            raise falcon.HTTPBadRequest(
+                f'At most {max_batch_queries} queries may be made at once')
+
+        nresults = self._get_nresults(body)
+        budget = self._get_budget(body, nresults)
+
+        queries = np.array(
+            [self._get_batch_query(query) for query in queries],
+            dtype=np.float32)
+        start = time.time()
+        batch = self.index.search_batch(
+            queries, n_results=nresults, **budget)
+        resp.media = {
+            'items': [{
+                'query': list(query.astype(np.float64)),
+                'items': results,
+                'total_count': len(results)
+            } for query, results in zip(queries, batch)],
+            'time': time.time() - start
+        }
+
 
 class CreateResource(object):
     def __init__(self, index):
@@ -223,14 +232,37 @@ class LowIdResource(object):
 
     @anonymous
     def on_get(self, req, resp):
+        info = self.index.info()
         resp.media = {
             'low_id': self.index.low_id,
-            'n_sounds': len(self.index.ids),
-            'n_segments': self.index.current_offset,
-            'n_hours': seconds_per_chunk * self.index.current_offset
+            'n_sounds': info['sounds'],
+            'n_segments': info['segments'],
+            'n_hours': seconds_per_chunk * info['segments']
         }
 
 
+class ShardsResource(object):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    @anonymous
+    def on_get(self, req, resp):
+        try:
+            shards = self.index.shard_info()
+        except AttributeError:
+            raise falcon.HTTPNotFound()
+        resp.media = {'items': shards, 'total_count': len(shards)}
+
+    def on_post(self, req, resp):
+        try:
+            add_shard = self.index.add_shard
+        except AttributeError:
+            raise falcon.HTTPNotFound()
+        resp.media = {'shard': add_shard()}
+        resp.status_code = falcon.HTTP_CREATED
+
+
 class Application(falcon.API):
     def __init__(self, index, access_key):
         super().__init__(
@@ -238,19 +270,45 @@ class Application(falcon.API):
         self.add_route('/', Resource(index))
         self.add_route('/{sound_id}', CreateResource(index))
         self.add_route('/low_id', LowIdResource(index))
+        self.add_route('/shards', ShardsResource(index))
 
 
 access_key = os.environ['ACCESS_KEY']
 user_uri = os.environ['USER_URI']
 
-try:
-    with open(filename, 'rb') as f:
-        index = pickle.load(f)
-except IOError:
-    index = Index(seconds_per_chunk, user_uri)
-
-persistor = Persistor(
-    index, persistor_frequency, filename, temp_index_filename)
+n_shards = int(os.environ.get('INDEX_SHARDS', 0))
+
+
+def load_index():
+    try:
+        return Index.load(index_directory, seconds_per_chunk, user_uri)
+    except FileNotFoundError:
+        pass
+    try:
+        with open(legacy_filename, 'rb') as f:
+            index = pickle.load(f)
+        index.save(index_directory)
+        logger.info(f'Migrated {legacy_filename} to {index_directory}')
+        return index
+    except IOError:
+        return Index(seconds_per_chunk, user_uri)
+
+
+if n_shards:
+    persisted_directory = sharded_index_directory
+    try:
+        # once persisted, the number of shards changes only as shards are
+        # added through the API
+        index = ShardedIndex.load(
+            sharded_index_directory, seconds_per_chunk, user_uri)
+    except FileNotFoundError:
+        index = ShardedIndex.from_index(load_index(), n_shards)
+        logger.info(f'Partitioned index across {n_shards} shards')
+else:
+    persisted_directory = index_directory
+    index = load_index()
+
+persistor = Persistor(index, persistor_frequency, persisted_directory)
 persistor.start()
 
 api = application = Application(index, access_key)
@@ -1,4 +1,3 @@
-import requests
 import zounds
 from io import BytesIO
 from bot_helper import BinaryData, main, SoundListener
@@ -15,46 +14,32 @@ windowing_sample_rate = zounds.SampleRate(
     duration=FILTER_BANK_KERNEL_SIZE * SAMPLE_RATE.frequency)
 
 
-class FFTListener(SoundListener):
-    def __init__(self, client, s3_client, page_size=3, logger=None):
-        super().__init__(client, s3_client, page_size, logger)
+def stft(samples):
+    samples = samples.mono
+    samples = zounds.soundfile.resample(samples, SAMPLE_RATE)
 
-    def _process_samples(self, samples):
-        samples = samples.mono
-        samples = zounds.soundfile.resample(samples, SAMPLE_RATE)
+    spec = zounds.spectral.stft(samples, windowing_sample_rate)
+    dims = spec.dimensions
+    spec = np.abs(spec)
+    spec = spec.astype(np.float32)
+    spec = zounds.ArrayWithUnits(spec, dims)
+    binary_data = BinaryData(spec)
+    return binary_data
 
-        spec = zounds.spectral.stft(samples, windowing_sample_rate)
-        dims = spec.dimensions
-        spec = np.abs(spec)
-        spec = spec.astype(np.float32)
-        spec = zounds.ArrayWithUnits(spec, dims)
-        binary_data = BinaryData(spec)
-        return binary_data
 
-    def _process_sound(self, sound):
-        # fetch audio
-        resp = requests.get(sound['audio_url'])
-        raw_audio = BytesIO(resp.content)
+def compute_stft(raw_audio):
+    samples = zounds.AudioSamples.from_file(BytesIO(raw_audio))
+    return stft(samples).packed_format()
 
-        # processing pipeline to compute spectrograms
-        samples = zounds.AudioSamples.from_file(raw_audio)
 
-        binary_data = self._process_samples(samples)
+class FFTListener(SoundListener):
+    compute = staticmethod(compute_stft)
 
-        # push output to s3
-        data_url = self.s3_client.put_object(
-            sound['id'],
-            binary_data.packed_file_like_object(),
-            'application/octet-stream')
-        logger.info(f'pushed binary data to {data_url}')
+    def __init__(self, client, s3_client, page_size=3, logger=None):
+        super().__init__(client, s3_client, page_size, logger)
 
-        # create annotation
-        self.client.create_annotations(sound['id'], {
-            'start_seconds': 0,
-            'duration_seconds': sound['duration_seconds'],
-            'data_url': data_url
-        })
-        logger.info('created annotation')
+    def _process_samples(self, samples):
+        return stft(samples)
 
 
 if __name__ == '__main__':
@@ -359,15 +359,41 @@ const decodeBase64EncodedTimeValue = (s, unit) => {
   return value / timeFactor;
 };
 
-const unpackFeatureData = (data) => {
+const FEATURE_MAGIC = 'FEAT';
+const FEATURE_ALIGNMENT = 64;
+
+// Read the JSON header of packed feature data, returning it along with the
+// byte offset where array data begins.  Data written before the versioned
+// format existed begins with the header length and has no magic bytes.
+const unpackFeatureHeader = (data) => {
   const view = new DataView(data);
-  const byteView = new Uint8Array(data);
-  const length = new Uint32Array(data, 0, 4)[0];
+  const magic = String.fromCharCode.apply(null, new Uint8Array(data, 0, 4));
+
+  let headerStart, headerLength, dataOffset;
+  if(magic === FEATURE_MAGIC) {
+    headerLength = view.getUint32(8, true);
+    headerStart = 12;
+    const headerEnd = headerStart + headerLength;
+    dataOffset =
+      Math.ceil(headerEnd / FEATURE_ALIGNMENT) * FEATURE_ALIGNMENT;
+  } else {
+    headerLength = view.getUint32(0, true);
+    headerStart = 4;
+    dataOffset = headerStart + headerLength;
+  }
+
+  const rawMetadata = new TextDecoder().decode(
+    new Uint8Array(data, headerStart, headerLength));
+  return [JSON.parse(rawMetadata), dataOffset];
+};
+
+const unpackFeatureData = (data) => {
+  const [metadata, dataOffset] = unpackFeatureHeader(data);
 
-  // TODO: Should I use TextDecoder here?
-  const rawMetadata = String.fromCharCode.apply(
-    null, new Uint8Array(data, 4, length));
-  const metadata = JSON.parse(rawMetadata);
+  if(metadata.compression) {
+    throw new Error(
+      `Compressed feature data (${metadata.compression}) is not supported`);
+  }
 
   // Decode the sample frequency and duration of the first time dimension
   const timeDimension = metadata.dimensions[0];
@@ -379,7 +405,11 @@ const unpackFeatureData = (data) => {
 
   // TODO: Array type should be dictated by metadata and not
   // hard-coded
-  const rawFeatures = new Float32Array(byteView.slice(4 + length).buffer);
+  const length = metadata.shape.reduce((x, y) => x * y, 1);
+  const rawFeatures = dataOffset % Float32Array.BYTES_PER_ELEMENT === 0
+    // aligned data can be viewed in place
+    ? new Float32Array(data, dataOffset, length)
+    : new Float32Array(data.slice(dataOffset));
   return featureData = new FeatureData(
     rawFeatures,
     metadata.shape,
@@ -131,10 +131,18 @@ class BaseTests(object):
     def user_annotations_resource(cls, user_id=''):
         return cls.url(f'/users/{user_id}/annotations')
 
+    @classmethod
+    def user_annotations_by_sound_resource(cls, user_id=''):
+        return cls.url(f'/users/{user_id}/annotations/by_sound')
+
     @classmethod
     def sound_annotations_resource(cls, sound_id=''):
         return cls.url(f'/sounds/{sound_id}/annotations')
 
+    @classmethod
+    def sound_annotation_summary_resource(cls, sound_id=''):
+        return cls.url(f'/sounds/{sound_id}/annotations/summary')
+
     @classmethod
     def annotations_resource(cls):
         return cls.url('/annotations')
@@ -721,6 +729,60 @@ class SoundTests(BaseTests, unittest2.TestCase):
         self.assertEqual(client.CONFLICT, resp.status_code)
         self.assertEqual(expected_location, resp.headers['location'])
 
+    def test_can_create_sounds_in_batch(self):
+        user1, user1_location = self.create_user(user_type='dataset')
+        auth = self._get_auth(user1)
+        sounds = [
+            self.sound_data(audio_url=f'https://example.com/{i}.wav')
+            for i in range(3)]
+        resp = requests.post(
+            self.sounds_resource('batch'), json={'sounds': sounds}, auth=auth)
+        self.assertEqual(client.OK, resp.status_code)
+        items = resp.json()['items']
+        self.assertEqual(3, len(items))
+        self.assertTrue(all(item['status'] == 'created' for item in items))
+        sound_resp = requests.get(self.url(items[1]['uri']), auth=auth)
+        self.assertEqual(client.OK, sound_resp.status_code)
+        self.assertEqual(
+            sounds[1]['audio_url'], sound_resp.json()['audio_url'])
+
+    def test_batch_returns_existing_sounds_rather_than_conflict(self):
+        user1, user1_location = self.create_user(user_type='dataset')
+        auth = self._get_auth(user1)
+        existing = self.sound_data(audio_url='https://example.com/0.wav')
+        resp = requests.post(self.sounds_resource(), json=existing, auth=auth)
+        self.assertEqual(client.CREATED, resp.status_code)
+        existing_uri = resp.headers['location']
+
+        sounds = [
+            existing,
+            self.sound_data(audio_url='https://example.com/1.wav'),
+            self.sound_data(audio_url='https://example.com/1.wav')]
+        resp = requests.post(
+            self.sounds_resource('batch'), json={'sounds': sounds}, auth=auth)
+        self.assertEqual(client.OK, resp.status_code)
+        items = resp.json()['items']
+        self.assertEqual(
+            ['existing', 'created', 'existing'],
+            [item['status'] for item in items])
+        self.assertEqual(existing_uri, items[0]['uri'])
+        self.assertEqual(items[1]['uri'], items[2]['uri'])
+
+    def test_bad_request_for_empty_sound_batch(self):
+        user1, user1_location = self.create_user(user_type='dataset')
+        auth = self._get_auth(user1)
+        resp = requests.post(
+            self.sounds_resource('batch'), json={'sounds': []}, auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
+    def test_bad_request_for_malformed_sound_in_batch(self):
+        user1, user1_location = self.create_user(user_type='dataset')
+        auth = self._get_auth(user1)
+        sounds = [self.sound_data(), 'https://example.com/1.wav']
+        resp = requests.post(
+            self.sounds_resource('batch'), json={'sounds': sounds}, auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
     def test_featurebot_cannot_create_sound(self):
         user1, user1_location = self.create_user(user_type='featurebot')
         auth = self._get_auth(user1)
@@ -1169,6 +1231,33 @@ class UserAnnotationTests(BaseTests, unittest2.TestCase):
         self.assertEqual(3, len(items))
         self.assertTrue(all([item['created_by'] == user_uri for item in items]))
 
+    def test_can_list_sounds_annotated_by_user(self):
+        user, user_location = self.create_user(user_type='dataset')
+        auth = self._get_auth(user)
+        sound_ids = [self._create_sound_with_user(auth) for _ in range(2)]
+
+        fb, fb_location = self.create_user(user_type='featurebot')
+        fb_auth = self._get_auth(fb)
+        fb_id = fb_location.split('/')[-1]
+        for i, sound_id in enumerate(sound_ids):
+            annotation_data = [
+                self.annotation_data(start_seconds=j, duration_seconds=1)
+                for j in range(i + 1)]
+            requests.post(
+                self.sound_annotations_resource(sound_id),
+                json={'annotations': annotation_data},
+                auth=fb_auth)
+
+        resp = requests.get(
+            self.user_annotations_by_sound_resource(fb_id),
+            auth=auth)
+        self.assertEqual(client.OK, resp.status_code)
+        data = resp.json()
+        self.assertEqual(2, data['total_count'])
+        counts = {item['sound']: item['count'] for item in data['items']}
+        self.assertEqual(1, counts[f'/sounds/{sound_ids[0]}'])
+        self.assertEqual(2, counts[f'/sounds/{sound_ids[1]}'])
+
     def test_can_stream_user_annotations_using_low_id(self):
         user, user_location = self.create_user(user_type='dataset')
         auth = self._get_auth(user)
@@ -1585,6 +1674,91 @@ class AnnotationTests(BaseTests, unittest2.TestCase):
         items = resp.json()['items']
         self.assertEqual(4, len(items))
 
+    def test_can_summarize_annotations_for_a_sound(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        annotation_data = [
+            self.annotation_data(
+                start_seconds=0, duration_seconds=10, tags=['drums']),
+            self.annotation_data(
+                start_seconds=1, duration_seconds=1, tags=['snare']),
+            self.annotation_data(
+                start_seconds=5, duration_seconds=1, tags=['snare'])
+        ]
+        requests.post(
+            self.sound_annotations_resource(sound_id),
+            json={'annotations': annotation_data},
+            auth=auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'time_range': '0-12', 'bucket_seconds': 4},
+            auth=auth)
+        self.assertEqual(client.OK, resp.status_code)
+        buckets = resp.json()['buckets']
+        self.assertEqual([2, 2, 1], [b['count'] for b in buckets])
+        self.assertEqual({'drums': 1, 'snare': 1}, buckets[0]['tags'])
+        self.assertEqual({user_location: 2}, buckets[0]['created_by'])
+
+    def test_bad_request_for_unsupported_summary_bucket_width(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'bucket_seconds': 3},
+            auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
+    def test_bad_request_for_non_finite_summary_time_range(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'time_range': '0-inf'},
+            auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
+    def test_bad_request_for_inverted_summary_time_range(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'time_range': '10-5'},
+            auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
+    def test_summary_time_range_is_clamped_to_sound_duration(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'time_range': '0-1000000000000', 'bucket_seconds': 64},
+            auth=auth)
+        self.assertEqual(client.OK, resp.status_code)
+
+    def test_bad_request_when_summary_exceeds_max_buckets(self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        sound_id = self._create_sound_with_user(auth)
+        resp = requests.get(
+            self.sound_annotation_summary_resource(sound_id),
+            params={'bucket_seconds': 1, 'max_buckets': 2},
+            auth=auth)
+        self.assertEqual(client.BAD_REQUEST, resp.status_code)
+
+    def test_not_found_when_summarizing_annotations_for_nonexistent_sound(
+            self):
+        user, user_location = self.create_user(user_type='human')
+        auth = self._get_auth(user)
+        resp = requests.get(
+            self.sound_annotation_summary_resource('WRONG'),
+            auth=auth)
+        self.assertEqual(client.NOT_FOUND, resp.status_code)
+
     def test_not_found_when_listing_annotations_for_nonexistent_sound(self):
         user, user_location = self.create_user(user_type='human')
         auth = self._get_auth(user)